@@ -0,0 +1,87 @@
+"""
+Compare two result files written by run_benchmarks.py, e.g., the results of two commits.
+
+For every pipeline benchmarked in both files, prints the median of every metric in both files and the relative
+change. Time, memory and thread metrics growing by more than the threshold are reported as regressions, and
+--fail-on-regression makes the script exit with status 1 if there is any, so it can gate a CI job:
+    python benchmarks/compare.py results/baseline.json results/candidate.json --threshold 0.1 --fail-on-regression
+"""
+
+import json
+import sys
+from argparse import ArgumentParser
+
+REGRESSION_METRICS = ("wall_time", "cpu_time", "peak_rss_mb", "peak_threads")
+
+
+def is_regression_metric(metric: str) -> bool:
+    """Larger values of time, memory and thread metrics are worse; token and request counts are only reported."""
+    return metric in REGRESSION_METRICS or metric.startswith(
+        ("stage_time.", "pipeline_stage_time.")
+    )
+
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> list[str]:
+    regressions = []
+    for pipeline, candidate_result in candidate["benchmarks"].items():
+        if pipeline not in baseline["benchmarks"]:
+            continue
+        baseline_median = baseline["benchmarks"][pipeline]["median"]
+        candidate_median = candidate_result["median"]
+        print(f"***** {pipeline} *****")
+        print(f"{'metric':<70} {'baseline':>12} {'candidate':>12} {'change':>8}")
+        for metric in sorted(set(baseline_median) | set(candidate_median)):
+            old = baseline_median.get(metric)
+            new = candidate_median.get(metric)
+            if old is None or new is None:
+                print(f"{metric:<70} {str(old):>12} {str(new):>12} {'':>8}")
+                continue
+            change = (new - old) / old if old else 0.0
+            flag = ""
+            if is_regression_metric(metric) and change > threshold:
+                flag = " REGRESSION"
+                regressions.append(f"{pipeline}: {metric} {old:.4g} -> {new:.4g}")
+            print(f"{metric:<70} {old:>12.4g} {new:>12.4g} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    print(
+        f"Baseline: {baseline['metadata'].get('git_commit')} ({baseline['metadata'].get('timestamp')})\n"
+        f"Candidate: {candidate['metadata'].get('git_commit')} ({candidate['metadata'].get('timestamp')})"
+    )
+    regressions = compare(baseline, candidate, args.threshold)
+    if regressions:
+        print(
+            f"***** {len(regressions)} regression(s) above {args.threshold:.0%} *****"
+        )
+        for regression in regressions:
+            print(regression)
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "baseline", type=str, help="Result file of the baseline, e.g., the main branch."
+    )
+    parser.add_argument(
+        "candidate", type=str, help="Result file to compare against the baseline."
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative increase of a time, memory or thread metric reported as a regression.",
+    )
+    parser.add_argument(
+        "--fail-on-regression",
+        action="store_true",
+        help="Exit with status 1 if there is any regression.",
+    )
+    main(parser.parse_args())
@@ -0,0 +1,99 @@
+"""
+Resource measurements and result helpers shared by the benchmark scripts.
+"""
+
+import resource
+import statistics
+import threading
+import time
+from typing import Optional
+
+
+def _read_proc_status() -> dict:
+    """Read the resident set size (in MB) and the OS thread count of the process from /proc (Linux only)."""
+    status = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    status["rss_mb"] = int(line.split()[1]) / 1024
+                elif line.startswith("Threads:"):
+                    status["threads"] = int(line.split()[1])
+    except OSError:
+        pass
+    return status
+
+
+class ResourceMonitor:
+    """Context manager measuring the wall time, CPU time, peak RSS and peak thread count of a block of code.
+
+    Peak RSS and thread count are sampled every `interval` seconds from /proc. Where /proc is not available,
+    the peak RSS of the whole process lifetime and the number of Python threads are reported instead.
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.result: Optional[dict] = None
+        self._stop = threading.Event()
+        self._peak_rss_mb = 0.0
+        self._peak_threads = 0
+
+    def _sample(self):
+        status = _read_proc_status()
+        self._peak_rss_mb = max(
+            self._peak_rss_mb,
+            status.get(
+                "rss_mb", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            ),
+        )
+        self._peak_threads = max(
+            self._peak_threads, status.get("threads", threading.active_count())
+        )
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._sampler = threading.Thread(target=self._run, daemon=True)
+        self._sampler.start()
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall_time = time.perf_counter() - self._start_wall
+        cpu_time = time.process_time() - self._start_cpu
+        self._stop.set()
+        self._sampler.join()
+        self._sample()
+        self.result = {
+            "wall_time": wall_time,
+            "cpu_time": cpu_time,
+            "peak_rss_mb": self._peak_rss_mb,
+            # The sampler thread itself is not part of the measured code.
+            "peak_threads": self._peak_threads - 1,
+        }
+
+
+def flatten_metrics(data: dict, prefix: str = "") -> dict:
+    """Flatten nested dicts into {"a.b.c": number}, dropping non-numeric values."""
+    flat = {}
+    for k, v in data.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            flat.update(flatten_metrics(v, prefix=f"{key}."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            flat[key] = v
+    return flat
+
+
+def median_metrics(runs: list[dict]) -> dict:
+    """Get the median of every numeric metric over several runs of a benchmark."""
+    flat_runs = [flatten_metrics(run) for run in runs]
+    keys = sorted(set().union(*flat_runs))
+    return {
+        key: statistics.median(run[key] for run in flat_runs if key in run)
+        for key in keys
+    }
@@ -0,0 +1,552 @@
+"""
+Local mock servers used by the benchmarks.
+
+`MockAPIServer` serves, from a single local port:
+    - /v1/chat/completions, /v1/completions: OpenAI-compatible LM API (including streaming)
+    - /v1/embeddings: OpenAI-compatible embedding API (used when ENCODER_API_TYPE=openai)
+    - /search: SearXNG-compatible search API, returning links to /page/<id>
+    - /page/<id>: HTML pages with deterministic content and ETags (answering If-None-Match with 304)
+    - /stats: request and token counts since the previous call to /stats
+
+The benchmarks start it in a separate process (`MockServerProcess`) so that its threads and CPU time are not
+counted as part of the measured pipeline. It can also be started by hand:
+    python benchmarks/mock_servers.py --port 8000 --lm-latency-median 1.0 --lm-latency-sigma 0.5
+
+Latencies are drawn from log-normal distributions with a random generator seeded by the request and its
+occurrence, so a benchmark run sees the same latencies regardless of thread scheduling. The server only depends
+on the standard library so that it starts quickly and does not load `knowledge_storm`.
+"""
+
+import hashlib
+import json
+import math
+import random
+import subprocess
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+from urllib.parse import parse_qs, urlparse
+from urllib.request import urlopen
+
+# Maps a seeded random generator to a latency in seconds.
+LatencyModel = Callable[[random.Random], float]
+
+# Responses keyed by the end of the prompt (dspy prompts end with the prefix of the field to generate). Prompts
+# matching none of them get GENERIC_RESPONSE, which parses as personas/experts ("1. name: description"),
+# search queries ("- query"), outlines ("# heading") and cited text at the same time.
+PROMPT_SUFFIX_RESPONSES = {
+    "Choice:": "insert",
+}
+GENERIC_RESPONSE = """1. Analyst: Focuses on the key facts and figures of the topic.
+2. Historian: Focuses on the origins and development of the topic.
+- overview of the topic
+- recent developments of the topic
+# Overview
+The topic has been studied extensively and several sources describe its main aspects [1].
+## Background
+Its background is documented by multiple independent sources [2].
+## Recent developments
+Recent reports discuss how the topic evolved over the last years [1][3]."""
+
+PARAGRAPH = (
+    "This page provides background information about {query}. It summarizes the main facts, the history "
+    "and the recent developments reported by several independent sources, and discusses their implications."
+)
+
+
+def _count_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def make_latency(median: float, sigma: float = 0.0) -> LatencyModel:
+    """Log-normal latency model; a `sigma` of 0 gives a constant latency."""
+    if sigma > 0:
+        return lambda rng: rng.lognormvariate(math.log(median), sigma)
+    return lambda rng: median
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients give up on requests, e.g., when a download deadline is reached.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class MockAPIServer:
+    """Local HTTP server mimicking an OpenAI-compatible LM API and a SearXNG search API.
+
+    Args:
+        lm_latency: Latency model of the time to first token of LM requests.
+        tokens_per_second: Generation speed added on top of `lm_latency` per completion token.
+        embedding_latency: Latency model of embedding requests.
+        search_latency: Latency model of search requests.
+        page_latency: Latency model of page downloads.
+        num_search_results: Number of results returned per search.
+        embedding_dim: Dimension of the returned embeddings.
+        seed: Seed of the latency models.
+        port: Port to listen on; 0 picks a free port.
+    """
+
+    def __init__(
+        self,
+        lm_latency: LatencyModel = make_latency(1.0, 0.5),
+        tokens_per_second: float = 100.0,
+        embedding_latency: LatencyModel = make_latency(0.05),
+        search_latency: LatencyModel = make_latency(0.5, 0.3),
+        page_latency: LatencyModel = make_latency(0.1),
+        num_search_results: int = 5,
+        embedding_dim: int = 256,
+        seed: int = 0,
+        port: int = 0,
+    ):
+        self.lm_latency = lm_latency
+        self.tokens_per_second = tokens_per_second
+        self.embedding_latency = embedding_latency
+        self.search_latency = search_latency
+        self.page_latency = page_latency
+        self.num_search_results = num_search_results
+        self.embedding_dim = embedding_dim
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._occurrences = {}
+        self._stats = self._empty_stats()
+        self._httpd = _HTTPServer(("127.0.0.1", port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _empty_stats() -> dict:
+        return {
+            "lm_requests": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "embedding_requests": 0,
+            "embedding_tokens": 0,
+            "search_requests": 0,
+            "page_requests": 0,
+            "page_not_modified": 0,
+        }
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def lm_api_base(self) -> str:
+        # The trailing slash matters: the openai module appends endpoint paths to it as is.
+        return f"{self.url}/v1/"
+
+    @property
+    def search_url(self) -> str:
+        return f"{self.url}/search"
+
+    def start(self) -> "MockAPIServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def get_stats_and_reset(self) -> dict:
+        with self._lock:
+            stats = self._stats
+            self._stats = self._empty_stats()
+        return stats
+
+    def _log(self, **counts):
+        with self._lock:
+            for k, v in counts.items():
+                self._stats[k] += v
+
+    def _sample_latency(self, latency: LatencyModel, request_key: str) -> float:
+        with self._lock:
+            occurrence = self._occurrences.get(request_key, 0)
+            self._occurrences[request_key] = occurrence + 1
+        rng = random.Random(f"{self.seed}:{request_key}:{occurrence}")
+        return max(0.0, latency(rng))
+
+    @staticmethod
+    def _get_response_text(prompt: str, max_tokens: Optional[int]) -> tuple[str, str]:
+        text = GENERIC_RESPONSE
+        for suffix, response in PROMPT_SUFFIX_RESPONSES.items():
+            if prompt.rstrip().endswith(suffix):
+                text = response
+                break
+        if max_tokens is not None and _count_tokens(text) > max_tokens:
+            return text[: max_tokens * 4], "length"
+        return text, "stop"
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep connections alive so that the connection pools of the clients are exercised.
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(
+                self,
+                status: int,
+                body: bytes,
+                content_type: str,
+                headers: Optional[dict] = None,
+            ):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_json(self, data: dict):
+                self._send(200, json.dumps(data).encode("utf-8"), "application/json")
+
+            def _read_json(self) -> tuple[dict, str]:
+                raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                return json.loads(raw or b"{}"), hashlib.sha256(raw).hexdigest()
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                if path.endswith("/chat/completions"):
+                    self._completions(chat=True)
+                elif path.endswith("/completions"):
+                    self._completions(chat=False)
+                elif path.endswith("/embeddings"):
+                    self._embeddings()
+                else:
+                    self._send(404, b"Not found", "text/plain")
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                if parsed.path == "/stats":
+                    self._send_json(server.get_stats_and_reset())
+                elif parsed.path == "/search":
+                    self._search(parse_qs(parsed.query).get("q", [""])[0])
+                elif parsed.path.startswith("/page/"):
+                    self._page(parsed.path[len("/page/") :])
+                else:
+                    self._send(404, b"Not found", "text/plain")
+
+            def _completions(self, chat: bool):
+                body, request_key = self._read_json()
+                if chat:
+                    prompt = "\n".join(
+                        str(m.get("content", "")) for m in body.get("messages", [])
+                    )
+                else:
+                    prompt = body.get("prompt", "")
+                    prompt = prompt if isinstance(prompt, str) else "\n".join(prompt)
+                n = body.get("n") or 1
+                text, finish_reason = server._get_response_text(
+                    prompt, body.get("max_tokens")
+                )
+                prompt_tokens = _count_tokens(prompt)
+                completion_tokens = _count_tokens(text) * n
+                server._log(
+                    lm_requests=1,
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=completion_tokens,
+                )
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                }
+                first_token_latency = server._sample_latency(
+                    server.lm_latency, request_key
+                )
+                generation_time = _count_tokens(text) / server.tokens_per_second
+                created = int(time.time())
+
+                if body.get("stream"):
+                    time.sleep(first_token_latency)
+                    self._stream(body, text, finish_reason, generation_time, usage)
+                    return
+
+                time.sleep(first_token_latency + generation_time)
+                if chat:
+                    choices = [
+                        {
+                            "index": i,
+                            "message": {"role": "assistant", "content": text},
+                            "finish_reason": finish_reason,
+                            "logprobs": None,
+                        }
+                        for i in range(n)
+                    ]
+                else:
+                    choices = [
+                        {
+                            "index": i,
+                            "text": text,
+                            "finish_reason": finish_reason,
+                            "logprobs": None,
+                        }
+                        for i in range(n)
+                    ]
+                self._send_json(
+                    {
+                        "id": f"mock-{request_key[:16]}",
+                        "object": "chat.completion" if chat else "text_completion",
+                        "created": created,
+                        "model": body.get("model", "mock"),
+                        "choices": choices,
+                        "usage": usage,
+                    }
+                )
+
+            def _stream(
+                self,
+                body: dict,
+                text: str,
+                finish_reason: str,
+                generation_time: float,
+                usage: dict,
+            ):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                words = text.split(" ")
+                chunk = {
+                    "id": "mock-stream",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": body.get("model", "mock"),
+                }
+                for i, word in enumerate(words):
+                    time.sleep(generation_time / len(words))
+                    delta = word if i == 0 else " " + word
+                    choice = {"index": 0, "delta": {"content": delta}}
+                    if i == len(words) - 1:
+                        choice["finish_reason"] = finish_reason
+                    self._write_event({**chunk, "choices": [choice]})
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    self._write_event({**chunk, "choices": [], "usage": usage})
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+            def _write_event(self, data: dict):
+                self.wfile.write(f"data: {json.dumps(data)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            def _embeddings(self):
+                body, request_key = self._read_json()
+                texts = body.get("input", "")
+                texts = [texts] if isinstance(texts, str) else texts
+                tokens = sum(_count_tokens(str(t)) for t in texts)
+                server._log(embedding_requests=1, embedding_tokens=tokens)
+                time.sleep(
+                    server._sample_latency(server.embedding_latency, request_key)
+                )
+                data = []
+                for i, text in enumerate(texts):
+                    rng = random.Random(str(text))
+                    vector = [rng.gauss(0, 1) for _ in range(server.embedding_dim)]
+                    norm = math.sqrt(sum(x * x for x in vector))
+                    data.append(
+                        {
+                            "object": "embedding",
+                            "index": i,
+                            "embedding": [x / norm for x in vector],
+                        }
+                    )
+                self._send_json(
+                    {
+                        "object": "list",
+                        "data": data,
+                        "model": body.get("model", "mock"),
+                        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+                    }
+                )
+
+            def _search(self, query: str):
+                server._log(search_requests=1)
+                time.sleep(server._sample_latency(server.search_latency, query))
+                query_id = hashlib.sha256(query.encode("utf-8")).hexdigest()[:12]
+                results = [
+                    {
+                        "url": f"{server.url}/page/{query_id}-{i}",
+                        "title": f"{query} ({i + 1})",
+                        "content": PARAGRAPH.format(query=query),
+                    }
+                    for i in range(server.num_search_results)
+                ]
+                self._send_json({"query": query, "results": results})
+
+            def _page(self, page_id: str):
+                server._log(page_requests=1)
+                time.sleep(server._sample_latency(server.page_latency, page_id))
+                paragraphs = "".join(
+                    f"<p>{PARAGRAPH.format(query=f'page {page_id}, part {i + 1}')}</p>"
+                    for i in range(20)
+                )
+                html = (
+                    f"<html><head><title>Page {page_id}</title></head>"
+                    f"<body><article><h1>Page {page_id}</h1>{paragraphs}</article></body></html>"
+                ).encode("utf-8")
+                # Pages never change, so conditional requests are always answered with 304 Not Modified.
+                etag = f'"{hashlib.sha256(html).hexdigest()[:16]}"'
+                if self.headers.get("If-None-Match") == etag:
+                    server._log(page_not_modified=1)
+                    self._send(304, b"", "text/html; charset=utf-8", {"ETag": etag})
+                    return
+                self._send(200, html, "text/html; charset=utf-8", {"ETag": etag})
+
+        return Handler
+
+
+def add_server_arguments(parser: ArgumentParser):
+    """Add the latency settings of the mock server to a command line parser."""
+    group = parser.add_argument_group("mock server")
+    group.add_argument(
+        "--lm-latency-median",
+        type=float,
+        default=1.0,
+        help="Median time to first token of LM requests in seconds.",
+    )
+    group.add_argument(
+        "--lm-latency-sigma",
+        type=float,
+        default=0.5,
+        help="Sigma of the log-normal LM latency; 0 makes it constant.",
+    )
+    group.add_argument(
+        "--tokens-per-second",
+        type=float,
+        default=100.0,
+        help="Generation speed of the mock LM.",
+    )
+    group.add_argument(
+        "--embedding-latency-median",
+        type=float,
+        default=0.05,
+        help="Median latency of embedding requests in seconds.",
+    )
+    group.add_argument(
+        "--search-latency-median",
+        type=float,
+        default=0.5,
+        help="Median latency of search requests in seconds.",
+    )
+    group.add_argument(
+        "--search-latency-sigma",
+        type=float,
+        default=0.3,
+        help="Sigma of the log-normal search latency; 0 makes it constant.",
+    )
+    group.add_argument(
+        "--page-latency",
+        type=float,
+        default=0.1,
+        help="Latency of page downloads in seconds.",
+    )
+    group.add_argument(
+        "--num-search-results",
+        type=int,
+        default=5,
+        help="Number of results returned per search.",
+    )
+    group.add_argument(
+        "--seed", type=int, default=0, help="Seed of the latency distributions."
+    )
+
+
+SERVER_ARGUMENTS = [
+    "lm_latency_median",
+    "lm_latency_sigma",
+    "tokens_per_second",
+    "embedding_latency_median",
+    "search_latency_median",
+    "search_latency_sigma",
+    "page_latency",
+    "num_search_results",
+    "seed",
+]
+
+
+class MockServerProcess:
+    """Run `MockAPIServer` in a child process, configured from the parsed arguments of `add_server_arguments`."""
+
+    def __init__(self, args):
+        self.command = [sys.executable, __file__, "--port", "0"]
+        for name in SERVER_ARGUMENTS:
+            self.command += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+        self.process: Optional[subprocess.Popen] = None
+        self.url: Optional[str] = None
+
+    @property
+    def lm_api_base(self) -> str:
+        # The trailing slash matters: the openai module appends endpoint paths to it as is.
+        return f"{self.url}/v1/"
+
+    @property
+    def search_url(self) -> str:
+        return f"{self.url}/search"
+
+    def start(self) -> "MockServerProcess":
+        self.process = subprocess.Popen(self.command, stdout=subprocess.PIPE, text=True)
+        # The server prints its URL once it is listening.
+        self.url = self.process.stdout.readline().strip()
+        if not self.url:
+            raise RuntimeError("The mock server failed to start.")
+        return self
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def get_stats_and_reset(self) -> dict:
+        with urlopen(f"{self.url}/stats") as response:
+            return json.loads(response.read())
+
+
+def main(args):
+    server = MockAPIServer(
+        lm_latency=make_latency(args.lm_latency_median, args.lm_latency_sigma),
+        tokens_per_second=args.tokens_per_second,
+        embedding_latency=make_latency(args.embedding_latency_median),
+        search_latency=make_latency(
+            args.search_latency_median, args.search_latency_sigma
+        ),
+        page_latency=make_latency(args.page_latency),
+        num_search_results=args.num_search_results,
+        seed=args.seed,
+        port=args.port,
+    )
+    print(server.url, flush=True)
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--port", type=int, default=8000, help="Port to listen on; 0 picks a free port."
+    )
+    add_server_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,370 @@
+"""
+End-to-end benchmarks of the STORM pipelines against local mock LM and search servers.
+
+The benchmarks drive
+    - investor: `STORMWikiRunner.run` of knowledge_storm.storm_investor (results stored in a temporary database)
+    - wiki: `STORMWikiRunner.run` of knowledge_storm.storm_wiki
+    - costorm: `CoStormRunner.warm_start` followed by `CoStormRunner.step`
+with all LM calls, embeddings and searches served by `mock_servers.MockAPIServer`, whose latencies are set on the
+command line. No API key or network access is needed. The wiki and investor pipelines still load the
+SentenceTransformer model of `storm_dataclass.py`, which has to be available in the local Hugging Face cache.
+
+For every run, the benchmarks report the wall time of every pipeline stage (`Engine.time`, or the stage times
+of the Co-STORM `LoggingWrapper`), the total wall time and CPU time, the peak RSS and thread count, the token
+usage reported by the LMs and the requests and tokens seen by the mock server. The results are written as JSON
+which can be compared between commits with `compare.py`:
+    python benchmarks/run_benchmarks.py --pipeline all --output results/baseline.json
+    (change the code)
+    python benchmarks/run_benchmarks.py --pipeline all --output results/candidate.json
+    python benchmarks/compare.py results/baseline.json results/candidate.json
+
+Output will be structured as below
+args.output:
+    metadata            # Git commit, Python version, platform and benchmark arguments
+    benchmarks/
+        <pipeline>/
+            runs        # Metrics of every run
+            median      # Median of every numeric metric over the runs, flattened to "a.b.c" keys
+"""
+
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from metrics import ResourceMonitor, median_metrics
+from mock_servers import MockServerProcess, add_server_arguments
+
+PIPELINES = ["investor", "wiki", "costorm"]
+
+# Responses memoized by dspy on disk would be served without hitting the mock server. The variable is read when
+# dspy is imported, which happens lazily in the benchmark functions.
+os.environ["DSP_CACHEBOOL"] = "false"
+
+
+def build_lm(server: MockServerProcess, max_tokens: int):
+    from knowledge_storm.lm import OpenAIModel
+
+    return OpenAIModel(
+        model="gpt-4o-mini",
+        max_tokens=max_tokens,
+        api_key="mock",
+        api_base=server.lm_api_base,
+        model_type="chat",
+        temperature=1.0,
+        top_p=0.9,
+    )
+
+
+def build_rm(server: MockServerProcess, k: int):
+    from knowledge_storm.rm import SearXNG
+
+    return SearXNG(searxng_api_url=server.search_url, k=k)
+
+
+def set_storm_lms(lm_configs, server: MockServerProcess):
+    # Same max_tokens as examples/storm_examples/run_storm_wiki_gpt.py.
+    lm_configs.set_conv_simulator_lm(build_lm(server, max_tokens=500))
+    lm_configs.set_question_asker_lm(build_lm(server, max_tokens=500))
+    lm_configs.set_outline_gen_lm(build_lm(server, max_tokens=400))
+    lm_configs.set_article_gen_lm(build_lm(server, max_tokens=700))
+    lm_configs.set_article_polish_lm(build_lm(server, max_tokens=4000))
+
+
+def run_wiki(args, server: MockServerProcess, work_dir: str) -> dict:
+    from knowledge_storm.storm_wiki.engine import (
+        STORMWikiLMConfigs,
+        STORMWikiRunner,
+        STORMWikiRunnerArguments,
+    )
+
+    lm_configs = STORMWikiLMConfigs()
+    set_storm_lms(lm_configs, server)
+    engine_args = STORMWikiRunnerArguments(
+        output_dir=work_dir,
+        max_conv_turn=args.max_conv_turn,
+        max_perspective=args.max_perspective,
+        search_top_k=args.search_top_k,
+        max_thread_num=args.max_thread_num,
+    )
+    runner = STORMWikiRunner(
+        engine_args, lm_configs, build_rm(server, k=args.search_top_k)
+    )
+
+    with ResourceMonitor() as monitor:
+        runner.run(
+            topic=args.topic,
+            do_research=True,
+            do_generate_outline=True,
+            do_generate_article=True,
+            do_polish_article=True,
+        )
+        runner.post_run()
+    return {
+        **monitor.result,
+        "stage_time": runner.time,
+        "lm_usage": runner.lm_cost,
+        "rm_usage": runner.rm_cost,
+    }
+
+
+def run_investor(args, server: MockServerProcess, work_dir: str) -> dict:
+    from knowledge_storm import utils_db
+    from knowledge_storm.storm_investor.engine import (
+        STORMWikiLMConfigs,
+        STORMWikiRunner,
+        STORMWikiRunnerArguments,
+    )
+
+    # Same schema as the database created by frontend/fasthtml/storm_fasthtml.py.
+    utils_db.database_path = os.path.join(work_dir, "investor_reports.db")
+    opportunity_id = "benchmark"
+    with utils_db.get_db_connection() as db:
+        opportunities = db.t.opportunities
+        opportunities.create(
+            id=str,
+            name=str,
+            conversation_log=str,
+            direct_gen_outline=str,
+            llm_call_history=str,
+            raw_search_results=str,
+            run_config=str,
+            storm_gen_article_polished=str,
+            storm_gen_article=str,
+            storm_gen_outline=str,
+            url_to_info=str,
+            user_name=str,
+            status=str,
+            pk="id",
+        )
+        Opportunities = opportunities.dataclass()
+        opportunities.insert(
+            Opportunities(id=opportunity_id, name=args.topic, status="initiated")
+        )
+
+    lm_configs = STORMWikiLMConfigs()
+    set_storm_lms(lm_configs, server)
+    engine_args = STORMWikiRunnerArguments(
+        output_dir=work_dir,
+        database_path=utils_db.database_path,
+        max_conv_turn=args.max_conv_turn,
+        max_perspective=args.max_perspective,
+        search_top_k=args.search_top_k,
+        max_thread_num=args.max_thread_num,
+    )
+    runner = STORMWikiRunner(
+        engine_args, lm_configs, build_rm(server, k=args.search_top_k)
+    )
+
+    with ResourceMonitor() as monitor:
+        runner.run(
+            opportunity=args.topic,
+            opportunity_id=opportunity_id,
+            do_research=True,
+            do_generate_outline=True,
+            do_generate_article=True,
+            do_polish_article=True,
+        )
+        runner.post_run(args.topic, opportunity_id)
+    return {
+        **monitor.result,
+        "stage_time": runner.time,
+        "lm_usage": runner.lm_cost,
+        "rm_usage": runner.rm_cost,
+    }
+
+
+def run_costorm(args, server: MockServerProcess, work_dir: str) -> dict:
+    from knowledge_storm.collaborative_storm.engine import (
+        CollaborativeStormLMConfigs,
+        CoStormRunner,
+        RunnerArgument,
+    )
+    from knowledge_storm.logging_wrapper import LoggingWrapper
+
+    lm_config = CollaborativeStormLMConfigs()
+    # Same max_tokens as examples/costorm_examples/run_costorm_gpt.py.
+    lm_config.set_question_answering_lm(build_lm(server, max_tokens=1000))
+    lm_config.set_discourse_manage_lm(build_lm(server, max_tokens=500))
+    lm_config.set_utterance_polishing_lm(build_lm(server, max_tokens=2000))
+    lm_config.set_warmstart_outline_gen_lm(build_lm(server, max_tokens=500))
+    lm_config.set_question_asking_lm(build_lm(server, max_tokens=300))
+    lm_config.set_knowledge_base_lm(build_lm(server, max_tokens=1000))
+
+    runner_argument = RunnerArgument(
+        topic=args.topic,
+        retrieve_top_k=args.search_top_k,
+        max_search_thread=args.max_thread_num,
+        warmstart_max_thread=args.max_thread_num,
+        max_thread_num=args.max_thread_num,
+    )
+    logging_wrapper = LoggingWrapper(lm_config)
+    runner = CoStormRunner(
+        lm_config=lm_config,
+        runner_argument=runner_argument,
+        logging_wrapper=logging_wrapper,
+        rm=build_rm(server, k=args.search_top_k),
+    )
+
+    step_time = {}
+    with ResourceMonitor() as monitor:
+        start_time = time.perf_counter()
+        runner.warm_start()
+        step_time["warm_start"] = time.perf_counter() - start_time
+        for i in range(args.costorm_steps):
+            start_time = time.perf_counter()
+            runner.step()
+            step_time[f"step_{i + 1}"] = time.perf_counter() - start_time
+
+    log_dump = runner.dump_logging_and_reset()
+    return {
+        **monitor.result,
+        "stage_time": step_time,
+        "pipeline_stage_time": {
+            stage: log["total_wall_time"] for stage, log in log_dump.items()
+        },
+        "lm_usage": {stage: log["lm_usage"] for stage, log in log_dump.items()},
+        "rm_usage": {stage: log["query_count"] for stage, log in log_dump.items()},
+    }
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args):
+    pipelines = PIPELINES if args.pipeline == "all" else [args.pipeline]
+    runners = {"investor": run_investor, "wiki": run_wiki, "costorm": run_costorm}
+    results = {
+        "metadata": {
+            "git_commit": get_git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "benchmarks": {},
+    }
+
+    with MockServerProcess(args) as server:
+        # The encoder reads its settings from the environment.
+        os.environ["ENCODER_API_TYPE"] = "openai"
+        os.environ["OPENAI_API_KEY"] = "mock"
+        os.environ["OPENAI_API_BASE"] = server.lm_api_base
+
+        for pipeline in pipelines:
+            runs = []
+            for i in range(args.warmup + args.repeat):
+                with tempfile.TemporaryDirectory() as work_dir:
+                    server.get_stats_and_reset()
+                    result = runners[pipeline](args, server, work_dir)
+                    result["server"] = server.get_stats_and_reset()
+                if i < args.warmup:
+                    continue
+                runs.append(result)
+                print(
+                    f"{pipeline} run {len(runs)}/{args.repeat}: {result['wall_time']:.2f}s wall, "
+                    f"{result['cpu_time']:.2f}s CPU, {result['peak_rss_mb']:.0f} MB peak RSS, "
+                    f"{result['peak_threads']} peak threads, {result['server']['lm_requests']} LM requests"
+                )
+            results["benchmarks"][pipeline] = {
+                "runs": runs,
+                "median": median_metrics(runs),
+            }
+
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--pipeline",
+        type=str,
+        choices=PIPELINES + ["all"],
+        default="all",
+        help="The pipeline to benchmark.",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="./results/benchmark.json",
+        help="Path of the JSON file to write the results to.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of measured runs of every pipeline.",
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=1,
+        help="Number of unmeasured runs before the measured ones (imports, model loading).",
+    )
+    parser.add_argument(
+        "--topic",
+        type=str,
+        default="Benchmark topic",
+        help="Topic (or investment opportunity) to run the pipelines on.",
+    )
+    # hyperparameters of the pipelines
+    parser.add_argument(
+        "--max-thread-num",
+        type=int,
+        default=10,
+        help="Maximum number of threads used by the pipelines.",
+    )
+    parser.add_argument(
+        "--max-conv-turn",
+        type=int,
+        default=3,
+        help="Maximum number of questions in conversational question asking.",
+    )
+    parser.add_argument(
+        "--max-perspective",
+        type=int,
+        default=3,
+        help="Maximum number of perspectives to consider in perspective-guided question asking.",
+    )
+    parser.add_argument(
+        "--search-top-k",
+        type=int,
+        default=3,
+        help="Top k search results to consider for each search query.",
+    )
+    parser.add_argument(
+        "--costorm-steps",
+        type=int,
+        default=3,
+        help="Number of Co-STORM conversation turns after the warm start.",
+    )
+    parser.add_argument(
+        "--log-level",
+        type=str,
+        default="WARNING",
+        help="Logging level of the pipelines.",
+    )
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+    main(args)
@@ -13,8 +13,10 @@ sys.path.append(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'demo_l
 import demo_util
 from demo_util import DemoFileIOHelper, DemoTextProcessingHelper
 from knowledge_storm import STORMWikiRunnerArguments, STORMWikiRunner, STORMWikiLMConfigs
+from knowledge_storm.encoder import warm_up_sentence_transformer
 from knowledge_storm.lm import OpenAIModel
 from knowledge_storm.rm import YouRM, BraveRM, BingSearch
+from knowledge_storm.storm_investor.modules.callback import BaseCallbackHandler
 from knowledge_storm.utils_db import database_path, get_db_connection
 
 load_dotenv()
@@ -136,6 +138,10 @@ hdrs = (MarkdownJS(), Style(app_styles))#, scripts, link_daisyui, link_pico)
 
 app, rt = fast_app(pico=True, hdrs=hdrs)
 
+# Load the encoder used by article generation in the background, so that the first run does not wait for it.
+if os.getenv("WARM_UP_ENCODER", "true").lower() == "true":
+    threaded(warm_up_sentence_transformer)()
+
 info_card_style = "word-wrap: break-word; overflow-wrap: break-word; white-space: normal; color: #1976d2; background-color: #e3f2fd; border-radius: 4px"
 error_card_style = "word-wrap: break-word; overflow-wrap: break-word; white-space: normal; color: #d32f2f; background-color: #ffebee; border-radius: 4px"
 
@@ -172,6 +178,20 @@ def set_storm_runner():
 
     runner = STORMWikiRunner(engine_args, llm_configs, rm)
     return runner
+
+# Sections of the article being written, streamed from the LM and shown while the final writing is in progress
+partial_sections = defaultdict(dict)
+
+class SectionStreamingCallbackHandler(BaseCallbackHandler):
+    def __init__(self, opportunity_id):
+        self.opportunity_id = opportunity_id
+        partial_sections[opportunity_id] = {}
+
+    def on_section_update(self, section_name, partial_section, **kwargs):
+        partial_sections[self.opportunity_id][section_name] = partial_section
+
+    def on_section_end(self, section_name, section_content, **kwargs):
+        partial_sections[self.opportunity_id][section_name] = section_content
 #-------------------------------------------------------------------------------
 
 # Define helper functions
@@ -386,8 +406,10 @@ def new_opportunity():
                 id="new_opportunity"
                 )
     else:
+        sections_in_progress = [Div(text, cls="marked") for text in list(partial_sections.get(oppo_id, {}).values())]
         return Card(
             f"Currently working on the opportunity ", B(oppo_name), f" ({status_text[oppo_status]}). You have to wait for it to finish before you can start a new one.",
+            *sections_in_progress,
             aria_busy="true",
             style=info_card_style,
             hx_get="/new_opportunity",
@@ -786,8 +808,8 @@ def run_workflow(opportunity_name, opportunity_id):
             do_generate_outline=False,
             do_generate_article=True,
             do_polish_article=False, # Removed the article polishing step because an Executive Summary is already (almost always) included in the article
-            remove_duplicate=False
-            #callback_handler=BaseCallbackHandler() # TODO: add callback handler
+            remove_duplicate=False,
+            callback_handler=SectionStreamingCallbackHandler(opportunity_id)
         )
         runner.post_run(
             opportunity=opportunity_name,
@@ -798,6 +820,7 @@ def run_workflow(opportunity_name, opportunity_id):
         global opportunity_generated
         opportunity_generated = opportunity_card(opportunity)
         set_status(opportunity_id, 'complete')
+        partial_sections.pop(opportunity_id, None)
         preview_exists = None
 
     return opportunity_generated
@@ -1,6 +1,9 @@
 from .storm_investor import *
 from .collaborative_storm import *
+from .cache import *
 from .encoder import *
+from .history import *
+from .replay import *
 from .interface import *
 from .lm import *
 from .rm import *
@@ -0,0 +1,205 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Any, Optional
+
+
+class SQLiteCache:
+    """A persistent key-value cache backed by a single SQLite file.
+
+    Values are JSON-serialized and zlib-compressed. Entries expire after `ttl` seconds and the least recently
+    used entries are evicted once the total (compressed) size exceeds `max_size_bytes`. The file can be shared
+    by multiple threads and processes; SQLite's WAL mode takes care of concurrent readers and writers.
+
+    The total size is kept in a meta row updated in the same transaction as the entries, so that insertions do not
+    scan the table. Expired entries are dropped when read, and swept at most every `TTL_SWEEP_INTERVAL` seconds.
+    """
+
+    TTL_SWEEP_INTERVAL = 60.0
+
+    def __init__(
+        self,
+        path: str,
+        ttl: Optional[float] = None,
+        max_size_bytes: Optional[int] = 512 * 1024 * 1024,
+    ):
+        """
+        Args:
+            path: Path to the SQLite file. Parent directories are created if needed.
+            ttl: Time-to-live of an entry in seconds. None means entries never expire.
+            max_size_bytes: Upper bound of the total size of the stored values. None means unbounded.
+        """
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self.max_size_bytes = max_size_bytes
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS entries_created_at ON entries (created_at)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+        # Computed once for files written before the total size was tracked.
+        self._conn.execute(
+            "INSERT OR IGNORE INTO meta (key, value) "
+            "SELECT 'total_size', COALESCE(SUM(size), 0) FROM entries"
+        )
+        self._last_sweep = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """Build a content-addressed key from JSON-serializable parts."""
+        serialized = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+            value, created_at = row
+            if self.ttl is not None and now - created_at > self.ttl:
+                with self._transaction():
+                    self._delete(key)
+                self.misses += 1
+                return default
+            self._conn.execute(
+                "UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+        try:
+            return json.loads(zlib.decompress(value).decode("utf-8"))
+        except Exception as e:
+            logging.warning(f"Dropping corrupted cache entry {key}: {e}")
+            self.delete(key)
+            return default
+
+    def set(self, key: str, value: Any):
+        blob = zlib.compress(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        now = time.time()
+        with self._lock, self._transaction():
+            self._delete(key)
+            self._conn.execute(
+                "INSERT INTO entries (key, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now),
+            )
+            self._add_size(len(blob))
+            self._evict()
+
+    def delete(self, key: str):
+        with self._lock, self._transaction():
+            self._delete(key)
+
+    def clear(self):
+        with self._lock, self._transaction():
+            self._conn.execute("DELETE FROM entries")
+            self._conn.execute("UPDATE meta SET value = 0 WHERE key = 'total_size'")
+
+    @contextmanager
+    def _transaction(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def _add_size(self, size: int):
+        self._conn.execute(
+            "UPDATE meta SET value = value + ? WHERE key = 'total_size'", (size,)
+        )
+
+    def _get_total_size(self) -> int:
+        return self._conn.execute(
+            "SELECT value FROM meta WHERE key = 'total_size'"
+        ).fetchone()[0]
+
+    def _delete(self, key: str):
+        """Must be called with `self._lock` held, within a transaction."""
+        row = self._conn.execute(
+            "SELECT size FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._add_size(-row[0])
+
+    def _evict(self):
+        """Sweep expired entries (periodically) and drop the least recently used ones until the cache fits in its
+        size bound. Must be called with `self._lock` held, within a transaction."""
+        now = time.time()
+        if self.ttl is not None and now - self._last_sweep > self.TTL_SWEEP_INTERVAL:
+            self._last_sweep = now
+            expired_size = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries WHERE created_at < ?",
+                (now - self.ttl,),
+            ).fetchone()[0]
+            self._conn.execute(
+                "DELETE FROM entries WHERE created_at < ?", (now - self.ttl,)
+            )
+            self._add_size(-expired_size)
+        if self.max_size_bytes is None:
+            return
+        total_size = self._get_total_size()
+        if total_size <= self.max_size_bytes:
+            return
+        # Evict down to 90% of the bound so that eviction does not run on every insertion.
+        to_free = total_size - int(self.max_size_bytes * 0.9)
+        freed = 0
+        stale_keys = []
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM entries ORDER BY accessed_at ASC"
+        ):
+            stale_keys.append((key,))
+            freed += size
+            if freed >= to_free:
+                break
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", stale_keys)
+        self._add_size(-freed)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def stats(self):
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            size = self._get_total_size()
+        return {
+            "entries": count,
+            "size_bytes": size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
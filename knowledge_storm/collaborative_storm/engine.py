@@ -167,7 +167,9 @@ class CollaborativeStormLMConfigs(LMConfigs):
             ):
                 usage = getattr(self, attr_name).get_usage_and_reset()
                 if any(
-                    value["prompt_tokens"] != 0 or value["completion_tokens"] != 0
+                    value["prompt_tokens"] != 0
+                    or value["completion_tokens"] != 0
+                    or value.get("cache_hits", 0) != 0
                     for value in usage.values()
                 ):
                     lm_usage[attr_name] = usage
@@ -251,7 +251,11 @@ def _get_answer_question_module_instance(
     # configure retriever
     if rm is None:
         rm = BingSearch(k=runner_argument.retrieve_top_k)
-    retriever = Retriever(rm=rm, max_thread=runner_argument.max_search_thread)
+    retriever = Retriever(
+        rm=rm,
+        max_thread=runner_argument.max_search_thread,
+        max_callers=runner_argument.max_thread_num,
+    )
     # return AnswerQuestionModule instance
     return AnswerQuestionModule(
         retriever=retriever,
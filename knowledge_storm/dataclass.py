@@ -4,7 +4,7 @@ import re
 import threading
 from typing import Set, Dict, List, Optional, Union, Tuple
 
-from .encoder import get_text_embeddings
+from .encoder import EmbeddingStore, get_embedding_store, get_text_embeddings
 from .interface import Information
 
 
@@ -353,7 +353,12 @@ class KnowledgeBase:
             "encoded_structure": np.array([[]]),
             "structure_string": "",
         }
-        self.embedding_cache: Dict[str, np.ndarray] = {}
+        # Shared with other sessions and processes when the embedding store is enabled.
+        self.embedding_cache: Union[Dict[str, np.ndarray], EmbeddingStore] = (
+            get_embedding_store()
+        )
+        if self.embedding_cache is None:
+            self.embedding_cache = {}
         self.info_uuid_to_info_dict: Dict[int, Information] = {}
         self.info_hash_to_uuid_dict: Dict[int, int] = {}
         self._lock = threading.Lock()
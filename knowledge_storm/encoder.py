@@ -1,35 +1,119 @@
+import hashlib
 import requests
 import os
+import platform
+import sqlite3
+import threading
+import time
 from typing import List, Tuple, Union, Optional, Dict, Literal
 import numpy as np
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 
 
 class EmbeddingModel:
+    # Limits of a single batched request: number of texts and (estimated) number of tokens.
+    max_batch_size: int = 1
+    max_batch_tokens: int = 8191
+    # Environment variables read by the constructor; `get_embedding_model` creates a new model when they change.
+    config_env_vars: Tuple[str, ...] = ()
+    # Maximum number of batches embedded in parallel, None meaning the `max_workers` of `get_text_embeddings`.
+    max_concurrency: Optional[int] = None
+
     def __init__(self):
         pass
 
     def get_embedding(self, text: str) -> Tuple[np.ndarray, int]:
         raise Exception("Not implemented")
 
+    @property
+    def name(self) -> str:
+        """Identify the embedding space, e.g., to key cached embeddings."""
+        return f"{type(self).__name__}/{getattr(self, 'model', '')}"
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        # Conservative estimate (about 4 characters per token for English) to stay within the token budget.
+        return len(text) // 3 + 1
+
+    def get_batches(self, texts: List[str]) -> List[List[int]]:
+        """Split texts into batches within `max_batch_size` and `max_batch_tokens`, as lists of indices."""
+        batches = []
+        batch, batch_tokens = [], 0
+        for i, text in enumerate(texts):
+            tokens = self.estimate_tokens(text)
+            if batch and (
+                len(batch) >= self.max_batch_size
+                or batch_tokens + tokens > self.max_batch_tokens
+            ):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _get_batch_embeddings(self, texts: List[str]) -> Tuple[List[np.ndarray], int]:
+        """Embed texts fitting in a single request. Models without a batch API embed one text at a time."""
+        results = [self.get_embedding(text) for text in texts]
+        return [embedding for embedding, _ in results], sum(
+            tokens for _, tokens in results
+        )
+
+    def get_embeddings(self, texts: List[str]) -> Tuple[np.ndarray, int]:
+        """Embed texts with as few requests as possible.
+
+        Returns:
+            Tuple[np.ndarray, int]: The 2D array of embeddings, in the order of `texts`, and the token usage.
+        """
+        embeddings = []
+        total_tokens = 0
+        for batch in self.get_batches(texts):
+            batch_embeddings, tokens = self._get_batch_embeddings(
+                [texts[i] for i in batch]
+            )
+            embeddings.extend(batch_embeddings)
+            total_tokens += tokens
+        return np.array(embeddings), total_tokens
+
 
 class OpenAIEmbeddingModel(EmbeddingModel):
-    def __init__(self, model: str = "text-embedding-3-small", api_key: str = None):
+    # https://platform.openai.com/docs/api-reference/embeddings/create
+    max_batch_size = 2048
+    max_batch_tokens = 300000
+    config_env_vars = ("OPENAI_API_KEY", "OPENAI_API_BASE")
+
+    def __init__(
+        self,
+        model: str = "text-embedding-3-small",
+        api_key: str = None,
+        api_base: str = None,
+    ):
         if not api_key:
             api_key = os.getenv("OPENAI_API_KEY")
+        if not api_base:
+            api_base = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
 
-        self.url = "https://api.openai.com/v1/embeddings"
+        self.url = f"{api_base.rstrip('/')}/embeddings"
         self.headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {api_key}",
         }
         self.model = model
+        # One session per thread, so that connections are reused across requests.
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
 
     def get_embedding(self, text: str) -> Tuple[np.ndarray, int]:
         data = {"input": text, "model": self.model}
 
-        response = requests.post(self.url, headers=self.headers, json=data)
+        response = self.session.post(self.url, headers=self.headers, json=data)
         if response.status_code == 200:
             data = response.json()
             embedding = np.array(data["data"][0]["embedding"])
@@ -38,8 +122,23 @@ class OpenAIEmbeddingModel(EmbeddingModel):
         else:
             response.raise_for_status()
 
+    def _get_batch_embeddings(self, texts: List[str]) -> Tuple[List[np.ndarray], int]:
+        data = {"input": texts, "model": self.model}
+
+        response = self.session.post(self.url, headers=self.headers, json=data)
+        response.raise_for_status()
+        data = response.json()
+        embeddings = [
+            np.array(d["embedding"])
+            for d in sorted(data["data"], key=lambda d: d["index"])
+        ]
+        return embeddings, data["usage"]["prompt_tokens"]
+
+
+class TogetherEmbeddingModel(EmbeddingModel):
+    max_batch_size = 128
+    config_env_vars = ("TOGETHER_API_KEY",)
 
-class TogetherEmbeddingModel:
     def __init__(self, model: str = "BAAI/bge-large-en-v1.5", api_key: str = None):
         import together
 
@@ -52,8 +151,20 @@ class TogetherEmbeddingModel:
         response = self.together_client.embeddings.create(input=text, model=self.model)
         return response.data[0].embedding, -1
 
+    def _get_batch_embeddings(self, texts: List[str]) -> Tuple[List[np.ndarray], int]:
+        response = self.together_client.embeddings.create(input=texts, model=self.model)
+        embeddings = [
+            np.array(d.embedding) for d in sorted(response.data, key=lambda d: d.index)
+        ]
+        # Token usage is not reported, -1 per text as in `get_embedding`.
+        return embeddings, -len(texts)
+
+
+class AzureOpenAIEmbeddingModel(EmbeddingModel):
+    max_batch_size = 2048
+    max_batch_tokens = 300000
+    config_env_vars = ("AZURE_API_KEY", "AZURE_API_VERSION", "AZURE_API_BASE")
 
-class AzureOpenAIEmbeddingModel:
     def __init__(self, model: str = "text-embedding-3-small", api_key: str = None):
         from openai import AzureOpenAI
 
@@ -74,71 +185,563 @@ class AzureOpenAIEmbeddingModel:
         token = response.usage.prompt_tokens
         return embedding, token
 
+    def _get_batch_embeddings(self, texts: List[str]) -> Tuple[List[np.ndarray], int]:
+        response = self.client.embeddings.create(input=texts, model=self.model)
+
+        embeddings = [
+            np.array(d.embedding) for d in sorted(response.data, key=lambda d: d.index)
+        ]
+        return embeddings, response.usage.prompt_tokens
+
+
+class LocalEmbeddingModel(EmbeddingModel):
+    """Embed texts on the CPU with a sentence-transformers model exported to ONNX (int8-quantized by default).
+
+    No API call is made, so embeddings work offline once the model is downloaded. Requires
+    `pip install onnxruntime`. Loading the model takes a while; `get_embedding_model("local")` loads it once and
+    shares it.
+    """
+
+    # onnxruntime already spreads a batch over `num_threads` threads, so batches are run one at a time.
+    max_batch_size = 32
+    max_batch_tokens = 100000
+    max_concurrency = 1
+    config_env_vars = (
+        "LOCAL_ENCODER_MODEL",
+        "LOCAL_ENCODER_ONNX_FILE",
+        "LOCAL_ENCODER_THREADS",
+    )
+
+    def __init__(
+        self,
+        model: Optional[str] = None,
+        onnx_file: Optional[str] = None,
+        num_threads: Optional[int] = None,
+        max_length: int = 256,
+    ):
+        """
+        Args:
+            model: Hugging Face repository of a sentence-transformers model shipping ONNX exports, or a local
+                directory with its `tokenizer.json` and ONNX file. Defaults to the LOCAL_ENCODER_MODEL environment
+                variable, then "sentence-transformers/all-MiniLM-L6-v2".
+            onnx_file: Path of the ONNX file within the model. Defaults to LOCAL_ENCODER_ONNX_FILE, then the
+                int8-quantized export for the CPU architecture ("onnx/model.onnx" on other architectures).
+            num_threads: Number of threads running a batch. Defaults to LOCAL_ENCODER_THREADS, then all cores.
+            max_length: Texts are truncated to this number of tokens.
+        """
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.model = (
+            model
+            or os.getenv("LOCAL_ENCODER_MODEL")
+            or "sentence-transformers/all-MiniLM-L6-v2"
+        )
+        onnx_file = (
+            onnx_file
+            or os.getenv("LOCAL_ENCODER_ONNX_FILE")
+            or self._get_default_onnx_file()
+        )
+        if num_threads is None and os.getenv("LOCAL_ENCODER_THREADS"):
+            num_threads = int(os.getenv("LOCAL_ENCODER_THREADS"))
+
+        self.tokenizer = Tokenizer.from_file(self._get_model_file("tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.no_padding()
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(
+            self._get_model_file(onnx_file),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._input_names = {input.name for input in self.session.get_inputs()}
+        # Warm up, so that the first call does not pay for the lazy initialization of onnxruntime.
+        self._get_batch_embeddings(["warm-up"])
+
+    @staticmethod
+    def _get_default_onnx_file() -> str:
+        machine = platform.machine().lower()
+        if machine in ("x86_64", "amd64"):
+            return "onnx/model_quint8_avx2.onnx"
+        if machine in ("arm64", "aarch64"):
+            return "onnx/model_qint8_arm64.onnx"
+        return "onnx/model.onnx"
+
+    def _get_model_file(self, filename: str) -> str:
+        if os.path.isdir(self.model):
+            return os.path.join(self.model, filename)
+        from huggingface_hub import hf_hub_download
+
+        return hf_hub_download(self.model, filename)
+
+    def get_embedding(self, text: str) -> Tuple[np.ndarray, int]:
+        embeddings, tokens = self._get_batch_embeddings([text])
+        return embeddings[0], tokens
+
+    def _get_batch_embeddings(self, texts: List[str]) -> Tuple[List[np.ndarray], int]:
+        encodings = self.tokenizer.encode_batch(texts)
+        length = max(len(encoding.ids) for encoding in encodings)
+        input_ids = np.zeros((len(texts), length), dtype=np.int64)
+        attention_mask = np.zeros((len(texts), length), dtype=np.int64)
+        token_type_ids = np.zeros((len(texts), length), dtype=np.int64)
+        for i, encoding in enumerate(encodings):
+            input_ids[i, : len(encoding.ids)] = encoding.ids
+            attention_mask[i, : len(encoding.ids)] = encoding.attention_mask
+            token_type_ids[i, : len(encoding.ids)] = encoding.type_ids
+        inputs = {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "token_type_ids": token_type_ids,
+        }
+        outputs = self.session.run(
+            None, {name: inputs[name] for name in self._input_names}
+        )[0]
+        if outputs.ndim == 3:
+            # Mean pooling over the tokens, as sentence-transformers does.
+            mask = attention_mask[:, :, None].astype(outputs.dtype)
+            outputs = (outputs * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        outputs = outputs / np.maximum(
+            np.linalg.norm(outputs, axis=1, keepdims=True), 1e-12
+        )
+        # No API tokens are used.
+        return list(outputs), 0
+
+
+# Embedding models selectable with the ENCODER_API_TYPE environment variable.
+ENCODER_TYPES: Dict[str, type] = {
+    "openai": OpenAIEmbeddingModel,
+    "azure": AzureOpenAIEmbeddingModel,
+    "together": TogetherEmbeddingModel,
+    "local": LocalEmbeddingModel,
+}
+
+_embedding_models: Dict[Tuple, EmbeddingModel] = {}
+_embedding_models_lock = threading.Lock()
+
+
+def get_embedding_model(encoder_type: Optional[str] = None) -> EmbeddingModel:
+    """Get the embedding model of `encoder_type` (by default, the ENCODER_API_TYPE environment variable).
+
+    Models are created once per configuration and shared by all threads, so that their clients and connections
+    are reused across calls.
+    """
+    if encoder_type is None:
+        encoder_type = os.getenv("ENCODER_API_TYPE")
+    if encoder_type not in ENCODER_TYPES:
+        raise Exception(
+            "No valid encoder type is provided. Check <repo root>/secrets.toml for the field ENCODER_API_TYPE"
+        )
+    model_class = ENCODER_TYPES[encoder_type]
+    key = (encoder_type, *(os.getenv(var) for var in model_class.config_env_vars))
+    with _embedding_models_lock:
+        if key not in _embedding_models:
+            _embedding_models[key] = model_class()
+        return _embedding_models[key]
+
+
+class EmbeddingStore:
+    """A persistent store of embeddings keyed by (model, text), shared by threads, sessions and processes.
+
+    The embeddings of a model live in a memory-mapped matrix of `max_entries` rows, and an SQLite index maps the
+    hash of each text to its row. Once the matrix is full, the rows of the least recently used texts are reused.
+    Each row also records the hash of its text, written after the embedding; readers check it after copying the
+    row, so that a row being overwritten by another process is treated as a miss rather than a wrong embedding.
+    Writers are serialized across processes by SQLite's write lock.
+    """
+
+    def __init__(
+        self,
+        path: str = "~/.cache/knowledge_storm/embeddings",
+        max_entries: int = 200000,
+        dtype: str = "float32",
+    ):
+        """
+        Args:
+            path: Directory of the store. It is created if needed.
+            max_entries: Number of embeddings kept per model. The matrix files are sparse, so unused rows take no
+                disk space. A store created by another process keeps its own value.
+            dtype: "float32" or "float16"; float16 halves the size of the store at a small loss of precision.
+        """
+        self.path = os.path.expanduser(path)
+        self.max_entries = max_entries
+        self.dtype = np.dtype(dtype)
+        os.makedirs(self.path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(self.path, "index.sqlite"),
+            check_same_thread=False,
+            isolation_level=None,
+            timeout=30,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS models ("
+            "model TEXT PRIMARY KEY, file TEXT NOT NULL, dim INTEGER NOT NULL, dtype TEXT NOT NULL, "
+            "capacity INTEGER NOT NULL, used INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "model TEXT NOT NULL, key INTEGER NOT NULL, row INTEGER NOT NULL, accessed_at REAL NOT NULL, "
+            "PRIMARY KEY (model, key))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (model, accessed_at)"
+        )
+        # model -> (embedding matrix, row keys), both memory-mapped.
+        self._matrices = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(text: str) -> int:
+        """Hash a text to a nonzero signed 64-bit integer; 0 marks a row being written."""
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "little", signed=True) or 1
+
+    def _open_model(self, model: str, dim: Optional[int] = None):
+        """Map the matrix of `model`, creating it with `dim` columns if given. Must be called with `self._lock`
+        held (and, to create the matrix, within a write transaction)."""
+        if model in self._matrices:
+            return self._matrices[model]
+        row = self._conn.execute(
+            "SELECT file, dim, dtype, capacity FROM models WHERE model = ?", (model,)
+        ).fetchone()
+        if row is None:
+            if dim is None:
+                return None
+            file = hashlib.sha256(model.encode("utf-8")).hexdigest()[:16]
+            row = (file, dim, self.dtype.str, self.max_entries)
+            self._conn.execute(
+                "INSERT INTO models (model, file, dim, dtype, capacity, used) VALUES (?, ?, ?, ?, ?, 0)",
+                (model, *row),
+            )
+        file, dim, dtype, capacity = row
+        file = os.path.join(self.path, file)
+        for suffix in (".emb", ".keys"):
+            if not os.path.exists(file + suffix):
+                # Sparse file of the final size: rows are only allocated when written.
+                with open(file + suffix, "wb") as f:
+                    f.truncate(
+                        capacity
+                        * (dim * np.dtype(dtype).itemsize if suffix == ".emb" else 8)
+                    )
+        self._matrices[model] = (
+            np.memmap(file + ".emb", dtype=dtype, mode="r+", shape=(capacity, dim)),
+            np.memmap(file + ".keys", dtype=np.int64, mode="r+", shape=(capacity,)),
+        )
+        return self._matrices[model]
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Get the embeddings of `texts` by `model`, with None for the texts not in the store."""
+        keys = [self.make_key(text) for text in texts]
+        results = [None] * len(texts)
+        with self._lock:
+            matrices = self._open_model(model)
+            if matrices is None:
+                self.misses += len(texts)
+                return results
+            matrix, row_keys = matrices
+            rows = {}
+            # Stay below SQLite's limit on the number of query parameters.
+            for start in range(0, len(keys), 500):
+                chunk = keys[start : start + 500]
+                rows.update(
+                    self._conn.execute(
+                        f"SELECT key, row FROM entries WHERE model = ? AND key IN ({','.join('?' * len(chunk))})",
+                        (model, *chunk),
+                    ).fetchall()
+                )
+            found = []
+            for i, key in enumerate(keys):
+                row = rows.get(key)
+                if row is None:
+                    continue
+                embedding = np.array(matrix[row], dtype=np.float32)
+                if row_keys[row] == key:
+                    results[i] = embedding
+                    found.append(key)
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE entries SET accessed_at = ? WHERE model = ? AND key = ?",
+                [(now, model, key) for key in found],
+            )
+            self.hits += len(found)
+            self.misses += len(texts) - len(found)
+        return results
+
+    def set_many(self, model: str, texts: List[str], embeddings: List[np.ndarray]):
+        """Store the embeddings of `texts` by `model`, evicting the least recently used ones if needed."""
+        entries = {}
+        for text, embedding in zip(texts, embeddings):
+            entries[self.make_key(text)] = np.asarray(embedding).ravel()
+        if not entries:
+            return
+        dim = len(next(iter(entries.values())))
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                matrix, row_keys = self._open_model(model, dim)
+                if matrix.shape[1] != dim:
+                    raise ValueError(
+                        f"Embeddings of {model} have {matrix.shape[1]} dimensions, got {dim}."
+                    )
+                existing = set()
+                keys = list(entries)
+                for start in range(0, len(keys), 500):
+                    chunk = keys[start : start + 500]
+                    existing.update(
+                        key
+                        for key, in self._conn.execute(
+                            f"SELECT key FROM entries WHERE model = ? AND key IN ({','.join('?' * len(chunk))})",
+                            (model, *chunk),
+                        )
+                    )
+                keys = [key for key in keys if key not in existing][: len(matrix)]
+                used = self._conn.execute(
+                    "SELECT used FROM models WHERE model = ?", (model,)
+                ).fetchone()[0]
+                free_rows = list(range(used, min(used + len(keys), len(matrix))))
+                if len(free_rows) < len(keys):
+                    evicted = self._conn.execute(
+                        "SELECT key, row FROM entries WHERE model = ? ORDER BY accessed_at ASC LIMIT ?",
+                        (model, len(keys) - len(free_rows)),
+                    ).fetchall()
+                    self._conn.executemany(
+                        "DELETE FROM entries WHERE model = ? AND key = ?",
+                        [(model, key) for key, _ in evicted],
+                    )
+                    free_rows.extend(row for _, row in evicted)
+                for key, row in zip(keys, free_rows):
+                    row_keys[row] = 0
+                    matrix[row] = entries[key]
+                    row_keys[row] = key
+                self._conn.executemany(
+                    "INSERT INTO entries (model, key, row, accessed_at) VALUES (?, ?, ?, ?)",
+                    [(model, key, row, now) for key, row in zip(keys, free_rows)],
+                )
+                self._conn.execute(
+                    "UPDATE models SET used = MAX(used, ?) WHERE model = ?",
+                    (used + len(keys), model),
+                )
+                matrix.flush()
+                row_keys.flush()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.execute("UPDATE models SET used = 0")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def stats(self):
+        return {"entries": len(self), "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            self._matrices.clear()
+            self._conn.close()
+
+
+# Process-wide embedding store. Disabled unless `enable_embedding_store` is called.
+_embedding_store: Optional[EmbeddingStore] = None
+
+
+def enable_embedding_store(**kwargs) -> EmbeddingStore:
+    """Turn on the on-disk embedding store used as the embedding cache of new `KnowledgeBase` instances.
+
+    Args:
+        **kwargs: Arguments of `EmbeddingStore`, e.g., its path and maximum number of entries.
+    """
+    global _embedding_store
+    _embedding_store = EmbeddingStore(**kwargs)
+    return _embedding_store
+
+
+def disable_embedding_store():
+    global _embedding_store
+    if _embedding_store is not None:
+        _embedding_store.close()
+    _embedding_store = None
+
+
+def get_embedding_store() -> Optional[EmbeddingStore]:
+    return _embedding_store
+
+
+def _get_cached_embeddings(
+    embedding_cache: Union[Dict[str, np.ndarray], EmbeddingStore, None],
+    model: str,
+    texts: List[str],
+) -> List[Optional[np.ndarray]]:
+    if embedding_cache is None:
+        return [None] * len(texts)
+    if isinstance(embedding_cache, EmbeddingStore):
+        return embedding_cache.get_many(model, texts)
+    return [embedding_cache.get(text) for text in texts]
+
+
+def _set_cached_embeddings(
+    embedding_cache: Union[Dict[str, np.ndarray], EmbeddingStore, None],
+    model: str,
+    texts: List[str],
+    embeddings: List[np.ndarray],
+):
+    if embedding_cache is None:
+        return
+    if isinstance(embedding_cache, EmbeddingStore):
+        embedding_cache.set_many(model, texts, embeddings)
+    else:
+        embedding_cache.update(zip(texts, embeddings))
+
+
+_sentence_transformers: Dict[Tuple[str, Optional[str]], "SentenceTransformer"] = {}
+_sentence_transformers_lock = threading.Lock()
+
+
+def get_sentence_transformer(
+    model_name: Optional[str] = None, device: Optional[str] = None
+) -> "SentenceTransformer":
+    """Get a SentenceTransformer model, loaded on first use and then shared by the whole process.
+
+    Args:
+        model_name: Name or path of the model. Defaults to the SENTENCE_TRANSFORMER_MODEL environment variable,
+            then "paraphrase-MiniLM-L6-v2".
+        device: Device of the model, e.g., "cpu" or "cuda". Defaults to the SENTENCE_TRANSFORMER_DEVICE
+            environment variable, then the device picked by sentence-transformers.
+    """
+    model_name = (
+        model_name
+        or os.getenv("SENTENCE_TRANSFORMER_MODEL")
+        or "paraphrase-MiniLM-L6-v2"
+    )
+    device = device or os.getenv("SENTENCE_TRANSFORMER_DEVICE")
+    key = (model_name, device)
+    with _sentence_transformers_lock:
+        if key not in _sentence_transformers:
+            from sentence_transformers import SentenceTransformer
+
+            _sentence_transformers[key] = SentenceTransformer(model_name, device=device)
+        return _sentence_transformers[key]
+
+
+def warm_up_sentence_transformer(
+    model_name: Optional[str] = None, device: Optional[str] = None
+):
+    """Load the shared SentenceTransformer model and run it once, e.g., at server start, so that the first
+    article generation does not wait for it."""
+    get_sentence_transformer(model_name, device).encode(
+        ["warm-up"], show_progress_bar=False
+    )
+
 
 def get_text_embeddings(
     texts: Union[str, List[str]],
     max_workers: int = 5,
-    embedding_cache: Optional[Dict[str, np.ndarray]] = None,
+    embedding_cache: Union[Dict[str, np.ndarray], EmbeddingStore, None] = None,
 ) -> Tuple[np.ndarray, int]:
     """
     Get text embeddings using OpenAI's text-embedding-3-small model.
 
     Args:
         texts (Union[str, List[str]]): A single text string or a list of text strings to embed.
-        max_workers (int): The maximum number of workers for parallel processing.
+        max_workers (int): The maximum number of batched requests sent in parallel.
         api_key (str): The API key for accessing OpenAI's services.
-        embedding_cache (Optional[Dict[str, np.ndarray]]): A cache to store previously computed embeddings.
+        embedding_cache (Union[Dict[str, np.ndarray], EmbeddingStore, None]): A cache to store previously
+            computed embeddings, either a dict from text to embedding or a persistent `EmbeddingStore`.
 
     Returns:
         Tuple[np.ndarray, int]: The 2D array of embeddings and the total token usage.
     """
-    embedding_model = None
-    encoder_type = os.getenv("ENCODER_API_TYPE")
-    if encoder_type and encoder_type == "openai":
-        embedding_model = OpenAIEmbeddingModel()
-    elif encoder_type and encoder_type == "azure":
-        embedding_model = AzureOpenAIEmbeddingModel()
-    elif encoder_type == encoder_type == "together":
-        embedding_model = TogetherEmbeddingModel()
-    else:
-        raise Exception(
-            "No valid encoder type is provided. Check <repo root>/secrets.toml for the field ENCODER_API_TYPE"
-        )
+    embedding_model = get_embedding_model()
 
+    # Fresh embeddings are cast to float32, the dtype of the embeddings read from an `EmbeddingStore`, so that
+    # cached and fresh embeddings come back alike.
     def fetch_embedding(text: str) -> Tuple[str, np.ndarray, int]:
-        if embedding_cache is not None and text in embedding_cache:
-            return (
-                text,
-                embedding_cache[text],
-                0,
-            )  # Returning 0 tokens since no API call is made
         embedding, token_usage = embedding_model.get_embedding(text)
-        return text, embedding, token_usage
+        return text, np.asarray(embedding, dtype=np.float32), token_usage
 
     if isinstance(texts, str):
+        (embedding,) = _get_cached_embeddings(
+            embedding_cache, embedding_model.name, [texts]
+        )
+        if embedding is not None:
+            # Returning 0 tokens since no API call is made
+            return np.array(embedding), 0
         _, embedding, tokens = fetch_embedding(texts)
+        _set_cached_embeddings(
+            embedding_cache, embedding_model.name, [texts], [embedding]
+        )
         return np.array(embedding), tokens
 
-    embeddings = []
-    total_tokens = 0
-
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(fetch_embedding, text): text for text in texts}
+    # Duplicate texts are embedded once; results are collected by position, in linear time.
+    unique_texts = list(dict.fromkeys(texts))
+    # Texts are embedded in batches, one request per batch; a batch which fails is retried text by text.
+    results = _get_cached_embeddings(
+        embedding_cache, embedding_model.name, unique_texts
+    )
+    to_embed = [i for i, embedding in enumerate(results) if embedding is None]
 
-        for future in as_completed(futures):
+    def fetch_batch(batch: List[int]) -> Tuple[List[int], List[np.ndarray], int]:
+        batch_texts = [unique_texts[i] for i in batch]
+        try:
+            embeddings, tokens = embedding_model.get_embeddings(batch_texts)
+            return batch, list(np.asarray(embeddings, dtype=np.float32)), tokens
+        except Exception as e:
+            print(f"An error occurred for a batch of {len(batch)} texts: {e}")
+        embedded, embeddings, total_tokens = [], [], 0
+        for i in batch:
             try:
-                text, embedding, tokens = future.result()
-                embeddings.append((text, embedding, tokens))
+                _, embedding, tokens = fetch_embedding(unique_texts[i])
+                embedded.append(i)
+                embeddings.append(embedding)
                 total_tokens += tokens
             except Exception as e:
-                print(f"An error occurred for text: {futures[future]}")
+                print(f"An error occurred for text: {unique_texts[i]}")
                 print(e)
+        return embedded, embeddings, total_tokens
+
+    total_tokens = 0
+    embedded_texts, new_embeddings = [], []
+    batches = [
+        [to_embed[i] for i in batch]
+        for batch in embedding_model.get_batches([unique_texts[i] for i in to_embed])
+    ]
+    if batches:
+        with ThreadPoolExecutor(
+            max_workers=max(
+                1,
+                min(
+                    max_workers,
+                    len(batches),
+                    embedding_model.max_concurrency or max_workers,
+                ),
+            )
+        ) as executor:
+            for embedded, embeddings, tokens in executor.map(fetch_batch, batches):
+                for i, embedding in zip(embedded, embeddings):
+                    results[i] = embedding
+                    embedded_texts.append(unique_texts[i])
+                    new_embeddings.append(embedding)
+                total_tokens += tokens
+    _set_cached_embeddings(
+        embedding_cache, embedding_model.name, embedded_texts, new_embeddings
+    )
 
-    # Sort results to match the order of the input texts
-    embeddings.sort(key=lambda x: texts.index(x[0]))
-    if embedding_cache is not None:
-        for text, embedding, _ in embeddings:
-            embedding_cache[text] = embedding
-    embeddings = [result[1] for result in embeddings]
+    # Texts which could not be embedded are left out, as before.
+    embedding_by_text = dict(zip(unique_texts, results))
+    embeddings = [
+        embedding_by_text[text] for text in texts if embedding_by_text[text] is not None
+    ]
 
     return np.array(embeddings), total_tokens
@@ -0,0 +1,235 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+
+def _json_default(obj):
+    for method in ("model_dump", "to_dict"):
+        if hasattr(obj, method):
+            try:
+                return getattr(obj, method)()
+            except Exception:
+                break
+    return str(obj)
+
+
+def to_json_safe(entry: dict) -> dict:
+    """Convert a history entry, which may hold provider response objects, into plain JSON data."""
+    return json.loads(json.dumps(entry, default=_json_default, ensure_ascii=False))
+
+
+class LMHistory:
+    """Base class of the bounded sinks that can replace the `history` list of the LM wrappers.
+
+    A sink behaves like a list of the most recent entries (`max_recent` of them), which is all dspy needs to read
+    (`history[-1]`, `inspect_history()`), while entries are converted into JSON data on `append` and handed to the
+    storage of the sink. `drain()` returns the entries appended since the previous drain, which is what
+    `LMConfigs.collect_and_reset_lm_history` collects at the end of every pipeline stage.
+    """
+
+    def __init__(self, max_recent: int = 100):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=max_recent)
+
+    def append(self, entry: dict):
+        entry = to_json_safe(entry)
+        with self._lock:
+            self._recent.append(entry)
+            self._write(entry)
+
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+
+    def drain(self) -> list[dict]:
+        """Get the entries appended since the last drain."""
+        with self._lock:
+            return self._drain()
+
+    def _write(self, entry: dict):
+        """Persist an entry. Called with `self._lock` held."""
+        raise NotImplementedError
+
+    def _drain(self) -> list[dict]:
+        """Called with `self._lock` held."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __getitem__(self, index):
+        with self._lock:
+            recent = list(self._recent)
+        return recent[index]
+
+    def __len__(self):
+        return len(self._recent)
+
+    def __iter__(self):
+        with self._lock:
+            recent = list(self._recent)
+        return iter(recent)
+
+    def __reversed__(self):
+        with self._lock:
+            recent = list(self._recent)
+        return reversed(recent)
+
+
+class RingBufferHistory(LMHistory):
+    """In-memory sink keeping only the last `max_entries` entries; older entries are dropped even if not drained."""
+
+    def __init__(self, max_entries: int = 1000):
+        super().__init__(max_recent=max_entries)
+        self._undrained = 0
+
+    def _write(self, entry: dict):
+        self._undrained = min(self._undrained + 1, self._recent.maxlen)
+
+    def _drain(self) -> list[dict]:
+        entries = list(self._recent)[len(self._recent) - self._undrained :]
+        self._undrained = 0
+        return entries
+
+
+class JSONLHistory(LMHistory):
+    """Sink appending entries to a JSONL file, rotated to `<path>.1` once it exceeds `max_bytes`.
+
+    Only the current and the previous file are kept, so entries older than one rotation are dropped even if they
+    have not been drained.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: Optional[int] = 256 * 1024 * 1024,
+        max_recent: int = 100,
+    ):
+        super().__init__(max_recent=max_recent)
+        self.path = os.path.expanduser(path)
+        self.max_bytes = max_bytes
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        # Position of the first undrained entry: (rotations since then, byte offset).
+        self._drain_rotations = 0
+        self._drain_offset = self._file.tell()
+
+    def _write(self, entry: dict):
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if self.max_bytes is not None and self._file.tell() > self.max_bytes:
+            self._file.close()
+            os.replace(self.path, self.path + ".1")
+            self._file = open(self.path, "a", encoding="utf-8")
+            self._drain_rotations += 1
+
+    @staticmethod
+    def _read_entries(path: str, offset: int) -> list[dict]:
+        if not os.path.exists(path):
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            f.seek(offset)
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _drain(self) -> list[dict]:
+        entries = []
+        if self._drain_rotations == 0:
+            entries = self._read_entries(self.path, self._drain_offset)
+        else:
+            if self._drain_rotations == 1:
+                entries = self._read_entries(self.path + ".1", self._drain_offset)
+            entries += self._read_entries(self.path, 0)
+        self._drain_rotations = 0
+        self._drain_offset = self._file.tell()
+        return entries
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class SQLiteHistory(LMHistory):
+    """Sink storing entries in a SQLite file which can be shared by the LMs of several processes.
+
+    Args:
+        path: Path to the SQLite file.
+        name: Name under which the entries are stored, e.g., the attribute name of the LM in its `LMConfigs`.
+        max_entries: Number of entries of `name` to retain. None means unbounded.
+        ttl: Time-to-live of an entry in seconds. None means entries never expire.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        name: str = "default",
+        max_entries: Optional[int] = None,
+        ttl: Optional[float] = None,
+        max_recent: int = 100,
+    ):
+        super().__init__(max_recent=max_recent)
+        self.path = os.path.expanduser(path)
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS history ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, "
+            "created_at REAL NOT NULL, entry TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS history_name_id ON history (name, id)"
+        )
+        # Entries from previous sessions are not drained.
+        self._last_drained_id = self._conn.execute(
+            "SELECT COALESCE(MAX(id), 0) FROM history"
+        ).fetchone()[0]
+        self._writes_since_cleanup = 0
+
+    def _write(self, entry: dict):
+        self._conn.execute(
+            "INSERT INTO history (name, created_at, entry) VALUES (?, ?, ?)",
+            (self.name, time.time(), json.dumps(entry, ensure_ascii=False)),
+        )
+        self._writes_since_cleanup += 1
+        # Apply the retention in batches rather than on every insertion.
+        if self._writes_since_cleanup >= 100:
+            self._cleanup()
+
+    def _cleanup(self):
+        self._writes_since_cleanup = 0
+        if self.ttl is not None:
+            self._conn.execute(
+                "DELETE FROM history WHERE name = ? AND created_at < ?",
+                (self.name, time.time() - self.ttl),
+            )
+        if self.max_entries is not None:
+            self._conn.execute(
+                "DELETE FROM history WHERE name = ? AND id NOT IN "
+                "(SELECT id FROM history WHERE name = ? ORDER BY id DESC LIMIT ?)",
+                (self.name, self.name, self.max_entries),
+            )
+
+    def _drain(self) -> list[dict]:
+        self._cleanup()
+        rows = self._conn.execute(
+            "SELECT id, entry FROM history WHERE name = ? AND id > ? ORDER BY id",
+            (self.name, self._last_drained_id),
+        ).fetchall()
+        if rows:
+            self._last_drained_id = rows[-1][0]
+        return [json.loads(entry) for _, entry in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,15 +1,27 @@
 import concurrent.futures
+import copy
 import dspy
 import functools
 import hashlib
 import json
 import logging
+import threading
 import time
 from abc import ABC, abstractmethod
 from collections import OrderedDict
-from typing import Dict, List, Optional, Union, TYPE_CHECKING
+from typing import (
+    Callable,
+    Dict,
+    FrozenSet,
+    List,
+    Optional,
+    Tuple,
+    Union,
+    TYPE_CHECKING,
+)
 
-from .utils import ArticleTextProcessing
+from .history import LMHistory
+from .utils import ArticleTextProcessing, normalize_query
 
 logging.basicConfig(
     level=logging.INFO, format="%(name)s : %(levelname)-8s : %(message)s"
@@ -266,14 +278,39 @@ class Retriever:
     The retrieval model/search engine used for each part should be declared with a suffix '_rm' in the attribute name.
     """
 
-    def __init__(self, rm: dspy.Retrieve, max_thread: int = 1):
+    def __init__(self, rm: dspy.Retrieve, max_thread: int = 1, max_callers: int = 1):
+        """
+        Args:
+            rm: The retrieval model.
+            max_thread: Maximum number of concurrent searches per call to `retrieve`.
+            max_callers: Number of threads calling `retrieve` concurrently, e.g., the personas of a conversation.
+                The workers shared by all calls are sized for all of them.
+        """
         self.max_thread = max_thread
+        self.max_callers = max_callers
         self.rm = rm
+        # Long-lived workers shared by all calls to `retrieve`, which are made from many threads; as many as when
+        # every call had its own `max_thread` workers.
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_thread * max_callers, thread_name_prefix="Retriever"
+        )
+        # (Normalized query, excluded URLs) -> future of the search in progress, shared by all callers asking the
+        # same query.
+        self._in_flight: Dict[Tuple[str, FrozenSet[str]], concurrent.futures.Future] = (
+            {}
+        )
+        self._in_flight_lock = threading.Lock()
+        self._coalesced_queries = 0
 
     def collect_and_reset_rm_usage(self):
         combined_usage = []
         if hasattr(getattr(self, "rm"), "get_usage_and_reset"):
             combined_usage.append(getattr(self, "rm").get_usage_and_reset())
+        with self._in_flight_lock:
+            coalesced_queries, self._coalesced_queries = self._coalesced_queries, 0
+        # Only reported if any query was coalesced, so that the usage is unchanged otherwise.
+        if coalesced_queries:
+            combined_usage.append({"Retriever coalesced queries": coalesced_queries})
 
         name_to_usage = {}
         for usage in combined_usage:
@@ -285,36 +322,92 @@ class Retriever:
 
         return name_to_usage
 
+    def _search(self, searches: List[tuple], exclude_urls: List[str]):
+        """Run the searches, given as (key, query, future) tuples, and resolve their futures.
+
+        Retrievers implementing `forward_batch` search all queries in one batch (concurrent API calls and a
+        single webpage download pass); other retrievers are called with one query at a time.
+        """
+        try:
+            queries = [q for _, q, _ in searches]
+            if len(queries) > 1 and hasattr(self.rm, "forward_batch"):
+                query_results = self.rm.forward_batch(
+                    queries, exclude_urls=exclude_urls
+                )
+            else:
+                query_results = [
+                    self.rm(query_or_queries=[q], exclude_urls=exclude_urls)
+                    for q in queries
+                ]
+            if len(query_results) != len(queries):
+                raise ValueError(
+                    f"The retrieval model returned {len(query_results)} result lists for {len(queries)} queries."
+                )
+            for retrieved_data_list in query_results:
+                for data in retrieved_data_list:
+                    for i in range(len(data["snippets"])):
+                        # STORM generate the article with citations. We do not consider multi-hop citations.
+                        # Remove citations in the source to avoid confusion.
+                        data["snippets"][i] = ArticleTextProcessing.remove_citations(
+                            data["snippets"][i]
+                        )
+            for (_, _, future), retrieved_data_list in zip(searches, query_results):
+                future.set_result(retrieved_data_list)
+        except Exception as e:
+            for _, _, future in searches:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            with self._in_flight_lock:
+                for key, _, future in searches:
+                    if self._in_flight.get(key) is future:
+                        del self._in_flight[key]
+
+    def _get_search_futures(
+        self, queries: List[str], exclude_urls: List[str]
+    ) -> List[concurrent.futures.Future]:
+        """Start searching the queries, joining the searches in progress of the same (normalized) queries with
+        the same excluded URLs."""
+        futures = []
+        searches = []
+        excluded = frozenset(exclude_urls)
+        with self._in_flight_lock:
+            for q in queries:
+                key = (normalize_query(q), excluded)
+                future = self._in_flight.get(key)
+                if future is not None:
+                    self._coalesced_queries += 1
+                else:
+                    future = concurrent.futures.Future()
+                    self._in_flight[key] = future
+                    searches.append((key, q, future))
+                futures.append(future)
+        if searches:
+            if hasattr(self.rm, "forward_batch"):
+                self._executor.submit(self._search, searches, list(exclude_urls))
+            else:
+                for search in searches:
+                    self._executor.submit(self._search, [search], list(exclude_urls))
+        return futures
+
     def retrieve(
         self, query: Union[str, List[str]], exclude_urls: List[str] = []
     ) -> List[Information]:
+        """Search the queries concurrently.
+
+        Queries asked concurrently with the same `exclude_urls` by several callers (e.g., the personas of a
+        conversation) are searched once and share the results.
+        """
         queries = query if isinstance(query, list) else [query]
+        futures = self._get_search_futures(queries, exclude_urls)
         to_return = []
 
-        def process_query(q):
-            retrieved_data_list = self.rm(
-                query_or_queries=[q], exclude_urls=exclude_urls
-            )
-            local_to_return = []
-            for data in retrieved_data_list:
-                for i in range(len(data["snippets"])):
-                    # STORM generate the article with citations. We do not consider multi-hop citations.
-                    # Remove citations in the source to avoid confusion.
-                    data["snippets"][i] = ArticleTextProcessing.remove_citations(
-                        data["snippets"][i]
-                    )
+        for q, future in zip(queries, futures):
+            # Every caller gets its own copy of the shared results.
+            for data in copy.deepcopy(future.result()):
                 storm_info = Information.from_dict(data)
                 storm_info.meta["query"] = q
-                local_to_return.append(storm_info)
-            return local_to_return
-
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=self.max_thread
-        ) as executor:
-            results = list(executor.map(process_query, queries))
-
-        for result in results:
-            to_return.extend(result)
+                to_return.append(storm_info)
 
         return to_return
 
@@ -440,12 +533,27 @@ class LMConfigs(ABC):
                     f"Language model for {attr_name} is not initialized. Please call set_{attr_name}()"
                 )
 
+    def set_lm_history_sink(self, create_sink: Callable[[str], LMHistory]):
+        """Replace the unbounded history lists of the language models with bounded history sinks.
+
+        Args:
+            create_sink: Called with the attribute name of each language model to create its sink, e.g.,
+                `lambda name: SQLiteHistory("lm_history.sqlite", name=name, max_entries=10000)`.
+        """
+        for attr_name in self.__dict__:
+            if "_lm" in attr_name and hasattr(getattr(self, attr_name), "history"):
+                getattr(self, attr_name).history = create_sink(attr_name)
+
     def collect_and_reset_lm_history(self):
         history = []
         for attr_name in self.__dict__:
             if "_lm" in attr_name and hasattr(getattr(self, attr_name), "history"):
-                history.extend(getattr(self, attr_name).history)
-                getattr(self, attr_name).history = []
+                lm_history = getattr(self, attr_name).history
+                if isinstance(lm_history, LMHistory):
+                    history.extend(lm_history.drain())
+                else:
+                    history.extend(lm_history)
+                    getattr(self, attr_name).history = []
 
         return history
 
@@ -463,12 +571,11 @@ class LMConfigs(ABC):
                 if model_name not in model_name_to_usage:
                     model_name_to_usage[model_name] = tokens
                 else:
-                    model_name_to_usage[model_name]["prompt_tokens"] += tokens[
-                        "prompt_tokens"
-                    ]
-                    model_name_to_usage[model_name]["completion_tokens"] += tokens[
-                        "completion_tokens"
-                    ]
+                    # Sum token counts as well as LM response cache savings (see `knowledge_storm.lm.LMCacheUsage`).
+                    for key, value in tokens.items():
+                        model_name_to_usage[model_name][key] = (
+                            model_name_to_usage[model_name].get(key, 0) + value
+                        )
 
         return model_name_to_usage
 
@@ -553,6 +660,34 @@ class Engine(ABC):
             for model_name, tokens in v.items():
                 print(f"    {model_name}: {tokens}")
 
+        cache_savings = {}
+        for v in self.lm_cost.values():
+            for model_name, tokens in v.items():
+                if tokens.get("cache_hits", 0) == 0:
+                    continue
+                saved = cache_savings.setdefault(
+                    model_name,
+                    {
+                        "hits": 0,
+                        "prompt_tokens": 0,
+                        "completion_tokens": 0,
+                        "latency": 0.0,
+                    },
+                )
+                saved["hits"] += tokens["cache_hits"]
+                saved["prompt_tokens"] += tokens["cache_saved_prompt_tokens"]
+                saved["completion_tokens"] += tokens["cache_saved_completion_tokens"]
+                saved["latency"] += tokens["cache_saved_latency"]
+        if cache_savings:
+            print("***** Savings from the LM response cache: *****")
+            for model_name, saved in cache_savings.items():
+                print(
+                    f"    {model_name}: {saved['hits']} hits, "
+                    f"{saved['prompt_tokens']} prompt tokens, "
+                    f"{saved['completion_tokens']} completion tokens, "
+                    f"{saved['latency']:.4f} seconds saved"
+                )
+
         print("***** Number of queries of retrieval models: *****")
         for k, v in self.rm_cost.items():
             print(f"{k}: {v}")
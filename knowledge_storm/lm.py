@@ -1,27 +1,1023 @@
+import asyncio
+import bisect
+import concurrent.futures
+import contextlib
+import contextvars
+import copy
+import functools
+import inspect
 import logging
 import os
 import random
 import threading
-from typing import Optional, Literal, Any
+import time
+import weakref
+from collections import deque
+from itertools import islice
+from typing import Callable, Optional, Literal, Any
 
 import backoff
 import dspy
+import httpx
+import openai
 import requests
 from dsp import ERRORS, backoff_hdlr, giveup_hdlr
 from dsp.modules.hf import openai_to_hf
 from dsp.modules.hf_client import send_hftgi_request_v01_wrapped
-from openai import OpenAI
+from openai import AsyncAzureOpenAI, AsyncOpenAI, OpenAI
 from transformers import AutoTokenizer
 
+from .cache import SQLiteCache
+from .history import to_json_safe
+from .replay import LatencyModel, ReplayLog
+
 try:
-    from anthropic import RateLimitError
+    from anthropic import AsyncAnthropic, RateLimitError
 except ImportError:
+    AsyncAnthropic = None
     RateLimitError = None
 
 
+# Process-wide LM response cache shared by all LM wrappers. Disabled unless `enable_lm_cache` is called.
+_lm_cache: Optional[SQLiteCache] = None
+# Request arguments that do not change the completion and are therefore left out of the cache key.
+_CACHE_IGNORED_KWARGS = {"stream", "timeout", "request_timeout", "api_key", "api_base"}
+# Token usage of the LM call in progress. A context variable (rather than a thread local) so that concurrent
+# `acall()` coroutines on the same event loop are tracked separately.
+_call_usage: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar(
+    "_call_usage", default=None
+)
+
+# Connection pool shared by the `acall()` of all LM wrappers. httpx async clients are bound to the event loop
+# they are first used in, so there is one pool per running loop.
+_async_http_clients = weakref.WeakKeyDictionary()
+_async_http_clients_lock = threading.Lock()
+_async_http_limits = httpx.Limits(
+    max_connections=500, max_keepalive_connections=100, keepalive_expiry=30.0
+)
+
+
+# Receiver of the text streamed by LM calls made in the current context, see `stream_lm_output`.
+_stream_handler: contextvars.ContextVar[Optional[Callable[[str], None]]] = (
+    contextvars.ContextVar("_stream_handler", default=None)
+)
+
+
+def enable_lm_cache(
+    path: str = "~/.cache/knowledge_storm/lm_cache.sqlite",
+    ttl: Optional[float] = 7 * 24 * 3600,
+    max_size_bytes: Optional[int] = 512 * 1024 * 1024,
+) -> SQLiteCache:
+    """Turn on the on-disk LM response cache consulted by all LM wrappers in this module.
+
+    Args:
+        path: Path to the SQLite file. Processes pointing to the same file share the cache.
+        ttl: Time-to-live of a cached response in seconds. None means responses never expire.
+        max_size_bytes: Size bound of the cache; least recently used responses are evicted beyond it.
+    """
+    global _lm_cache
+    _lm_cache = SQLiteCache(path=path, ttl=ttl, max_size_bytes=max_size_bytes)
+    return _lm_cache
+
+
+def disable_lm_cache():
+    global _lm_cache
+    if _lm_cache is not None:
+        _lm_cache.close()
+    _lm_cache = None
+
+
+def get_lm_cache() -> Optional[SQLiteCache]:
+    return _lm_cache
+
+
+def _get_model_name(lm) -> str:
+    return (
+        getattr(lm, "model", None)
+        or lm.kwargs.get("model")
+        or lm.kwargs.get("engine")
+        or type(lm).__name__
+    )
+
+
+def _record_call_usage(prompt_tokens: int, completion_tokens: int):
+    """Attribute token usage to the LM call currently in progress (used to fill cache entries and recordings)."""
+    tracker = _call_usage.get()
+    if tracker is not None:
+        tracker["prompt_tokens"] += prompt_tokens
+        tracker["completion_tokens"] += completion_tokens
+
+
+class LMCacheUsage:
+    """Thread-safe accounting of LM calls served from the LM response cache."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.saved_prompt_tokens = 0
+        self.saved_completion_tokens = 0
+        self.saved_latency = 0.0
+
+    def log_hit(self, entry: dict):
+        with self._lock:
+            self.hits += 1
+            self.saved_prompt_tokens += entry.get("prompt_tokens", 0)
+            self.saved_completion_tokens += entry.get("completion_tokens", 0)
+            self.saved_latency += entry.get("latency", 0.0)
+
+    def get_usage_and_reset(self) -> dict:
+        """Get the cache usage to be merged into the token usage of the LM and reset it.
+
+        Returns an empty dict if no call has been served from the cache so that the usage reported by LMs
+        without cache hits stays unchanged.
+        """
+        with self._lock:
+            if self.hits == 0:
+                return {}
+            usage = {
+                "cache_hits": self.hits,
+                "cache_saved_prompt_tokens": self.saved_prompt_tokens,
+                "cache_saved_completion_tokens": self.saved_completion_tokens,
+                "cache_saved_latency": self.saved_latency,
+            }
+            self.hits = 0
+            self.saved_prompt_tokens = 0
+            self.saved_completion_tokens = 0
+            self.saved_latency = 0.0
+        return usage
+
+
+def _get_cache_key(lm, cache: SQLiteCache, prompt: str, kwargs: dict) -> str:
+    request_kwargs = {
+        k: v
+        for k, v in {**lm.kwargs, **kwargs}.items()
+        if v is not None and k not in _CACHE_IGNORED_KWARGS
+    }
+    return cache.make_key(_get_model_name(lm), request_kwargs, prompt)
+
+
+def _get_history_entry(lm, prompt: str) -> Optional[dict]:
+    """Get the history entry the LM just appended for `prompt`, as JSON data."""
+    # Other threads may have appended entries since, so the entry is looked up by prompt among the recent ones.
+    for entry in islice(reversed(lm.history), 100):
+        if isinstance(entry, dict) and entry.get("prompt") == prompt:
+            return to_json_safe(entry)
+    return None
+
+
+def _store_completions(
+    lm,
+    cache: SQLiteCache,
+    key: str,
+    prompt: str,
+    completions,
+    latency: float,
+    tracker: dict,
+):
+    if completions:
+        cache.set(
+            key,
+            {
+                "completions": completions,
+                "latency": latency,
+                "history": _get_history_entry(lm, prompt),
+                **tracker,
+            },
+        )
+
+
+def _log_cache_hit(lm, prompt: str, kwargs: dict, entry: dict):
+    """Append the history entry of a call served from the cache, marked as cached, so that history consumers
+    (`collect_and_reset_lm_history`, history sinks, `inspect_history`) see every call.
+    """
+    lm.cache_usage.log_hit(entry)
+    # Entries cached before their history entry was stored get one in the format of the OpenAI wrappers.
+    history_entry = entry.get("history") or {
+        "prompt": prompt,
+        "response": {"choices": [{"text": c} for c in entry["completions"]]},
+        "kwargs": {**lm.kwargs, **kwargs},
+    }
+    lm.history.append({**history_entry, "raw_kwargs": kwargs, "cached": True})
+
+
+def cache_lm_call(func):
+    """Decorator for `__call__` and `acall` of LM wrappers to serve completions from the LM response cache.
+
+    The cache key is a hash of the model name, the normalized request kwargs and the prompt. On a miss, the
+    completions are stored together with the token usage and latency of the call so that cache hits can be
+    reported as saved tokens and saved latency, and with the history entry of the call, which is appended to the
+    history again (with "cached": True) on every hit.
+    """
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(self, prompt, *args, **kwargs):
+            cache = get_lm_cache()
+            if cache is None:
+                return await func(self, prompt, *args, **kwargs)
+
+            key = _get_cache_key(self, cache, prompt, kwargs)
+            entry = cache.get(key)
+            if entry is not None:
+                _log_cache_hit(self, prompt, kwargs, entry)
+                return entry["completions"]
+
+            tracker = {"prompt_tokens": 0, "completion_tokens": 0}
+            token = _call_usage.set(tracker)
+            start_time = time.time()
+            try:
+                completions = await func(self, prompt, *args, **kwargs)
+            finally:
+                _call_usage.reset(token)
+            _record_call_usage(**tracker)
+            _store_completions(
+                self, cache, key, prompt, completions, time.time() - start_time, tracker
+            )
+            return completions
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, prompt, *args, **kwargs):
+        cache = get_lm_cache()
+        if cache is None:
+            return func(self, prompt, *args, **kwargs)
+
+        key = _get_cache_key(self, cache, prompt, kwargs)
+        entry = cache.get(key)
+        if entry is not None:
+            _log_cache_hit(self, prompt, kwargs, entry)
+            stream_handler = _stream_handler.get()
+            if stream_handler is not None and entry["completions"]:
+                stream_handler(entry["completions"][0])
+            return entry["completions"]
+
+        tracker = {"prompt_tokens": 0, "completion_tokens": 0}
+        token = _call_usage.set(tracker)
+        start_time = time.time()
+        try:
+            completions = func(self, prompt, *args, **kwargs)
+        finally:
+            _call_usage.reset(token)
+        _record_call_usage(**tracker)
+        _store_completions(
+            self, cache, key, prompt, completions, time.time() - start_time, tracker
+        )
+        return completions
+
+    return wrapper
+
+
+def configure_async_http_pool(
+    max_connections: Optional[int] = 500,
+    max_keepalive_connections: Optional[int] = 100,
+    keepalive_expiry: Optional[float] = 30.0,
+):
+    """Set the limits of the connection pool shared by the `acall()` of all LM wrappers.
+
+    The limits apply to pools created afterwards, i.e., to event loops which have not made an async LM call yet.
+    """
+    global _async_http_limits
+    _async_http_limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Get the pooled httpx client of the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    with _async_http_clients_lock:
+        client = _async_http_clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                limits=_async_http_limits,
+                timeout=httpx.Timeout(600.0, connect=10.0),
+            )
+            _async_http_clients[loop] = client
+    return client
+
+
+async def aclose_async_http_client():
+    """Close the pooled httpx client of the running event loop. Call it before the loop is closed."""
+    loop = asyncio.get_running_loop()
+    with _async_http_clients_lock:
+        client = _async_http_clients.pop(loop, None)
+    if client is not None:
+        await client.aclose()
+
+
+def _get_async_client(lm, create_client):
+    """Get the async provider client of `lm` for the running event loop.
+
+    `create_client` is called with the shared pooled httpx client the first time `lm` is used in a loop.
+    """
+    loop = asyncio.get_running_loop()
+    clients = lm.__dict__.setdefault("_async_clients", weakref.WeakKeyDictionary())
+    client = clients.get(loop)
+    if client is None or client.is_closed():
+        client = create_client(get_async_http_client())
+        clients[loop] = client
+    return client
+
+
+class LMRateLimiter:
+    """Token-bucket limiter for the requests sent to one provider/model.
+
+    The request and token budgets refill continuously at `rpm` and `tpm` per minute. A request is admitted once
+    both budgets suffice and fewer than `max_in_flight` requests are outstanding. The token cost of a request is
+    debited upfront from an estimate and reconciled with the actual usage reported in the response.
+    """
+
+    def __init__(
+        self,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        max_in_flight: Optional[int] = None,
+    ):
+        """
+        Args:
+            rpm: Requests per minute. None means unlimited.
+            tpm: Tokens (prompt and completion) per minute. None means unlimited.
+            max_in_flight: Maximum number of concurrent requests. None means unlimited.
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_in_flight = max_in_flight
+        self._cond = threading.Condition()
+        self._request_budget = float(rpm or 0)
+        self._token_budget = float(tpm or 0)
+        self._in_flight = 0
+        self._last_refill = time.monotonic()
+        self.throttled_requests = 0
+        self.throttled_seconds = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.rpm:
+            self._request_budget = min(
+                self.rpm, self._request_budget + elapsed * self.rpm / 60
+            )
+        if self.tpm:
+            self._token_budget = min(
+                self.tpm, self._token_budget + elapsed * self.tpm / 60
+            )
+
+    def _try_acquire(self, tokens: int) -> Optional[float]:
+        """Admit a request if the budgets allow it. Must be called with `self._cond` held.
+
+        Returns 0 if the request is admitted, otherwise the seconds to wait before trying again, or None if the
+        request has to wait for an in-flight request to finish.
+        """
+        self._refill()
+        if self.max_in_flight and self._in_flight >= self.max_in_flight:
+            return None
+        wait = 0.0
+        if self.rpm and self._request_budget < 1:
+            wait = max(wait, (1 - self._request_budget) * 60 / self.rpm)
+        if self.tpm and self._token_budget < tokens:
+            wait = max(wait, (tokens - self._token_budget) * 60 / self.tpm)
+        if wait > 0:
+            return wait
+        self._request_budget -= 1
+        self._token_budget -= tokens
+        self._in_flight += 1
+        return 0
+
+    def _clip_tokens(self, tokens: int) -> int:
+        # A request larger than the whole budget would never be admitted.
+        return min(tokens, self.tpm) if self.tpm else tokens
+
+    def acquire(self, tokens: int = 0) -> int:
+        """Block until a request estimated to use `tokens` tokens is admitted.
+
+        Returns the number of tokens debited, to be passed to `release()`.
+        """
+        tokens = self._clip_tokens(tokens)
+        start_time = time.monotonic()
+        with self._cond:
+            wait = self._try_acquire(tokens)
+            if wait == 0:
+                return tokens
+            self.throttled_requests += 1
+            while wait != 0:
+                self._cond.wait(timeout=wait)
+                wait = self._try_acquire(tokens)
+            self.throttled_seconds += time.monotonic() - start_time
+        return tokens
+
+    async def aacquire(self, tokens: int = 0) -> int:
+        """Async counterpart of `acquire()` which yields to the event loop while waiting."""
+        tokens = self._clip_tokens(tokens)
+        start_time = time.monotonic()
+        with self._cond:
+            wait = self._try_acquire(tokens)
+            if wait == 0:
+                return tokens
+            self.throttled_requests += 1
+        while wait != 0:
+            await asyncio.sleep(0.05 if wait is None else wait)
+            with self._cond:
+                wait = self._try_acquire(tokens)
+        with self._cond:
+            self.throttled_seconds += time.monotonic() - start_time
+        return tokens
+
+    def release(self, debited_tokens: int, actual_tokens: Optional[int] = None):
+        """Mark an admitted request as finished and correct its token estimate with the actual usage."""
+        with self._cond:
+            self._in_flight -= 1
+            if self.tpm and actual_tokens is not None:
+                self._token_budget = min(
+                    self.tpm, self._token_budget + debited_tokens - actual_tokens
+                )
+            self._cond.notify_all()
+
+
+# Process-wide rate limiters keyed by (provider, model); a model of None applies to all models of the provider.
+_rate_limiters: dict[tuple[str, Optional[str]], LMRateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def set_lm_rate_limit(
+    provider: str,
+    model: Optional[str] = None,
+    rpm: Optional[float] = None,
+    tpm: Optional[float] = None,
+    max_in_flight: Optional[int] = None,
+) -> LMRateLimiter:
+    """Limit the requests sent by all LM wrappers in this process to a provider or one of its models.
+
+    Args:
+        provider: The `rate_limit_provider` of the LM wrappers to limit, e.g., "openai", "azure" or "anthropic".
+        model: The model to limit. None applies the limit to all models of the provider without a limit of their
+            own, and the budget is shared by these models.
+        rpm: Requests per minute. None means unlimited.
+        tpm: Tokens per minute. None means unlimited.
+        max_in_flight: Maximum number of concurrent requests. None means unlimited.
+    """
+    limiter = LMRateLimiter(rpm=rpm, tpm=tpm, max_in_flight=max_in_flight)
+    with _rate_limiters_lock:
+        _rate_limiters[(provider, model)] = limiter
+    return limiter
+
+
+def remove_lm_rate_limit(provider: str, model: Optional[str] = None):
+    with _rate_limiters_lock:
+        _rate_limiters.pop((provider, model), None)
+
+
+def get_lm_rate_limiter(lm) -> Optional[LMRateLimiter]:
+    provider = getattr(lm, "rate_limit_provider", None)
+    if provider is None or not _rate_limiters:
+        return None
+    with _rate_limiters_lock:
+        return _rate_limiters.get(
+            (provider, _get_model_name(lm)), _rate_limiters.get((provider, None))
+        )
+
+
+def _estimate_request_tokens(lm, prompt: str, kwargs: dict) -> int:
+    """Estimate the token cost of a request: ~4 characters per prompt token plus the completion budget."""
+    kwargs = {**lm.kwargs, **kwargs}
+    max_tokens = (
+        kwargs.get("max_tokens")
+        or kwargs.get("max_output_tokens")
+        or kwargs.get("max_new_tokens")
+        or 0
+    )
+    return len(prompt) // 4 + 1 + max_tokens * (kwargs.get("n") or 1)
+
+
+def _get_response_tokens(response) -> Optional[int]:
+    """Get the total token usage reported in a provider response, or None if it is not reported."""
+    if isinstance(response, dict):
+        usage = response.get("usage")
+    else:
+        usage = getattr(response, "usage", None) or getattr(
+            response, "usage_metadata", None
+        )
+    if not usage:
+        return None
+    for prompt_key, completion_key in (
+        ("prompt_tokens", "completion_tokens"),
+        ("input_tokens", "output_tokens"),
+        ("prompt_token_count", "candidates_token_count"),
+    ):
+        if isinstance(usage, dict):
+            prompt_tokens = usage.get(prompt_key)
+            completion_tokens = usage.get(completion_key)
+        else:
+            prompt_tokens = getattr(usage, prompt_key, None)
+            completion_tokens = getattr(usage, completion_key, None)
+        if prompt_tokens is not None or completion_tokens is not None:
+            return (prompt_tokens or 0) + (completion_tokens or 0)
+    return None
+
+
+def rate_limit_lm_request(func):
+    """Decorator for the method of LM wrappers which sends a single request to the provider.
+
+    The request waits for the rate limiter configured for the provider/model of the LM via `set_lm_rate_limit`.
+    Apply it below `backoff` so that every retry is admitted by the limiter as well.
+    """
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(self, prompt, *args, **kwargs):
+            limiter = get_lm_rate_limiter(self)
+            if limiter is None:
+                return await func(self, prompt, *args, **kwargs)
+            tokens = await limiter.aacquire(
+                _estimate_request_tokens(self, prompt, kwargs)
+            )
+            response = None
+            try:
+                response = await func(self, prompt, *args, **kwargs)
+                return response
+            finally:
+                limiter.release(tokens, _get_response_tokens(response))
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, prompt, *args, **kwargs):
+        limiter = get_lm_rate_limiter(self)
+        if limiter is None:
+            return func(self, prompt, *args, **kwargs)
+        tokens = limiter.acquire(_estimate_request_tokens(self, prompt, kwargs))
+        response = None
+        try:
+            response = func(self, prompt, *args, **kwargs)
+            return response
+        finally:
+            limiter.release(tokens, _get_response_tokens(response))
+
+    return wrapper
+
+
+class LatencyHistogram:
+    """Latencies of the recent requests to one model, used to derive the delay after which a request is hedged."""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._sorted_latencies = []
+        self.hedged_requests = 0
+        self.hedge_wins = 0
+
+    def record(self, latency: float):
+        with self._lock:
+            if len(self._latencies) == self._latencies.maxlen:
+                evicted = self._latencies[0]
+                del self._sorted_latencies[
+                    bisect.bisect_left(self._sorted_latencies, evicted)
+                ]
+            self._latencies.append(latency)
+            bisect.insort(self._sorted_latencies, latency)
+
+    def log_hedge(self, won: bool):
+        with self._lock:
+            self.hedged_requests += 1
+            self.hedge_wins += int(won)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Get the q-th percentile (0-100) of the recent latencies, or None without samples."""
+        with self._lock:
+            if not self._sorted_latencies:
+                return None
+            index = min(
+                len(self._sorted_latencies) - 1,
+                int(q / 100 * len(self._sorted_latencies)),
+            )
+            return self._sorted_latencies[index]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._latencies)
+
+
+class HedgingPolicy:
+    """When to send a duplicate of a slow LM request.
+
+    Args:
+        percentile: A request still pending after this percentile of the recent latencies of its model is
+            hedged with an identical request; the first response wins.
+        min_samples: Number of latency samples of a model required before its requests are hedged.
+        min_delay: Lower bound of the hedging delay in seconds, so that fast models are not hedged on jitter.
+        max_workers: Size of the thread pool running hedged synchronous requests.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        min_samples: int = 20,
+        min_delay: float = 1.0,
+        max_workers: int = 64,
+    ):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_workers = max_workers
+
+
+_hedging_policy: Optional[HedgingPolicy] = None
+_hedging_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_latency_histograms: dict[tuple[str, str], LatencyHistogram] = {}
+_latency_histograms_lock = threading.Lock()
+
+
+def enable_lm_hedging(
+    percentile: float = 95.0,
+    min_samples: int = 20,
+    min_delay: float = 1.0,
+    max_workers: int = 64,
+) -> HedgingPolicy:
+    """Turn on hedging of slow requests for all LM wrappers in this module. See `HedgingPolicy` for the arguments.
+
+    Hedged requests are not cancelled on the wire when sent synchronously: the losing request runs to completion
+    in the background and its response is discarded, so its history entry and token usage are not logged.
+    Streamed requests are never hedged.
+    """
+    global _hedging_policy, _hedging_executor
+    with _latency_histograms_lock:
+        if _hedging_executor is not None:
+            _hedging_executor.shutdown(wait=False)
+        _hedging_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="lm_hedging"
+        )
+        _hedging_policy = HedgingPolicy(
+            percentile=percentile,
+            min_samples=min_samples,
+            min_delay=min_delay,
+            max_workers=max_workers,
+        )
+    return _hedging_policy
+
+
+def disable_lm_hedging():
+    global _hedging_policy, _hedging_executor
+    with _latency_histograms_lock:
+        _hedging_policy = None
+        if _hedging_executor is not None:
+            _hedging_executor.shutdown(wait=False)
+        _hedging_executor = None
+
+
+def _get_latency_histogram(lm) -> LatencyHistogram:
+    key = (getattr(lm, "rate_limit_provider", type(lm).__name__), _get_model_name(lm))
+    with _latency_histograms_lock:
+        if key not in _latency_histograms:
+            _latency_histograms[key] = LatencyHistogram()
+        return _latency_histograms[key]
+
+
+def get_lm_latency_stats() -> dict:
+    """Get the latency percentiles and hedging counts of the models called since hedging was enabled."""
+    with _latency_histograms_lock:
+        histograms = dict(_latency_histograms)
+    return {
+        f"{provider}/{model}": {
+            "samples": len(histogram),
+            "p50": histogram.percentile(50),
+            "p95": histogram.percentile(95),
+            "p99": histogram.percentile(99),
+            "hedged_requests": histogram.hedged_requests,
+            "hedge_wins": histogram.hedge_wins,
+        }
+        for (provider, model), histogram in histograms.items()
+    }
+
+
+def _get_hedging_delay(
+    policy: HedgingPolicy, histogram: LatencyHistogram
+) -> Optional[float]:
+    if _stream_handler.get() is not None or len(histogram) < policy.min_samples:
+        return None
+    return max(policy.min_delay, histogram.percentile(policy.percentile))
+
+
+def time_lm_request(func):
+    """Decorator for the method of LM wrappers which sends a single request to the provider.
+
+    With hedging enabled, records the latency of the request in the histogram of its model. Apply it below
+    `rate_limit_lm_request`, so that the time spent waiting for the rate limiter does not count as latency;
+    otherwise throttling would trigger hedges, which would add to the load on the limiter.
+    """
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(self, prompt, *args, **kwargs):
+            if _hedging_policy is None:
+                return await func(self, prompt, *args, **kwargs)
+            start_time = time.monotonic()
+            response = await func(self, prompt, *args, **kwargs)
+            _get_latency_histogram(self).record(time.monotonic() - start_time)
+            return response
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, prompt, *args, **kwargs):
+        if _hedging_policy is None:
+            return func(self, prompt, *args, **kwargs)
+        start_time = time.monotonic()
+        response = func(self, prompt, *args, **kwargs)
+        _get_latency_histogram(self).record(time.monotonic() - start_time)
+        return response
+
+    return wrapper
+
+
+def _copy_for_hedged_request(lm):
+    """Copy `lm` for one of the requests of a hedged call, with its own history and token usage, so that only the
+    request which wins is logged (see `_log_hedged_request`)."""
+    # Shared by the copies so that the async provider clients are still created once per event loop.
+    lm.__dict__.setdefault("_async_clients", weakref.WeakKeyDictionary())
+    request_lm = copy.copy(lm)
+    request_lm.history = []
+    for attr in ("prompt_tokens", "completion_tokens"):
+        if hasattr(request_lm, attr):
+            setattr(request_lm, attr, 0)
+    return request_lm
+
+
+def _log_hedged_request(lm, request_lm, tracker: dict):
+    """Log the history and token usage of the winning request of a hedged call to `lm`."""
+    lm.history.extend(request_lm.history)
+    if hasattr(lm, "prompt_tokens"):
+        with getattr(lm, "_token_usage_lock", None) or contextlib.nullcontext():
+            lm.prompt_tokens += request_lm.prompt_tokens
+            lm.completion_tokens += request_lm.completion_tokens
+    _record_call_usage(**tracker)
+
+
+def hedge_lm_request(func):
+    """Decorator for the method of LM wrappers which sends a single request to the provider.
+
+    With hedging enabled (see `enable_lm_hedging`), a request still pending after the configured percentile of the
+    recent latencies of its model (recorded by `time_lm_request`) is duplicated. The first successful response is
+    returned and the other request is cancelled (async) or abandoned (sync). Each request is sent through a copy
+    of the LM, and only the history and token usage of the returned one are logged.
+    """
+
+    if inspect.iscoroutinefunction(func):
+
+        async def send_request(self, prompt, *args, **kwargs):
+            request_lm = _copy_for_hedged_request(self)
+            tracker = {"prompt_tokens": 0, "completion_tokens": 0}
+            # Tasks run in a copy of the context, so the tracker is only seen by this request.
+            _call_usage.set(tracker)
+            response = await func(request_lm, prompt, *args, **kwargs)
+            return response, request_lm, tracker
+
+        def get_response(self, task):
+            response, request_lm, tracker = task.result()
+            _log_hedged_request(self, request_lm, tracker)
+            return response
+
+        @functools.wraps(func)
+        async def async_wrapper(self, prompt, *args, **kwargs):
+            policy = _hedging_policy
+            if policy is None:
+                return await func(self, prompt, *args, **kwargs)
+            histogram = _get_latency_histogram(self)
+            delay = _get_hedging_delay(policy, histogram)
+            if delay is None:
+                return await func(self, prompt, *args, **kwargs)
+
+            primary = asyncio.ensure_future(send_request(self, prompt, *args, **kwargs))
+            pending = {primary}
+            try:
+                done, pending = await asyncio.wait(pending, timeout=delay)
+                if done:
+                    return get_response(self, primary)
+                hedge = asyncio.ensure_future(
+                    send_request(self, prompt, *args, **kwargs)
+                )
+                pending.add(hedge)
+                while pending:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        if task.exception() is None:
+                            histogram.log_hedge(won=task is hedge)
+                            return get_response(self, task)
+                histogram.log_hedge(won=False)
+                return get_response(self, primary)
+            finally:
+                for task in pending:
+                    task.cancel()
+
+        return async_wrapper
+
+    def send_request(self, prompt, *args, **kwargs):
+        request_lm = _copy_for_hedged_request(self)
+        tracker = {"prompt_tokens": 0, "completion_tokens": 0}
+        # Run in a copy of the context of the caller, so the tracker is only seen by this request.
+        _call_usage.set(tracker)
+        response = func(request_lm, prompt, *args, **kwargs)
+        return response, request_lm, tracker
+
+    def get_response(self, future):
+        response, request_lm, tracker = future.result()
+        _log_hedged_request(self, request_lm, tracker)
+        return response
+
+    @functools.wraps(func)
+    def wrapper(self, prompt, *args, **kwargs):
+        policy, executor = _hedging_policy, _hedging_executor
+        if policy is None or executor is None:
+            return func(self, prompt, *args, **kwargs)
+        histogram = _get_latency_histogram(self)
+        delay = _get_hedging_delay(policy, histogram)
+        if delay is None:
+            return func(self, prompt, *args, **kwargs)
+
+        # Run the requests in the context of the caller so that they see its settings, e.g., fail-fast.
+        primary = executor.submit(
+            contextvars.copy_context().run, send_request, self, prompt, *args, **kwargs
+        )
+        done, pending = concurrent.futures.wait([primary], timeout=delay)
+        if done:
+            return get_response(self, primary)
+        hedge = executor.submit(
+            contextvars.copy_context().run, send_request, self, prompt, *args, **kwargs
+        )
+        pending.add(hedge)
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                if future.exception() is None:
+                    histogram.log_hedge(won=future is hedge)
+                    for other in pending:
+                        other.cancel()
+                    return get_response(self, future)
+        histogram.log_hedge(won=False)
+        return get_response(self, primary)
+
+    return wrapper
+
+
+class LMBackendError(Exception):
+    """Raised in place of the error of a request when the caller is about to fail over to another LM backend.
+
+    The retry decorators of the LM wrappers do not retry it, so a failing backend is given up on at once instead
+    of being retried with backoff for minutes.
+    """
+
+    def __init__(self, message: str):
+        super().__init__(message)
+        # Read by the `giveup` handlers of dsp.
+        self.message = message
+
+
+# Whether errors of LM requests made in the current context should skip the retries, see `FailoverLM`.
+_fail_fast: contextvars.ContextVar[bool] = contextvars.ContextVar(
+    "_fail_fast", default=False
+)
+
+
+def fail_fast_lm_request(func):
+    """Decorator for the method of LM wrappers which sends a single request to the provider.
+
+    Inside a fail-fast context, errors are re-raised as `LMBackendError` so that the enclosing `backoff` gives up.
+    """
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(self, prompt, *args, **kwargs):
+            try:
+                return await func(self, prompt, *args, **kwargs)
+            except Exception as e:
+                if not _fail_fast.get():
+                    raise
+                raise LMBackendError(
+                    f"Request to {_get_model_name(self)} failed with {type(e).__name__}"
+                ) from e
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, prompt, *args, **kwargs):
+        try:
+            return func(self, prompt, *args, **kwargs)
+        except Exception as e:
+            if not _fail_fast.get():
+                raise
+            raise LMBackendError(
+                f"Request to {_get_model_name(self)} failed with {type(e).__name__}"
+            ) from e
+
+    return wrapper
+
+
+def managed_lm_request(func):
+    """Decorator for the method of LM wrappers which sends a single request to the provider.
+
+    Applies the process-wide request policies: failing fast for failover, hedging and rate limiting. Apply it
+    below `backoff` so that every retry goes through the policies as well.
+    """
+    return fail_fast_lm_request(
+        hedge_lm_request(rate_limit_lm_request(time_lm_request(func)))
+    )
+
+
+async def _openai_abasic_request(lm, client, prompt: str, **kwargs) -> dict:
+    """Async counterpart of `basic_request()` of dspy.OpenAI and dspy.AzureOpenAI."""
+    raw_kwargs = kwargs
+    kwargs = {**lm.kwargs, **kwargs}
+    if lm.model_type == "chat":
+        messages = [{"role": "user", "content": prompt}]
+        if lm.system_prompt:
+            messages.insert(0, {"role": "system", "content": lm.system_prompt})
+        kwargs["messages"] = messages
+        response = await client.chat.completions.create(**kwargs)
+    else:
+        kwargs["prompt"] = prompt
+        response = await client.completions.create(**kwargs)
+    response = response.model_dump()
+
+    history = {
+        "prompt": prompt,
+        "response": response,
+        "kwargs": kwargs,
+        "raw_kwargs": raw_kwargs,
+    }
+    lm.history.append(history)
+
+    return response
+
+
+def _get_openai_completions(lm, response: dict, only_completed: bool) -> list[str]:
+    choices = response["choices"]
+    completed_choices = [c for c in choices if c["finish_reason"] != "length"]
+    if only_completed and len(completed_choices):
+        choices = completed_choices
+    return [lm._get_choice_text(c) for c in choices]
+
+
+@contextlib.contextmanager
+def stream_lm_output(stream_handler: Callable[[str], None]):
+    """Stream the text generated by the LM calls made in this context (and thread) to `stream_handler`.
+
+    `stream_handler` is called with each new piece of text of the first completion as soon as the provider
+    sends it. Only OpenAIModel (chat models) and ClaudeModel stream; completions served from the LM response
+    cache are passed to `stream_handler` at once. Other LMs ignore the handler.
+    """
+    token = _stream_handler.set(stream_handler)
+    try:
+        yield
+    finally:
+        _stream_handler.reset(token)
+
+
+def _collect_openai_stream(chunks, stream_handler: Callable[[str], None]) -> dict:
+    """Assemble the chunks of a streamed chat completion into the dict returned by a non-streamed request."""
+    response = {}
+    contents = {}
+    finish_reasons = {}
+    for chunk in chunks:
+        response["id"] = chunk.id
+        response["model"] = chunk.model
+        if getattr(chunk, "usage", None) is not None:
+            response["usage"] = chunk.usage.model_dump()
+        for choice in chunk.choices:
+            if choice.delta.content:
+                contents.setdefault(choice.index, []).append(choice.delta.content)
+                if choice.index == 0:
+                    stream_handler(choice.delta.content)
+            if choice.finish_reason is not None:
+                finish_reasons[choice.index] = choice.finish_reason
+    response["choices"] = [
+        {
+            "index": index,
+            "message": {
+                "role": "assistant",
+                "content": "".join(contents.get(index, [])),
+            },
+            "finish_reason": finish_reasons.get(index),
+        }
+        for index in sorted(set(contents) | set(finish_reasons))
+    ]
+    return response
+
+
 class OpenAIModel(dspy.OpenAI):
     """A wrapper class for dspy.OpenAI."""
 
+    rate_limit_provider = "openai"
+
     def __init__(
         self,
         model: str = "gpt-4o-mini",
@@ -33,6 +1029,10 @@ class OpenAIModel(dspy.OpenAI):
         self._token_usage_lock = threading.Lock()
         self.prompt_tokens = 0
         self.completion_tokens = 0
+        self.cache_usage = LMCacheUsage()
+        # dspy.OpenAI configures the global openai module; keep the credentials for the async client.
+        self.api_key = api_key
+        self.api_base = kwargs.get("api_base")
 
     def log_usage(self, response):
         """Log the total tokens from the OpenAI API response."""
@@ -41,6 +1041,10 @@ class OpenAIModel(dspy.OpenAI):
             with self._token_usage_lock:
                 self.prompt_tokens += usage_data.get("prompt_tokens", 0)
                 self.completion_tokens += usage_data.get("completion_tokens", 0)
+            _record_call_usage(
+                usage_data.get("prompt_tokens", 0),
+                usage_data.get("completion_tokens", 0),
+            )
 
     def get_usage_and_reset(self):
         """Get the total tokens used and reset the token usage."""
@@ -49,6 +1053,7 @@ class OpenAIModel(dspy.OpenAI):
             or self.kwargs.get("engine"): {
                 "prompt_tokens": self.prompt_tokens,
                 "completion_tokens": self.completion_tokens,
+                **self.cache_usage.get_usage_and_reset(),
             }
         }
         self.prompt_tokens = 0
@@ -56,6 +1061,34 @@ class OpenAIModel(dspy.OpenAI):
 
         return usage
 
+    @managed_lm_request
+    def basic_request(self, prompt: str, **kwargs):
+        stream_handler = _stream_handler.get()
+        if stream_handler is None or self.model_type != "chat":
+            return super().basic_request(prompt, **kwargs)
+
+        raw_kwargs = kwargs
+        kwargs = {**self.kwargs, **kwargs}
+        messages = [{"role": "user", "content": prompt}]
+        if self.system_prompt:
+            messages.insert(0, {"role": "system", "content": self.system_prompt})
+        kwargs["messages"] = messages
+        chunks = openai.chat.completions.create(
+            **kwargs, stream=True, stream_options={"include_usage": True}
+        )
+        response = _collect_openai_stream(chunks, stream_handler)
+
+        history = {
+            "prompt": prompt,
+            "response": response,
+            "kwargs": kwargs,
+            "raw_kwargs": raw_kwargs,
+        }
+        self.history.append(history)
+
+        return response
+
+    @cache_lm_call
     def __call__(
         self,
         prompt: str,
@@ -108,10 +1141,54 @@ class OpenAIModel(dspy.OpenAI):
 
         return completions
 
+    @backoff.on_exception(
+        backoff.expo,
+        ERRORS,
+        max_time=1000,
+        on_backoff=backoff_hdlr,
+        giveup=giveup_hdlr,
+    )
+    async def arequest(self, prompt: str, **kwargs):
+        """Async counterpart of `request()`."""
+        if "model_type" in kwargs:
+            del kwargs["model_type"]
+        return await self.abasic_request(prompt, **kwargs)
+
+    @managed_lm_request
+    async def abasic_request(self, prompt: str, **kwargs):
+        client = _get_async_client(
+            self,
+            lambda http_client: AsyncOpenAI(
+                api_key=self.api_key or openai.api_key,
+                base_url=self.api_base or openai.base_url,
+                http_client=http_client,
+            ),
+        )
+        return await _openai_abasic_request(self, client, prompt, **kwargs)
+
+    @cache_lm_call
+    async def acall(
+        self,
+        prompt: str,
+        only_completed: bool = True,
+        return_sorted: bool = False,
+        **kwargs,
+    ) -> list[str]:
+        """Async counterpart of `__call__()` sharing the connection pool of the running event loop."""
+        assert only_completed, "for now"
+        assert return_sorted is False, "for now"
+
+        response = await self.arequest(prompt, **kwargs)
+        self.log_usage(response)
+
+        return _get_openai_completions(self, response, only_completed)
+
 
 class DeepSeekModel(dspy.OpenAI):
     """A wrapper class for DeepSeek API, compatible with dspy.OpenAI."""
 
+    rate_limit_provider = "deepseek"
+
     def __init__(
         self,
         model: str = "deepseek-chat",
@@ -123,6 +1200,7 @@ class DeepSeekModel(dspy.OpenAI):
         self._token_usage_lock = threading.Lock()
         self.prompt_tokens = 0
         self.completion_tokens = 0
+        self.cache_usage = LMCacheUsage()
         self.model = model
         self.api_key = api_key or os.getenv("DEEPSEEK_API_KEY")
         self.api_base = api_base
@@ -138,6 +1216,10 @@ class DeepSeekModel(dspy.OpenAI):
             with self._token_usage_lock:
                 self.prompt_tokens += usage_data.get("prompt_tokens", 0)
                 self.completion_tokens += usage_data.get("completion_tokens", 0)
+            _record_call_usage(
+                usage_data.get("prompt_tokens", 0),
+                usage_data.get("completion_tokens", 0),
+            )
 
     def get_usage_and_reset(self):
         """Get the total tokens used and reset the token usage."""
@@ -145,6 +1227,7 @@ class DeepSeekModel(dspy.OpenAI):
             self.model: {
                 "prompt_tokens": self.prompt_tokens,
                 "completion_tokens": self.completion_tokens,
+                **self.cache_usage.get_usage_and_reset(),
             }
         }
         self.prompt_tokens = 0
@@ -158,6 +1241,7 @@ class DeepSeekModel(dspy.OpenAI):
         on_backoff=backoff_hdlr,
         giveup=giveup_hdlr,
     )
+    @managed_lm_request
     def _create_completion(self, prompt: str, **kwargs):
         """Create a completion using the DeepSeek API."""
         headers = {
@@ -175,6 +1259,32 @@ class DeepSeekModel(dspy.OpenAI):
         response.raise_for_status()
         return response.json()
 
+    @backoff.on_exception(
+        backoff.expo,
+        ERRORS,
+        max_time=1000,
+        on_backoff=backoff_hdlr,
+        giveup=giveup_hdlr,
+    )
+    @managed_lm_request
+    async def _acreate_completion(self, prompt: str, **kwargs):
+        """Async counterpart of `_create_completion()` using the shared connection pool."""
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}",
+        }
+        data = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            **kwargs,
+        }
+        response = await get_async_http_client().post(
+            f"{self.api_base}/v1/chat/completions", headers=headers, json=data
+        )
+        response.raise_for_status()
+        return response.json()
+
+    @cache_lm_call
     def __call__(
         self,
         prompt: str,
@@ -203,10 +1313,39 @@ class DeepSeekModel(dspy.OpenAI):
 
         return completions
 
+    @cache_lm_call
+    async def acall(
+        self,
+        prompt: str,
+        only_completed: bool = True,
+        return_sorted: bool = False,
+        **kwargs,
+    ) -> list[str]:
+        """Async counterpart of `__call__()`."""
+        assert only_completed, "for now"
+        assert return_sorted is False, "for now"
+
+        response = await self._acreate_completion(prompt, **kwargs)
+        self.log_usage(response)
+
+        choices = response["choices"]
+        completions = [choice["message"]["content"] for choice in choices]
+
+        history = {
+            "prompt": prompt,
+            "response": response,
+            "kwargs": kwargs,
+        }
+        self.history.append(history)
+
+        return completions
+
 
 class AzureOpenAIModel(dspy.AzureOpenAI):
     """A wrapper class for dspy.AzureOpenAI."""
 
+    rate_limit_provider = "azure"
+
     def __init__(
         self,
         api_base: Optional[str] = None,
@@ -227,6 +1366,7 @@ class AzureOpenAIModel(dspy.AzureOpenAI):
         self._token_usage_lock = threading.Lock()
         self.prompt_tokens = 0
         self.completion_tokens = 0
+        self.cache_usage = LMCacheUsage()
 
     def log_usage(self, response):
         """Log the total tokens from the OpenAI API response.
@@ -237,6 +1377,10 @@ class AzureOpenAIModel(dspy.AzureOpenAI):
             with self._token_usage_lock:
                 self.prompt_tokens += usage_data.get("prompt_tokens", 0)
                 self.completion_tokens += usage_data.get("completion_tokens", 0)
+            _record_call_usage(
+                usage_data.get("prompt_tokens", 0),
+                usage_data.get("completion_tokens", 0),
+            )
 
     def get_usage_and_reset(self):
         """Get the total tokens used and reset the token usage."""
@@ -245,6 +1389,7 @@ class AzureOpenAIModel(dspy.AzureOpenAI):
             or self.kwargs.get("engine"): {
                 "prompt_tokens": self.prompt_tokens,
                 "completion_tokens": self.completion_tokens,
+                **self.cache_usage.get_usage_and_reset(),
             }
         }
         self.prompt_tokens = 0
@@ -252,10 +1397,71 @@ class AzureOpenAIModel(dspy.AzureOpenAI):
 
         return usage
 
+    @managed_lm_request
+    def basic_request(self, prompt: str, **kwargs):
+        return super().basic_request(prompt, **kwargs)
+
+    @cache_lm_call
+    def __call__(
+        self,
+        prompt: str,
+        only_completed: bool = True,
+        return_sorted: bool = False,
+        **kwargs,
+    ) -> list[dict[str, Any]]:
+        return super().__call__(
+            prompt, only_completed=only_completed, return_sorted=return_sorted, **kwargs
+        )
+
+    @backoff.on_exception(
+        backoff.expo,
+        ERRORS,
+        max_time=1000,
+        on_backoff=backoff_hdlr,
+        giveup=giveup_hdlr,
+    )
+    async def arequest(self, prompt: str, **kwargs):
+        """Async counterpart of `request()`."""
+        if "model_type" in kwargs:
+            del kwargs["model_type"]
+        return await self.abasic_request(prompt, **kwargs)
+
+    @managed_lm_request
+    async def abasic_request(self, prompt: str, **kwargs):
+        client = _get_async_client(
+            self,
+            lambda http_client: AsyncAzureOpenAI(
+                azure_endpoint=self.api_base,
+                api_key=self.api_key,
+                api_version=self.api_version,
+                http_client=http_client,
+            ),
+        )
+        return await _openai_abasic_request(self, client, prompt, **kwargs)
+
+    @cache_lm_call
+    async def acall(
+        self,
+        prompt: str,
+        only_completed: bool = True,
+        return_sorted: bool = False,
+        **kwargs,
+    ) -> list[str]:
+        """Async counterpart of `__call__()` sharing the connection pool of the running event loop."""
+        assert only_completed, "for now"
+        assert return_sorted is False, "for now"
+
+        response = await self.arequest(prompt, **kwargs)
+        self.log_usage(response)
+
+        return _get_openai_completions(self, response, only_completed)
+
 
 class GroqModel(dspy.OpenAI):
     """A wrapper class for Groq API (https://console.groq.com/), compatible with dspy.OpenAI."""
 
+    rate_limit_provider = "groq"
+
     def __init__(
         self,
         model: str = "llama3-70b-8192",
@@ -267,6 +1473,7 @@ class GroqModel(dspy.OpenAI):
         self._token_usage_lock = threading.Lock()
         self.prompt_tokens = 0
         self.completion_tokens = 0
+        self.cache_usage = LMCacheUsage()
         self.model = model
         self.api_key = api_key or os.getenv("GROQ_API_KEY")
         self.api_base = api_base
@@ -282,6 +1489,10 @@ class GroqModel(dspy.OpenAI):
             with self._token_usage_lock:
                 self.prompt_tokens += usage_data.get("prompt_tokens", 0)
                 self.completion_tokens += usage_data.get("completion_tokens", 0)
+            _record_call_usage(
+                usage_data.get("prompt_tokens", 0),
+                usage_data.get("completion_tokens", 0),
+            )
 
     def get_usage_and_reset(self):
         """Get the total tokens used and reset the token usage."""
@@ -289,6 +1500,7 @@ class GroqModel(dspy.OpenAI):
             self.model: {
                 "prompt_tokens": self.prompt_tokens,
                 "completion_tokens": self.completion_tokens,
+                **self.cache_usage.get_usage_and_reset(),
             }
         }
         self.prompt_tokens = 0
@@ -302,6 +1514,7 @@ class GroqModel(dspy.OpenAI):
         on_backoff=backoff_hdlr,
         giveup=giveup_hdlr,
     )
+    @managed_lm_request
     def _create_completion(self, prompt: str, **kwargs):
         """Create a completion using the Groq API."""
         headers = {
@@ -338,6 +1551,7 @@ class GroqModel(dspy.OpenAI):
         response.raise_for_status()
         return response.json()
 
+    @cache_lm_call
     def __call__(
         self,
         prompt: str,
@@ -370,6 +1584,8 @@ class GroqModel(dspy.OpenAI):
 class ClaudeModel(dspy.dsp.modules.lm.LM):
     """Copied from dspy/dsp/modules/anthropic.py with the addition of tracking token usage."""
 
+    rate_limit_provider = "anthropic"
+
     def __init__(
         self,
         model: str,
@@ -406,6 +1622,7 @@ class ClaudeModel(dspy.dsp.modules.lm.LM):
         self._token_usage_lock = threading.Lock()
         self.prompt_tokens = 0
         self.completion_tokens = 0
+        self.cache_usage = LMCacheUsage()
 
     def log_usage(self, response):
         """Log the total tokens from the Anthropic API response."""
@@ -414,6 +1631,7 @@ class ClaudeModel(dspy.dsp.modules.lm.LM):
             with self._token_usage_lock:
                 self.prompt_tokens += usage_data.input_tokens
                 self.completion_tokens += usage_data.output_tokens
+            _record_call_usage(usage_data.input_tokens, usage_data.output_tokens)
 
     def get_usage_and_reset(self):
         """Get the total tokens used and reset the token usage."""
@@ -421,6 +1639,7 @@ class ClaudeModel(dspy.dsp.modules.lm.LM):
             self.model: {
                 "prompt_tokens": self.prompt_tokens,
                 "completion_tokens": self.completion_tokens,
+                **self.cache_usage.get_usage_and_reset(),
             }
         }
         self.prompt_tokens = 0
@@ -428,13 +1647,45 @@ class ClaudeModel(dspy.dsp.modules.lm.LM):
 
         return usage
 
+    @managed_lm_request
     def basic_request(self, prompt: str, **kwargs):
         raw_kwargs = kwargs
         kwargs = {**self.kwargs, **kwargs}
         # caching mechanism requires hashable kwargs
         kwargs["messages"] = [{"role": "user", "content": prompt}]
         kwargs.pop("n")
-        response = self.client.messages.create(**kwargs)
+        stream_handler = _stream_handler.get()
+        if stream_handler is None:
+            response = self.client.messages.create(**kwargs)
+        else:
+            with self.client.messages.stream(**kwargs) as stream:
+                for text in stream.text_stream:
+                    stream_handler(text)
+                response = stream.get_final_message()
+        self._log_history(prompt, response, kwargs, raw_kwargs)
+        return response
+
+    @managed_lm_request
+    async def abasic_request(self, prompt: str, **kwargs):
+        """Async counterpart of `basic_request()` using the shared connection pool."""
+        raw_kwargs = kwargs
+        kwargs = {**self.kwargs, **kwargs}
+        kwargs["messages"] = [{"role": "user", "content": prompt}]
+        kwargs.pop("n")
+        client = _get_async_client(self, self._create_async_client)
+        response = await client.messages.create(**kwargs)
+        self._log_history(prompt, response, kwargs, raw_kwargs)
+        return response
+
+    def _create_async_client(self, http_client: httpx.AsyncClient):
+        try:
+            return AsyncAnthropic(api_key=self.api_key, http_client=http_client)
+        except TypeError:
+            # Recent anthropic SDKs ship their own HTTP stack and reject httpx clients; fall back to the
+            # connection pool of the SDK client, which is still reused across calls in the same event loop.
+            return AsyncAnthropic(api_key=self.api_key)
+
+    def _log_history(self, prompt: str, response, kwargs: dict, raw_kwargs: dict):
         # history = {
         #     "prompt": prompt,
         #     "response": response,
@@ -459,7 +1710,6 @@ class ClaudeModel(dspy.dsp.modules.lm.LM):
             "raw_kwargs": raw_kwargs,
         }
         self.history.append(json_serializable_history)
-        return response
 
     @backoff.on_exception(
         backoff.expo,
@@ -473,6 +1723,19 @@ class ClaudeModel(dspy.dsp.modules.lm.LM):
         """Handles retrieval of completions from Anthropic whilst handling API errors."""
         return self.basic_request(prompt, **kwargs)
 
+    @backoff.on_exception(
+        backoff.expo,
+        (RateLimitError,),
+        max_time=1000,
+        max_tries=8,
+        on_backoff=backoff_hdlr,
+        giveup=giveup_hdlr,
+    )
+    async def arequest(self, prompt: str, **kwargs):
+        """Async counterpart of `request()`."""
+        return await self.abasic_request(prompt, **kwargs)
+
+    @cache_lm_call
     def __call__(self, prompt, only_completed=True, return_sorted=False, **kwargs):
         """Retrieves completions from Anthropic.
 
@@ -502,6 +1765,19 @@ class ClaudeModel(dspy.dsp.modules.lm.LM):
             completions = [c.text for c in response.content]
         return completions
 
+    @cache_lm_call
+    async def acall(self, prompt, only_completed=True, return_sorted=False, **kwargs):
+        """Async counterpart of `__call__()`."""
+        assert only_completed, "for now"
+        assert return_sorted is False, "for now"
+        n = kwargs.pop("n", 1)
+        completions = []
+        for _ in range(n):
+            response = await self.arequest(prompt, **kwargs)
+            self.log_usage(response)
+            completions = [c.text for c in response.content]
+        return completions
+
 
 class VLLMClient(dspy.dsp.LM):
     """A client compatible with vLLM HTTP server.
@@ -509,6 +1785,8 @@ class VLLMClient(dspy.dsp.LM):
     vLLM HTTP server is designed to be compatible with the OpenAI API. Use OpenAI client to interact with the server.
     """
 
+    rate_limit_provider = "vllm"
+
     def __init__(
         self,
         model,
@@ -526,11 +1804,14 @@ class VLLMClient(dspy.dsp.LM):
         self.base_url = f"{url}:{port}/v1/"
         if model_type == "chat":
             self.base_url += "chat/"
+        self.api_key = api_key
         self.client = OpenAI(base_url=self.base_url, api_key=api_key)
         self.prompt_tokens = 0
         self.completion_tokens = 0
         self._token_usage_lock = threading.Lock()
+        self.cache_usage = LMCacheUsage()
 
+    @managed_lm_request
     def basic_request(self, prompt, **kwargs):
         completion = self.client.chat.completions.create(
             **kwargs,
@@ -538,6 +1819,20 @@ class VLLMClient(dspy.dsp.LM):
         )
         return completion
 
+    @managed_lm_request
+    async def abasic_request(self, prompt, **kwargs):
+        client = _get_async_client(
+            self,
+            lambda http_client: AsyncOpenAI(
+                base_url=self.base_url, api_key=self.api_key, http_client=http_client
+            ),
+        )
+        completion = await client.chat.completions.create(
+            **kwargs,
+            messages=[{"role": "user", "content": prompt}],
+        )
+        return completion
+
     @backoff.on_exception(
         backoff.expo,
         ERRORS,
@@ -547,6 +1842,15 @@ class VLLMClient(dspy.dsp.LM):
     def request(self, prompt: str, **kwargs):
         return self.basic_request(prompt, **kwargs)
 
+    @backoff.on_exception(
+        backoff.expo,
+        ERRORS,
+        max_time=1000,
+        on_backoff=backoff_hdlr,
+    )
+    async def arequest(self, prompt: str, **kwargs):
+        return await self.abasic_request(prompt, **kwargs)
+
     def log_usage(self, response):
         """Log the total tokens from the response."""
         usage_data = response.usage
@@ -554,6 +1858,7 @@ class VLLMClient(dspy.dsp.LM):
             with self._token_usage_lock:
                 self.prompt_tokens += usage_data.prompt_tokens
                 self.completion_tokens += usage_data.completion_tokens
+            _record_call_usage(usage_data.prompt_tokens, usage_data.completion_tokens)
 
     def get_usage_and_reset(self):
         """Get the total tokens used and reset the token usage."""
@@ -562,6 +1867,7 @@ class VLLMClient(dspy.dsp.LM):
             or self.kwargs.get("engine"): {
                 "prompt_tokens": self.prompt_tokens,
                 "completion_tokens": self.completion_tokens,
+                **self.cache_usage.get_usage_and_reset(),
             }
         }
         self.prompt_tokens = 0
@@ -569,6 +1875,7 @@ class VLLMClient(dspy.dsp.LM):
 
         return usage
 
+    @cache_lm_call
     def __call__(self, prompt: str, **kwargs):
         kwargs = {**self.kwargs, **kwargs}
 
@@ -592,10 +1899,37 @@ class VLLMClient(dspy.dsp.LM):
 
         return completions
 
+    @cache_lm_call
+    async def acall(self, prompt: str, **kwargs):
+        """Async counterpart of `__call__()`."""
+        kwargs = {**self.kwargs, **kwargs}
+
+        try:
+            response = await self.arequest(prompt, **kwargs)
+        except Exception as e:
+            print(f"Failed to generate completion: {e}")
+            raise Exception(e)
+
+        self.log_usage(response)
+
+        choices = response.choices
+        completions = [choice.message.content for choice in choices]
+
+        history = {
+            "prompt": prompt,
+            "response": response,
+            "kwargs": kwargs,
+        }
+        self.history.append(history)
+
+        return completions
+
 
 class OllamaClient(dspy.OllamaLocal):
     """A wrapper class for dspy.OllamaClient."""
 
+    rate_limit_provider = "ollama"
+
     def __init__(self, model, port, url="http://localhost", **kwargs):
         """Copied from dspy/dsp/modules/hf_client.py with the addition of storing additional kwargs."""
         # Check if the URL has 'http://' or 'https://'
@@ -604,9 +1938,22 @@ class OllamaClient(dspy.OllamaLocal):
         super().__init__(model=model, base_url=f"{url}:{port}", **kwargs)
         # Store additional kwargs for the generate method.
         self.kwargs = {**self.kwargs, **kwargs}
+        self.cache_usage = LMCacheUsage()
+
+    @managed_lm_request
+    def basic_request(self, prompt: str, **kwargs):
+        return super().basic_request(prompt, **kwargs)
+
+    @cache_lm_call
+    def __call__(self, prompt: str, only_completed=True, return_sorted=False, **kwargs):
+        return super().__call__(
+            prompt, only_completed=only_completed, return_sorted=return_sorted, **kwargs
+        )
 
 
 class TGIClient(dspy.HFClientTGI):
+    rate_limit_provider = "tgi"
+
     def __init__(self, model, port, url, http_request_kwargs=None, **kwargs):
         super().__init__(
             model=model,
@@ -615,7 +1962,15 @@ class TGIClient(dspy.HFClientTGI):
             http_request_kwargs=http_request_kwargs,
             **kwargs,
         )
+        self.cache_usage = LMCacheUsage()
 
+    @cache_lm_call
+    def __call__(self, prompt: str, only_completed=True, return_sorted=False, **kwargs):
+        return super().__call__(
+            prompt, only_completed=only_completed, return_sorted=return_sorted, **kwargs
+        )
+
+    @managed_lm_request
     def _generate(self, prompt, **kwargs):
         """Copied from dspy/dsp/modules/hf_client.py with the addition of removing hard-coded parameters."""
         kwargs = {**self.kwargs, **kwargs}
@@ -671,6 +2026,8 @@ class TGIClient(dspy.HFClientTGI):
 class TogetherClient(dspy.HFModel):
     """A wrapper class for dspy.Together."""
 
+    rate_limit_provider = "together"
+
     def __init__(
         self,
         model,
@@ -724,6 +2081,7 @@ class TogetherClient(dspy.HFModel):
         self._token_usage_lock = threading.Lock()
         self.prompt_tokens = 0
         self.completion_tokens = 0
+        self.cache_usage = LMCacheUsage()
 
     def log_usage(self, response):
         """Log the total tokens from the OpenAI API response."""
@@ -732,6 +2090,10 @@ class TogetherClient(dspy.HFModel):
             with self._token_usage_lock:
                 self.prompt_tokens += usage_data.get("prompt_tokens", 0)
                 self.completion_tokens += usage_data.get("completion_tokens", 0)
+            _record_call_usage(
+                usage_data.get("prompt_tokens", 0),
+                usage_data.get("completion_tokens", 0),
+            )
 
     def get_usage_and_reset(self):
         """Get the total tokens used and reset the token usage."""
@@ -739,6 +2101,7 @@ class TogetherClient(dspy.HFModel):
             self.model: {
                 "prompt_tokens": self.prompt_tokens,
                 "completion_tokens": self.completion_tokens,
+                **self.cache_usage.get_usage_and_reset(),
             }
         }
         self.prompt_tokens = 0
@@ -746,12 +2109,19 @@ class TogetherClient(dspy.HFModel):
 
         return usage
 
+    @cache_lm_call
+    def __call__(self, prompt, only_completed=True, return_sorted=False, **kwargs):
+        return super().__call__(
+            prompt, only_completed=only_completed, return_sorted=return_sorted, **kwargs
+        )
+
     @backoff.on_exception(
         backoff.expo,
         ERRORS,
         max_time=1000,
         on_backoff=backoff_hdlr,
     )
+    @managed_lm_request
     def _generate(self, prompt, **kwargs):
         kwargs = {**self.kwargs, **kwargs}
 
@@ -820,6 +2190,8 @@ class TogetherClient(dspy.HFModel):
 class GoogleModel(dspy.dsp.modules.lm.LM):
     """A wrapper class for Google Gemini API."""
 
+    rate_limit_provider = "google"
+
     def __init__(
         self,
         model: str,
@@ -867,6 +2239,7 @@ class GoogleModel(dspy.dsp.modules.lm.LM):
         self._token_usage_lock = threading.Lock()
         self.prompt_tokens = 0
         self.completion_tokens = 0
+        self.cache_usage = LMCacheUsage()
 
     def log_usage(self, response):
         """Log the total tokens from the Google API response."""
@@ -875,6 +2248,9 @@ class GoogleModel(dspy.dsp.modules.lm.LM):
             with self._token_usage_lock:
                 self.prompt_tokens += usage_data.prompt_token_count
                 self.completion_tokens += usage_data.candidates_token_count
+            _record_call_usage(
+                usage_data.prompt_token_count, usage_data.candidates_token_count
+            )
 
     def get_usage_and_reset(self):
         """Get the total tokens used and reset the token usage."""
@@ -882,6 +2258,7 @@ class GoogleModel(dspy.dsp.modules.lm.LM):
             self.model: {
                 "prompt_tokens": self.prompt_tokens,
                 "completion_tokens": self.completion_tokens,
+                **self.cache_usage.get_usage_and_reset(),
             }
         }
         self.prompt_tokens = 0
@@ -889,6 +2266,7 @@ class GoogleModel(dspy.dsp.modules.lm.LM):
 
         return usage
 
+    @managed_lm_request
     def basic_request(self, prompt: str, **kwargs):
         raw_kwargs = kwargs
         kwargs = {
@@ -923,6 +2301,7 @@ class GoogleModel(dspy.dsp.modules.lm.LM):
         """Handles retrieval of completions from Google whilst handling API errors"""
         return self.basic_request(prompt, **kwargs)
 
+    @cache_lm_call
     def __call__(
         self,
         prompt: str,
@@ -942,3 +2321,433 @@ class GoogleModel(dspy.dsp.modules.lm.LM):
             completions.append(response.parts[0].text)
 
         return completions
+
+
+class CircuitBreaker:
+    """Sliding-window error-rate circuit breaker of one LM backend.
+
+    The circuit opens once at least `min_requests` requests were made in the last `window` seconds and the share
+    of failed ones reaches `failure_rate_threshold`. An open circuit rejects requests for `cooldown` seconds and
+    then lets a single trial request through, which closes the circuit on success and re-opens it on failure.
+    """
+
+    def __init__(
+        self,
+        window: float = 60.0,
+        min_requests: int = 5,
+        failure_rate_threshold: float = 0.5,
+        cooldown: float = 30.0,
+    ):
+        self.window = window
+        self.min_requests = min_requests
+        self.failure_rate_threshold = failure_rate_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._outcomes = deque()
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def _drop_old_outcomes(self, now: float):
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            self._outcomes.popleft()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.cooldown:
+                return "open"
+            return "half_open"
+
+    def would_allow_request(self) -> bool:
+        """Whether `allow_request()` would let a request through, without taking the trial slot of the circuit."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            return (
+                time.monotonic() - self._opened_at >= self.cooldown
+                and not self._trial_in_flight
+            )
+
+    def allow_request(self) -> bool:
+        """Let a request through, taking the trial slot if the circuit is half-open. Call it only right before
+        sending the request, and record its outcome."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if (
+                time.monotonic() - self._opened_at < self.cooldown
+                or self._trial_in_flight
+            ):
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._opened_at is not None:
+                if not self._trial_in_flight:
+                    return
+                self._opened_at = None
+                self._trial_in_flight = False
+                self._outcomes.clear()
+            self._outcomes.append((now, True))
+            self._drop_old_outcomes(now)
+
+    def record_failure(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._opened_at is not None:
+                if self._trial_in_flight:
+                    self._opened_at = now
+                    self._trial_in_flight = False
+                return
+            self._outcomes.append((now, False))
+            self._drop_old_outcomes(now)
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            if (
+                len(self._outcomes) >= self.min_requests
+                and failures / len(self._outcomes) >= self.failure_rate_threshold
+            ):
+                self._opened_at = now
+                self._outcomes.clear()
+
+
+class FailoverLM(dspy.dsp.modules.lm.LM):
+    """Route LM calls to the first healthy backend of an ordered list of LM wrappers.
+
+    Every backend has a `CircuitBreaker`. Calls skip backends with an open circuit, and a backend failing while
+    another one can take over is given up on at once (its retries are skipped) instead of backing off. The last
+    candidate backend keeps its usual retries. Token usage is reported per backend.
+    """
+
+    def __init__(
+        self,
+        backends: list,
+        window: float = 60.0,
+        min_requests: int = 5,
+        failure_rate_threshold: float = 0.5,
+        cooldown: float = 30.0,
+    ):
+        """
+        Args:
+            backends: LM wrappers in order of preference, e.g., [OpenAIModel(...), AzureOpenAIModel(...)].
+            window, min_requests, failure_rate_threshold, cooldown: Settings of the circuit breaker of each
+                backend, see `CircuitBreaker`.
+        """
+        if not backends:
+            raise ValueError("FailoverLM requires at least one backend.")
+        self.backends = list(backends)
+        super().__init__(model=_get_model_name(self.backends[0]))
+        self.provider = self.backends[0].provider
+        # Share the request settings of the primary backend, e.g., for `max_tokens` read by dspy.
+        self.kwargs = self.backends[0].kwargs
+        self.circuit_breakers = [
+            CircuitBreaker(
+                window=window,
+                min_requests=min_requests,
+                failure_rate_threshold=failure_rate_threshold,
+                cooldown=cooldown,
+            )
+            for _ in self.backends
+        ]
+        self._failed_requests = [0] * len(self.backends)
+        self._failed_requests_lock = threading.Lock()
+
+    @property
+    def history(self):
+        return self._history
+
+    @history.setter
+    def history(self, value):
+        # The backends append to the history of the failover LM so that it can be collected and reset as a whole.
+        self._history = value
+        for backend in self.backends:
+            backend.history = value
+
+    def _get_candidates(self) -> tuple[list[int], bool]:
+        """Get the backends to try in order, and whether they are tried regardless of their circuit.
+
+        The circuits are only peeked at: the trial slot of a half-open circuit is taken right before its backend is
+        actually tried (see `_admit`), so that backends which are never reached keep their slot.
+        """
+        candidates = [
+            i
+            for i, breaker in enumerate(self.circuit_breakers)
+            if breaker.would_allow_request()
+        ]
+        if candidates:
+            return candidates, False
+        # With all circuits open, trying the backends anyway beats failing the call.
+        return list(range(len(self.backends))), True
+
+    def _admit(self, i: int, forced: bool) -> bool:
+        # Another call may have taken the trial slot of a half-open circuit since the candidates were listed.
+        return forced or self.circuit_breakers[i].allow_request()
+
+    def _log_failure(self, i: int, error: Exception, is_last: bool):
+        self.circuit_breakers[i].record_failure()
+        with self._failed_requests_lock:
+            self._failed_requests[i] += 1
+        if not is_last:
+            logging.warning(
+                f"LM backend {_get_model_name(self.backends[i])} failed ({error}), failing over to the next backend."
+            )
+
+    def _call_with_failover(self, call):
+        candidates, forced = self._get_candidates()
+        error = None
+        for position, i in enumerate(candidates):
+            if not self._admit(i, forced):
+                continue
+            is_last = position == len(candidates) - 1
+            token = _fail_fast.set(not is_last)
+            try:
+                result = call(self.backends[i])
+            except Exception as e:
+                self._log_failure(i, e, is_last)
+                if is_last:
+                    raise
+                error = e
+                continue
+            finally:
+                _fail_fast.reset(token)
+            self.circuit_breakers[i].record_success()
+            return result
+        raise error or LMBackendError("No LM backend of FailoverLM is available.")
+
+    async def _acall_with_failover(self, call):
+        candidates, forced = self._get_candidates()
+        candidates = [i for i in candidates if hasattr(self.backends[i], "acall")]
+        if not candidates:
+            raise ValueError("None of the backends of FailoverLM supports acall().")
+        error = None
+        for position, i in enumerate(candidates):
+            if not self._admit(i, forced):
+                continue
+            is_last = position == len(candidates) - 1
+            token = _fail_fast.set(not is_last)
+            try:
+                result = await call(self.backends[i])
+            except Exception as e:
+                self._log_failure(i, e, is_last)
+                if is_last:
+                    raise
+                error = e
+                continue
+            finally:
+                _fail_fast.reset(token)
+            self.circuit_breakers[i].record_success()
+            return result
+        raise error or LMBackendError("No LM backend of FailoverLM is available.")
+
+    def basic_request(self, prompt: str, **kwargs):
+        return self._call_with_failover(
+            lambda backend: backend.basic_request(prompt, **kwargs)
+        )
+
+    def __call__(self, prompt: str, **kwargs):
+        return self._call_with_failover(lambda backend: backend(prompt, **kwargs))
+
+    async def acall(self, prompt: str, **kwargs):
+        """Async counterpart of `__call__()`. Backends without `acall()` are skipped."""
+        return await self._acall_with_failover(
+            lambda backend: backend.acall(prompt, **kwargs)
+        )
+
+    def get_usage_and_reset(self):
+        """Get the token usage of every backend, keyed by "<provider>/<model>", and reset it."""
+        usage = {}
+        for i, backend in enumerate(self.backends):
+            provider = getattr(backend, "rate_limit_provider", type(backend).__name__)
+            with self._failed_requests_lock:
+                failed_requests = self._failed_requests[i]
+                self._failed_requests[i] = 0
+            for model, model_usage in backend.get_usage_and_reset().items():
+                if failed_requests:
+                    model_usage = {**model_usage, "failed_requests": failed_requests}
+                    failed_requests = 0
+                usage[f"{provider}/{model}"] = model_usage
+        return usage
+
+
+class ReplayLM(dspy.dsp.modules.lm.LM):
+    """Drop-in LM which records the calls of a real LM to a JSONL file or replays them from it offline.
+
+    In "record" mode, calls are forwarded to `lm` and the completions, token usage and latency of every call are
+    appended to `path`. In "replay" mode, calls are served from `path`, keyed by the prompt and the request
+    kwargs, after sleeping for a synthetic latency given by `latency` (see `knowledge_storm.replay`). The
+    recorded token usage is reported as if the calls were real so that token volume can be compared as well.
+    """
+
+    rate_limit_provider = "replay"
+
+    def __init__(
+        self,
+        path: str,
+        lm: Optional[dspy.dsp.modules.lm.LM] = None,
+        mode: Literal["record", "replay"] = "replay",
+        latency: Optional[LatencyModel] = None,
+        seed: int = 0,
+        default_completion: Optional[str] = None,
+    ):
+        """
+        Args:
+            path: Path to the recording.
+            lm: The LM to record. Required in "record" mode.
+            mode: "record" or "replay".
+            latency: Latency model of replayed calls. Defaults to the recorded latencies.
+            seed: Seed of the latency model; a replay with the same seed sleeps for the same latencies.
+            default_completion: Completion returned for prompts missing from the recording in "replay" mode.
+                If None, such prompts raise a KeyError.
+        """
+        if mode == "record" and lm is None:
+            raise ValueError("ReplayLM requires the LM to record in record mode.")
+        self.lm = lm
+        self.mode = mode
+        self.default_completion = default_completion
+        self.log = ReplayLog(path=path, mode=mode, latency=latency, seed=seed)
+        if mode == "record":
+            super().__init__(model=_get_model_name(lm))
+            self.provider = lm.provider
+            self.kwargs = lm.kwargs
+            self._recorded_kwargs = lm.kwargs
+            self.log.record(
+                "__config__",
+                model=_get_model_name(lm),
+                provider=self.provider,
+                kwargs=self.kwargs,
+            )
+        else:
+            config = self.log.get_first("__config__") or {
+                "model": "replay",
+                "provider": "openai",
+                "kwargs": {},
+            }
+            super().__init__(model=config["model"])
+            self.provider = config["provider"]
+            self.kwargs = {**self.kwargs, **config["kwargs"]}
+            # The defaults of the dspy base LM are not part of the recorded requests of every wrapper.
+            self._recorded_kwargs = config["kwargs"]
+        self._token_usage_lock = threading.Lock()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.missed_prompts = 0
+
+    @property
+    def history(self):
+        return self._history
+
+    @history.setter
+    def history(self, value):
+        # In record mode, the recorded LM appends to the history of the replay LM.
+        self._history = value
+        if self.lm is not None:
+            self.lm.history = value
+
+    def _get_key(self, prompt: str, kwargs: dict) -> str:
+        request_kwargs = {
+            k: v
+            for k, v in {**self._recorded_kwargs, **kwargs}.items()
+            if v is not None and k not in _CACHE_IGNORED_KWARGS
+        }
+        return SQLiteCache.make_key(prompt, request_kwargs)
+
+    def _record(self, prompt: str, kwargs: dict, completions, latency, tracker):
+        self.log.record(
+            self._get_key(prompt, kwargs),
+            completions=completions,
+            latency=latency,
+            **tracker,
+        )
+
+    def _lookup(self, prompt: str, kwargs: dict) -> tuple[list[str], float]:
+        replayed = self.log.replay(self._get_key(prompt, kwargs))
+        if replayed is None:
+            with self._token_usage_lock:
+                self.missed_prompts += 1
+            if self.default_completion is None:
+                raise KeyError(
+                    f"Prompt not found in the recording {self.log.path}: {prompt[:100]}"
+                )
+            return [self.default_completion], 0.0
+        entry, latency = replayed
+        with self._token_usage_lock:
+            self.prompt_tokens += entry.get("prompt_tokens", 0)
+            self.completion_tokens += entry.get("completion_tokens", 0)
+        return entry["completions"], latency
+
+    def _log_replay(self, prompt: str, kwargs: dict, completions: list[str]):
+        self.history.append(
+            {
+                "prompt": prompt,
+                "response": {"choices": [{"text": c} for c in completions]},
+                "kwargs": {**self.kwargs, **kwargs},
+                "raw_kwargs": kwargs,
+            }
+        )
+        stream_handler = _stream_handler.get()
+        if stream_handler is not None and completions:
+            stream_handler(completions[0])
+
+    def basic_request(self, prompt: str, **kwargs):
+        return {"choices": [{"text": c} for c in self(prompt, **kwargs)]}
+
+    def __call__(self, prompt: str, **kwargs):
+        if self.mode == "record":
+            tracker = {"prompt_tokens": 0, "completion_tokens": 0}
+            token = _call_usage.set(tracker)
+            start_time = time.time()
+            try:
+                completions = self.lm(prompt, **kwargs)
+            finally:
+                _call_usage.reset(token)
+            self._record(prompt, kwargs, completions, time.time() - start_time, tracker)
+            return completions
+
+        completions, latency = self._lookup(prompt, kwargs)
+        time.sleep(latency)
+        self._log_replay(prompt, kwargs, completions)
+        return completions
+
+    async def acall(self, prompt: str, **kwargs):
+        """Async counterpart of `__call__()`. Recorded LMs without `acall()` are called in a worker thread."""
+        if self.mode == "record":
+            tracker = {"prompt_tokens": 0, "completion_tokens": 0}
+            token = _call_usage.set(tracker)
+            start_time = time.time()
+            try:
+                if hasattr(self.lm, "acall"):
+                    completions = await self.lm.acall(prompt, **kwargs)
+                else:
+                    completions = await asyncio.to_thread(self.lm, prompt, **kwargs)
+            finally:
+                _call_usage.reset(token)
+            self._record(prompt, kwargs, completions, time.time() - start_time, tracker)
+            return completions
+
+        completions, latency = self._lookup(prompt, kwargs)
+        await asyncio.sleep(latency)
+        self._log_replay(prompt, kwargs, completions)
+        return completions
+
+    def get_usage_and_reset(self):
+        """Get the token usage of the recorded LM, or the recorded token usage of the replayed calls, and reset it."""
+        if self.mode == "record":
+            return self.lm.get_usage_and_reset()
+        with self._token_usage_lock:
+            usage = {
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+            }
+            if self.missed_prompts:
+                usage["missed_prompts"] = self.missed_prompts
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+            self.missed_prompts = 0
+        return {_get_model_name(self): usage}
+
+    def close(self):
+        self.log.close()
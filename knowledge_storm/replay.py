@@ -0,0 +1,90 @@
+import json
+import math
+import os
+import random
+import threading
+from typing import Any, Callable, Literal, Optional
+
+# A latency model maps a random generator and the latency observed while recording a call to the latency
+# (in seconds) to simulate when replaying it.
+LatencyModel = Callable[[random.Random, float], float]
+
+
+def recorded_latency(scale: float = 1.0) -> LatencyModel:
+    """Replay every call with the latency observed while recording it, multiplied by `scale`."""
+    return lambda rng, latency: latency * scale
+
+
+def constant_latency(seconds: float) -> LatencyModel:
+    return lambda rng, latency: seconds
+
+
+def lognormal_latency(median: float, sigma: float = 0.5) -> LatencyModel:
+    """Draw latencies from a log-normal distribution, which has the long tail typical of API calls."""
+    return lambda rng, latency: rng.lognormvariate(math.log(median), sigma)
+
+
+class ReplayLog:
+    """Append-only JSONL log of recorded calls, replayed by key.
+
+    A key recorded several times is replayed in the recorded order and then cycled. Latencies are drawn from a
+    random generator seeded with the key and its occurrence, so a replay is reproducible regardless of the
+    order in which threads issue the calls.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        mode: Literal["record", "replay"] = "replay",
+        latency: Optional[LatencyModel] = None,
+        seed: int = 0,
+    ):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown replay mode {mode}.")
+        self.path = os.path.expanduser(path)
+        self.mode = mode
+        self.latency = latency or recorded_latency()
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._entries: dict[str, list[dict]] = {}
+        self._occurrences: dict[str, int] = {}
+        if mode == "record":
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        else:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries.setdefault(entry["key"], []).append(entry)
+
+    def record(self, key: str, **entry: Any):
+        with self._lock:
+            self._file.write(
+                json.dumps({"key": key, **entry}, ensure_ascii=False, default=str)
+                + "\n"
+            )
+            self._file.flush()
+
+    def get_first(self, key: str) -> Optional[dict]:
+        """Get the first entry recorded under `key` without consuming it (e.g., the configuration of the LM)."""
+        entries = self._entries.get(key)
+        return entries[0] if entries else None
+
+    def replay(self, key: str) -> Optional[tuple[dict, float]]:
+        """Get the next entry recorded under `key` and the latency to simulate, or None if the key is unknown."""
+        entries = self._entries.get(key)
+        if not entries:
+            return None
+        with self._lock:
+            occurrence = self._occurrences.get(key, 0)
+            self._occurrences[key] = occurrence + 1
+        entry = entries[occurrence % len(entries)]
+        rng = random.Random(f"{self.seed}:{key}:{occurrence}")
+        return entry, max(0.0, self.latency(rng, entry.get("latency", 0.0)))
+
+    def close(self):
+        if self.mode == "record":
+            with self._lock:
+                self._file.close()
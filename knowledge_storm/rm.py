@@ -1,6 +1,9 @@
+import concurrent.futures
 import logging
 import os
-from typing import Callable, Union, List
+import threading
+import time
+from typing import Callable, Dict, Union, List, Literal, Optional
 
 import backoff
 import dspy
@@ -11,7 +14,26 @@ from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_qdrant import Qdrant
 from qdrant_client import QdrantClient
 
-from .utils import WebPageHelper
+from .cache import SQLiteCache
+from .replay import LatencyModel, ReplayLog
+from .utils import BM25Index, WebPageHelper, normalize_query
+
+# Workers sending the API requests of batched searches, shared by all retrievers.
+_search_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_search_executor_lock = threading.Lock()
+
+
+def _search_concurrently(search: Callable, queries: List[str]) -> list:
+    """Call `search` on every query concurrently, returning the results in the order of `queries`."""
+    global _search_executor
+    if len(queries) <= 1:
+        return [search(query) for query in queries]
+    with _search_executor_lock:
+        if _search_executor is None:
+            _search_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=32, thread_name_prefix="search"
+            )
+    return list(_search_executor.map(search, queries))
 
 
 class YouRM(dspy.Retrieve):
@@ -129,6 +151,50 @@ class BingSearch(dspy.Retrieve):
 
         return {"BingSearch": usage}
 
+    def _search(self, query: str) -> List[Dict]:
+        headers = {"Ocp-Apim-Subscription-Key": self.bing_api_key}
+        try:
+            results = requests.get(
+                self.endpoint, headers=headers, params={**self.params, "q": query}
+            ).json()
+            return [
+                {"url": d["url"], "title": d["name"], "description": d["snippet"]}
+                for d in results["webPages"]["value"]
+            ]
+        except Exception as e:
+            logging.error(f"Error occurs when searching query {query}: {e}")
+            return []
+
+    def forward_batch(
+        self, queries: List[str], exclude_urls: List[str] = []
+    ) -> List[List[Dict]]:
+        """Search all queries concurrently and download the webpages of all their results in a single pass.
+
+        Returns:
+            the results of every query, in the order of `queries`. A webpage found by several queries is
+            downloaded once and appears in the results of each of them.
+        """
+        self.usage += len(queries)
+        query_results = [
+            [
+                r
+                for r in results
+                if self.is_valid_source(r["url"]) and r["url"] not in exclude_urls
+            ]
+            for results in _search_concurrently(self._search, queries)
+        ]
+        valid_url_to_snippets = self.webpage_helper.urls_to_snippets(
+            list(dict.fromkeys(r["url"] for results in query_results for r in results))
+        )
+        return [
+            [
+                {**r, "snippets": valid_url_to_snippets[r["url"]]["snippets"]}
+                for r in results
+                if r["url"] in valid_url_to_snippets
+            ]
+            for results in query_results
+        ]
+
     def forward(
         self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []
     ):
@@ -146,38 +212,12 @@ class BingSearch(dspy.Retrieve):
             if isinstance(query_or_queries, str)
             else query_or_queries
         )
-        self.usage += len(queries)
-
         url_to_results = {}
+        for results in self.forward_batch(queries, exclude_urls):
+            for r in results:
+                url_to_results.setdefault(r["url"], r)
 
-        headers = {"Ocp-Apim-Subscription-Key": self.bing_api_key}
-
-        for query in queries:
-            try:
-                results = requests.get(
-                    self.endpoint, headers=headers, params={**self.params, "q": query}
-                ).json()
-
-                for d in results["webPages"]["value"]:
-                    if self.is_valid_source(d["url"]) and d["url"] not in exclude_urls:
-                        url_to_results[d["url"]] = {
-                            "url": d["url"],
-                            "title": d["name"],
-                            "description": d["snippet"],
-                        }
-            except Exception as e:
-                logging.error(f"Error occurs when searching query {query}: {e}")
-
-        valid_url_to_snippets = self.webpage_helper.urls_to_snippets(
-            list(url_to_results.keys())
-        )
-        collected_results = []
-        for url in valid_url_to_snippets:
-            r = url_to_results[url]
-            r["snippets"] = valid_url_to_snippets[url]["snippets"]
-            collected_results.append(r)
-
-        return collected_results
+        return list(url_to_results.values())
 
 
 class VectorRM(dspy.Retrieve):
@@ -333,6 +373,80 @@ class VectorRM(dspy.Retrieve):
         return collected_results
 
 
+class BM25RM(dspy.Retrieve):
+    """Retrieve information from custom documents with BM25 over a local inverted index.
+
+    An offline, CPU-only alternative to `VectorRM` which needs neither Qdrant nor an embedding model. The custom
+    documents have the same fields as for `VectorRM` and are indexed from CSV files with `add_csv()` (see
+    `knowledge_storm.utils.BM25Index`). New files can be added to an existing index at any time.
+    """
+
+    def __init__(self, index_path: str, k: int = 3, k1: float = 1.2, b: float = 0.75):
+        """
+        Params:
+            index_path: Directory of the index, created by the first call to `add_csv()` if it does not exist.
+            k: Number of top chunks to retrieve.
+            k1: BM25 term frequency saturation.
+            b: BM25 length normalization.
+        """
+        super().__init__(k=k)
+        self.usage = 0
+        if not index_path:
+            raise ValueError("Please provide an index path.")
+        self.index = BM25Index(index_path=index_path, k1=k1, b=b)
+
+    def add_csv(self, file_path: str, content_column: str, **kwargs) -> int:
+        """Index the documents of a CSV file, see `BM25Index.add_csv()`."""
+        return self.index.add_csv(
+            file_path=file_path, content_column=content_column, **kwargs
+        )
+
+    def get_usage_and_reset(self):
+        usage = self.usage
+        self.usage = 0
+
+        return {"BM25RM": usage}
+
+    def get_chunk_count(self):
+        return len(self.index)
+
+    def forward(
+        self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []
+    ):
+        """
+        Search in your data for self.k top passages for query or queries.
+
+        Args:
+            query_or_queries (Union[str, List[str]]): The query or queries to search for.
+            exclude_urls (List[str]): A list of urls to exclude from the search results.
+
+        Returns:
+            a list of Dicts, each dict has keys of 'description', 'snippets' (list of strings), 'title', 'url'
+        """
+        queries = (
+            [query_or_queries]
+            if isinstance(query_or_queries, str)
+            else query_or_queries
+        )
+        self.usage += len(queries)
+        collected_results = []
+        for query in queries:
+            # Excluded chunks may take up to all of the extra places.
+            hits = self.index.search(query, k=self.k + len(exclude_urls))
+            chunks = [chunk for _, chunk in hits if chunk["url"] not in exclude_urls]
+            for chunk in chunks[: self.k]:
+                collected_results.append(
+                    {
+                        "description": chunk["description"],
+                        "snippets": [chunk["content"]],
+                        "title": chunk["title"],
+                        "url": chunk["url"],
+                    }
+                )
+
+        return collected_results
+
+
 class StanfordOvalArxivRM(dspy.Retrieve):
     """[Alpha] This retrieval class is for internal use only, not intended for the public."""
 
@@ -452,10 +566,9 @@ class SerperRM(dspy.Retrieve):
             self.serper_search_api_key = os.environ["SERPER_API_KEY"]
 
         self.base_url = "https://google.serper.dev"
-
-    def serper_runner(self, query_params):
         self.search_url = f"{self.base_url}/search"
 
+    def serper_runner(self, query_params):
         headers = {
             "X-API-KEY": self.serper_search_api_key,
             "Content-Type": "application/json",
@@ -477,58 +590,46 @@ class SerperRM(dspy.Retrieve):
         self.usage = 0
         return {"SerperRM": usage}
 
-    def forward(self, query_or_queries: Union[str, List[str]], exclude_urls: List[str]):
-        """
-        Calls the API and searches for the query passed in.
-
-
-        Args:
-            query_or_queries (Union[str, List[str]]): The query or queries to search for.
-            exclude_urls (List[str]): Dummy parameter to match the interface. Does not have any effect.
+    def _search(self, query: str) -> dict:
+        if query == "Queries:":
+            return {}
+        # All available parameters can be found in the playground: https://serper.dev/playground
+        # Sets the json value for query to be the query that is being parsed, and the type to be search, can be
+        # images, video, places, maps etc that Google provides. The shared parameters are copied as queries are
+        # searched concurrently.
+        return self.serper_runner({**self.query_params, "q": query, "type": "search"})
+
+    def forward_batch(
+        self, queries: List[str], exclude_urls: List[str] = []
+    ) -> List[List[Dict]]:
+        """Search all queries concurrently. With ENABLE_EXTRA_SNIPPET_EXTRACTION, the webpages of the results of
+        all queries are downloaded in a single pass.
 
         Returns:
-            a list of dictionaries, each dictionary has keys of 'description', 'snippets' (list of strings), 'title', 'url'
+            the results of every query, in the order of `queries`.
         """
-        queries = (
-            [query_or_queries]
-            if isinstance(query_or_queries, str)
-            else query_or_queries
-        )
-
         self.usage += len(queries)
-        self.results = []
-        collected_results = []
-        for query in queries:
-            if query == "Queries:":
-                continue
-            query_params = self.query_params
-
-            # All available parameters can be found in the playground: https://serper.dev/playground
-            # Sets the json value for query to be the query that is being parsed.
-            query_params["q"] = query
-
-            # Sets the type to be search, can be images, video, places, maps etc that Google provides.
-            query_params["type"] = "search"
-
-            self.result = self.serper_runner(query_params)
-            self.results.append(self.result)
-
-        # Array of dictionaries that will be used by Storm to create the jsons
-        collected_results = []
+        # Kept local rather than on self: forward_batch may be called concurrently.
+        results = _search_concurrently(self._search, queries)
 
         if self.ENABLE_EXTRA_SNIPPET_EXTRACTION:
             urls = []
-            for result in self.results:
+            for result in results:
                 organic_results = result.get("organic", [])
                 for organic in organic_results:
                     url = organic.get("link")
                     if url:
                         urls.append(url)
-            valid_url_to_snippets = self.webpage_helper.urls_to_snippets(urls)
+            valid_url_to_snippets = self.webpage_helper.urls_to_snippets(
+                list(dict.fromkeys(urls))
+            )
         else:
             valid_url_to_snippets = {}
 
-        for result in self.results:
+        query_results = []
+        for result in results:
+            # Array of dictionaries that will be used by Storm to create the jsons
+            collected_results = []
             try:
                 # An array of dictionaries that contains the snippets, title of the document and url that will be used.
                 organic_results = result.get("organic")
@@ -537,9 +638,9 @@ class SerperRM(dspy.Retrieve):
                     snippets = [organic.get("snippet")]
                     if self.ENABLE_EXTRA_SNIPPET_EXTRACTION:
                         snippets.extend(
-                            valid_url_to_snippets.get(url.strip("'"), {}).get(
-                                "snippets", []
-                            )
+                            valid_url_to_snippets.get(
+                                (organic.get("link") or "").strip("'"), {}
+                            ).get("snippets", [])
                         )
                     collected_results.append(
                         {
@@ -554,9 +655,31 @@ class SerperRM(dspy.Retrieve):
                         }
                     )
             except:
-                continue
+                pass
+            query_results.append(collected_results)
 
-        return collected_results
+        return query_results
+
+    def forward(self, query_or_queries: Union[str, List[str]], exclude_urls: List[str]):
+        """
+        Calls the API and searches for the query passed in.
+
+
+        Args:
+            query_or_queries (Union[str, List[str]]): The query or queries to search for.
+            exclude_urls (List[str]): Dummy parameter to match the interface. Does not have any effect.
+
+        Returns:
+            a list of dictionaries, each dictionary has keys of 'description', 'snippets' (list of strings), 'title', 'url'
+        """
+        queries = (
+            [query_or_queries]
+            if isinstance(query_or_queries, str)
+            else query_or_queries
+        )
+        return [
+            r for results in self.forward_batch(queries, exclude_urls) for r in results
+        ]
 
 
 class BraveRM(dspy.Retrieve):
@@ -771,6 +894,9 @@ class DuckDuckGoSearchRM(dspy.Retrieve):
 
         # Import the duckduckgo search library found here: https://github.com/deedy5/duckduckgo_search
         self.ddgs = DDGS()
+        # DDGS sessions are not thread-safe; queries searched concurrently use one session per thread.
+        self._thread_local = threading.local()
+        self._thread_local.ddgs = self.ddgs
 
     def get_usage_and_reset(self):
         usage = self.usage
@@ -786,11 +912,18 @@ class DuckDuckGoSearchRM(dspy.Retrieve):
         giveup=giveup_hdlr,
     )
     def request(self, query: str):
-        results = self.ddgs.text(
+        results = self._get_ddgs().text(
             query, max_results=self.k, backend=self.duck_duck_go_backend
         )
         return results
 
+    def _get_ddgs(self):
+        if not hasattr(self._thread_local, "ddgs"):
+            from duckduckgo_search import DDGS
+
+            self._thread_local.ddgs = DDGS()
+        return self._thread_local.ddgs
+
     def forward(
         self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []
     ):
@@ -806,14 +939,25 @@ class DuckDuckGoSearchRM(dspy.Retrieve):
             if isinstance(query_or_queries, str)
             else query_or_queries
         )
-        self.usage += len(queries)
+        return [
+            r for results in self.forward_batch(queries, exclude_urls) for r in results
+        ]
 
-        collected_results = []
+    def forward_batch(
+        self, queries: List[str], exclude_urls: List[str] = []
+    ) -> List[List[Dict]]:
+        """Search all queries concurrently.
 
-        for query in queries:
-            #  list of dicts that will be parsed to return
-            results = self.request(query)
+        Returns:
+            the results of every query, in the order of `queries`.
+        """
+        self.usage += len(queries)
+        query_results = []
 
+        #  lists of dicts that will be parsed to return
+        for query, results in zip(queries, _search_concurrently(self.request, queries)):
+            collected_results = []
+            query_results.append(collected_results)
             for d in results:
                 # assert d is dict
                 if not isinstance(d, dict):
@@ -844,7 +988,7 @@ class DuckDuckGoSearchRM(dspy.Retrieve):
                     print(f"Error occurs when processing {result=}: {e}\n")
                     print(f"Error occurs when searching query {query}: {e}")
 
-        return collected_results
+        return query_results
 
 
 class TavilySearchRM(dspy.Retrieve):
@@ -1228,3 +1372,235 @@ class AzureAISearch(dspy.Retrieve):
                 logging.error(f"Error occurs when searching query {query}: {e}")
 
         return collected_results
+
+
+class ReplayRM(dspy.Retrieve):
+    """Drop-in retriever which records the search results of a real retriever to a JSONL file or replays them.
+
+    In "record" mode, every query is forwarded to `rm` and its results are appended to `path` together with the
+    latency of the search. In "replay" mode, results are served from `path` after sleeping for a synthetic
+    latency given by `latency` (see `knowledge_storm.replay`). Queries are recorded without `exclude_urls`,
+    which are filtered out when the results are returned, so a recording can be replayed with other exclusions.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        rm: dspy.Retrieve = None,
+        mode: Literal["record", "replay"] = "replay",
+        latency: Optional[LatencyModel] = None,
+        seed: int = 0,
+        k: int = 3,
+    ):
+        """
+        Args:
+            path: Path to the recording.
+            rm: The retriever to record. Required in "record" mode.
+            mode: "record" or "replay".
+            latency: Latency model of replayed searches. Defaults to the recorded latencies.
+            seed: Seed of the latency model; a replay with the same seed sleeps for the same latencies.
+            k: Unused in "record" mode, where `rm` decides how many results to return.
+        """
+        super().__init__(k=rm.k if rm is not None else k)
+        if mode == "record" and rm is None:
+            raise ValueError(
+                "ReplayRM requires the retriever to record in record mode."
+            )
+        self.rm = rm
+        self.mode = mode
+        self.log = ReplayLog(path=path, mode=mode, latency=latency, seed=seed)
+        self.usage = 0
+        self._usage_lock = threading.Lock()
+
+    def get_usage_and_reset(self):
+        if self.mode == "record":
+            return self.rm.get_usage_and_reset()
+        with self._usage_lock:
+            usage = self.usage
+            self.usage = 0
+
+        return {"ReplayRM": usage}
+
+    def _search(self, query: str) -> list[dict]:
+        key = SQLiteCache.make_key(query)
+        if self.mode == "record":
+            start_time = time.time()
+            results = self.rm(query_or_queries=[query], exclude_urls=[])
+            self.log.record(
+                key, query=query, results=results, latency=time.time() - start_time
+            )
+            return results
+
+        replayed = self.log.replay(key)
+        with self._usage_lock:
+            self.usage += 1
+        if replayed is None:
+            logging.warning(
+                f"Query not found in the recording {self.log.path}: {query}"
+            )
+            return []
+        entry, latency = replayed
+        time.sleep(latency)
+        return entry["results"]
+
+    def forward(
+        self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []
+    ):
+        """Search for self.k top passages for query or queries, or replay the recorded results.
+
+        Args:
+            query_or_queries (Union[str, List[str]]): The query or queries to search for.
+            exclude_urls (List[str]): A list of urls to exclude from the search results.
+
+        Returns:
+            a list of Dicts, each dict has keys of 'description', 'snippets' (list of strings), 'title', 'url'
+        """
+        queries = (
+            [query_or_queries]
+            if isinstance(query_or_queries, str)
+            else query_or_queries
+        )
+        collected_results = []
+        for query in queries:
+            for r in self._search(query):
+                if r["url"] not in exclude_urls:
+                    collected_results.append(r)
+
+        return collected_results
+
+    def close(self):
+        self.log.close()
+
+
+class CachedRM(dspy.Retrieve):
+    """Wrap any retriever in this module with an on-disk cache of its search results.
+
+    Results are cached per query under a key made of the retriever class, its configuration, the normalized
+    query and k, so that near-identical queries asked by different personas (differing in case or whitespace)
+    hit the search API once. Entries expire after `ttl` seconds and the least recently used ones are evicted
+    beyond `max_size_bytes`. Like in `ReplayRM`, queries are searched without `exclude_urls`, which are filtered
+    out when the results are returned.
+    """
+
+    def __init__(
+        self,
+        rm: dspy.Retrieve,
+        path: str = "~/.cache/knowledge_storm/search_cache.sqlite",
+        ttl: Optional[float] = 24 * 3600,
+        max_size_bytes: Optional[int] = 256 * 1024 * 1024,
+        params: Optional[dict] = None,
+        cache: Optional[SQLiteCache] = None,
+    ):
+        """
+        Args:
+            rm: The retriever to cache.
+            path: Path to the SQLite file. Processes pointing to the same file share the cache.
+            ttl: Time-to-live of cached search results in seconds. None means results never expire.
+            max_size_bytes: Size bound of the cache; least recently used results are evicted beyond it.
+            params: Configuration of `rm` which changes its results, as part of the cache key. Defaults to its
+                scalar attributes except credentials. Settings which are not scalars (e.g., `is_valid_source`)
+                have to be given here to tell different configurations apart.
+            cache: Cache to use instead of opening `path`, e.g., to share it between several retrievers.
+        """
+        super().__init__(k=rm.k)
+        self.rm = rm
+        self.params = params if params is not None else self._get_params(rm)
+        self._owns_cache = cache is None
+        self.cache = cache or SQLiteCache(
+            path=path, ttl=ttl, max_size_bytes=max_size_bytes
+        )
+        self.hits = 0
+        self.misses = 0
+        self._usage_lock = threading.Lock()
+
+    @staticmethod
+    def _get_params(rm: dspy.Retrieve) -> dict:
+        return {
+            name: value
+            for name, value in vars(rm).items()
+            if isinstance(value, (str, int, float, bool, type(None)))
+            # dspy.Retrieve.stage is random; usage is a counter.
+            and name not in ("stage", "usage")
+            and not any(s in name.lower() for s in ("key", "token", "secret"))
+        }
+
+    def get_usage_and_reset(self):
+        usage = (
+            self.rm.get_usage_and_reset()
+            if hasattr(self.rm, "get_usage_and_reset")
+            else {}
+        )
+        with self._usage_lock:
+            hits, misses = self.hits, self.misses
+            self.hits = self.misses = 0
+        usage["CachedRM hits"] = hits
+        usage["CachedRM misses"] = misses
+        usage["CachedRM hit rate"] = hits / (hits + misses) if hits + misses else 0.0
+
+        return usage
+
+    def forward_batch(
+        self, queries: List[str], exclude_urls: List[str] = []
+    ) -> List[List[Dict]]:
+        """Get the results of every query, searching the queries missing from the cache in one batch.
+
+        Returns:
+            the results of every query, in the order of `queries`.
+        """
+        keys = [
+            SQLiteCache.make_key(
+                type(self.rm).__name__, self.params, normalize_query(query), self.k
+            )
+            for query in queries
+        ]
+        query_results = [self.cache.get(key) for key in keys]
+        missing = [i for i, results in enumerate(query_results) if results is None]
+        with self._usage_lock:
+            self.hits += len(queries) - len(missing)
+            self.misses += len(missing)
+
+        missing_queries = [queries[i] for i in missing]
+        if not missing_queries:
+            searched = []
+        elif hasattr(self.rm, "forward_batch"):
+            searched = self.rm.forward_batch(missing_queries, exclude_urls=[])
+        else:
+            searched = _search_concurrently(
+                lambda query: self.rm(query_or_queries=[query], exclude_urls=[]),
+                missing_queries,
+            )
+        for i, results in zip(missing, searched):
+            query_results[i] = results
+            # Failed searches return no result and are not cached.
+            if results:
+                self.cache.set(keys[i], results)
+
+        return [
+            [r for r in results if r["url"] not in exclude_urls]
+            for results in query_results
+        ]
+
+    def forward(
+        self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []
+    ):
+        """Search for self.k top passages for query or queries, serving cached results where possible.
+
+        Args:
+            query_or_queries (Union[str, List[str]]): The query or queries to search for.
+            exclude_urls (List[str]): A list of urls to exclude from the search results.
+
+        Returns:
+            a list of Dicts, each dict has keys of 'description', 'snippets' (list of strings), 'title', 'url'
+        """
+        queries = (
+            [query_or_queries]
+            if isinstance(query_or_queries, str)
+            else query_or_queries
+        )
+        return [
+            r for results in self.forward_batch(queries, exclude_urls) for r in results
+        ]
+
+    def close(self):
+        if self._owns_cache:
+            self.cache.close()
@@ -1,4 +1,5 @@
 import concurrent.futures
+import contextlib
 import copy
 import logging
 from concurrent.futures import as_completed
@@ -14,7 +15,12 @@ import dspy
 from .callback import BaseCallbackHandler
 from .storm_dataclass import StormInformationTable, StormArticle
 from ...interface import ArticleGenerationModule, Information
-from ...utils import ArticleTextProcessing
+from ...lm import stream_lm_output
+from ...utils import (
+    ArticleTextProcessing,
+    get_input_token_budget,
+    get_token_counter,
+)
 
 class StormArticleGenerationModule(ArticleGenerationModule):
     """
@@ -35,7 +41,13 @@ class StormArticleGenerationModule(ArticleGenerationModule):
         self.section_gen = ConvToSection(engine=self.article_gen_lm)
 
     def generate_section(
-        self, opportunity, section_name, information_table, section_outline, section_query
+        self,
+        opportunity,
+        section_name,
+        information_table,
+        section_outline,
+        section_query,
+        callback_handler: BaseCallbackHandler = None,
     ):
         collected_info: List[Information] = []
         if information_table is not None:
@@ -47,17 +59,22 @@ class StormArticleGenerationModule(ArticleGenerationModule):
             outline=section_outline,
             section=section_name,
             collected_info=collected_info,
+            callback_handler=callback_handler,
         )
+        if callback_handler is not None:
+            callback_handler.on_section_end(
+                section_name=section_name, section_content=output.section
+            )
         return {
             "section_name": section_name,
             "section_content": output.section,
             "collected_info": collected_info,
         }
 
-    def generate_section_with_debug(self, opportunity, section_title, information_table, section_outline, section_query):
+    def generate_section_with_debug(self, opportunity, section_title, information_table, section_outline, section_query, callback_handler=None):
         thread_id = threading.current_thread().ident
         start = time.time()
-        result = self.generate_section(opportunity, section_title, information_table, section_outline, section_query)
+        result = self.generate_section(opportunity, section_title, information_table, section_outline, section_query, callback_handler)
         duration = time.time() - start
         print(f"Section {section_title} in thread {thread_id} took {duration:.2f}s")
         return result
@@ -97,6 +114,7 @@ class StormArticleGenerationModule(ArticleGenerationModule):
                 information_table=information_table,
                 section_outline="",
                 section_query=[opportunity],
+                callback_handler=callback_handler,
             )
             section_output_dict_collection = [section_output_dict]
         else:
@@ -148,6 +166,7 @@ class StormArticleGenerationModule(ArticleGenerationModule):
                             information_table,
                             section_outline,
                             section_query,
+                            callback_handler,
                         )
                     ] = section_title
 
@@ -174,16 +193,46 @@ class ConvToSection(dspy.Module):
         self.engine = engine
 
     def forward(
-        self, opportunity: str, outline: str, section: str, collected_info: List[Information]
+        self,
+        opportunity: str,
+        outline: str,
+        section: str,
+        collected_info: List[Information],
+        callback_handler: BaseCallbackHandler = None,
     ):
         info = ""
         for idx, storm_info in enumerate(collected_info):
             info += f"[{idx + 1}]\n" + "\n".join(storm_info.snippets)
             info += "\n\n"
 
-        info = ArticleTextProcessing.limit_word_count_preserve_newline(info, 1500)
+        info = ArticleTextProcessing.limit_token_count_preserve_newline(
+            info,
+            get_input_token_budget(
+                self.engine, WriteSection, opportunity, section, max_budget=2000
+            ),
+            get_token_counter(self.engine),
+        )
+
+        # Stream the section to the callback handler only if it consumes the partial text.
+        if (
+            callback_handler is not None
+            and type(callback_handler).on_section_update
+            is not BaseCallbackHandler.on_section_update
+        ):
+            section_name = section
+            partial_section = []
+
+            def on_new_text(text):
+                partial_section.append(text)
+                callback_handler.on_section_update(
+                    section_name=section_name, partial_section="".join(partial_section)
+                )
+
+            stream_context = stream_lm_output(on_new_text)
+        else:
+            stream_context = contextlib.nullcontext()
 
-        with dspy.settings.context(lm=self.engine):
+        with dspy.settings.context(lm=self.engine), stream_context:
             section = ArticleTextProcessing.clean_up_section(
                 self.write_section(opportunity=opportunity, info=info, section=section).output
             )
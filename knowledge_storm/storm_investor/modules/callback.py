@@ -32,3 +32,14 @@ class BaseCallbackHandler:
     def on_outline_refinement_end(self, outline: str, **kwargs):
         """Run when the outline refinement finishes."""
         pass
+
+    def on_section_update(self, section_name: str, partial_section: str, **kwargs):
+        """Run when new text of a section is generated; `partial_section` is the section written so far.
+
+        Only called while the section is streamed from the article generation LM (see `stream_lm_output`).
+        """
+        pass
+
+    def on_section_end(self, section_name: str, section_content: str, **kwargs):
+        """Run when the writing of a section finishes."""
+        pass
@@ -13,7 +13,11 @@ from .callback import BaseCallbackHandler
 from .persona_generator import StormPersonaGenerator
 from .storm_dataclass import DialogueTurn, StormInformationTable
 from ...interface import KnowledgeCurationModule, Retriever, Information
-from ...utils import ArticleTextProcessing
+from ...utils import (
+    ArticleTextProcessing,
+    get_input_token_budget,
+    get_token_counter,
+)
 
 try:
     from streamlit.runtime.scriptrunner import add_script_run_ctx
@@ -113,7 +117,21 @@ class WikiWriter(dspy.Module):
             )
         conv = "\n".join(conv)
         conv = conv.strip() or "N/A"
-        conv = ArticleTextProcessing.limit_word_count_preserve_newline(conv, 2500)
+        if persona is not None and len(persona.strip()) > 0:
+            budget = get_input_token_budget(
+                self.engine,
+                AskQuestionWithPersona,
+                opportunity,
+                persona,
+                max_budget=3300,
+            )
+        else:
+            budget = get_input_token_budget(
+                self.engine, AskQuestion, opportunity, max_budget=3300
+            )
+        conv = ArticleTextProcessing.limit_token_count_preserve_newline(
+            conv, budget, get_token_counter(self.engine)
+        )
 
         with dspy.settings.context(lm=self.engine):
             if persona is not None and len(persona.strip()) > 0:
@@ -224,8 +242,16 @@ class TopicExpert(dspy.Module):
                     info += "\n".join(f"[{n + 1}]: {s}" for s in r.snippets[:1])
                     info += "\n\n"
 
-                info = ArticleTextProcessing.limit_word_count_preserve_newline(
-                    info, 1000
+                info = ArticleTextProcessing.limit_token_count_preserve_newline(
+                    info,
+                    get_input_token_budget(
+                        self.engine,
+                        AnswerQuestion,
+                        opportunity,
+                        question,
+                        max_budget=1300,
+                    ),
+                    get_token_counter(self.engine),
                 )
 
                 try:
@@ -5,7 +5,11 @@ import dspy
 from .callback import BaseCallbackHandler
 from .storm_dataclass import StormInformationTable, StormArticle
 from ...interface import OutlineGenerationModule
-from ...utils import ArticleTextProcessing
+from ...utils import (
+    ArticleTextProcessing,
+    get_input_token_budget,
+    get_token_counter,
+)
 
 
 class StormOutlineGenerationModule(OutlineGenerationModule):
@@ -103,7 +107,6 @@ class WriteOutline(dspy.Module):
             ]
         )
         conv = ArticleTextProcessing.remove_citations(conv)
-        conv = ArticleTextProcessing.limit_word_count_preserve_newline(conv, 5000)
 
         with dspy.settings.context(lm=self.engine):
             if old_outline is None:
@@ -114,6 +117,17 @@ class WriteOutline(dspy.Module):
                     callback_handler.on_direct_outline_generation_end(
                         outline=old_outline
                     )
+            conv = ArticleTextProcessing.limit_token_count_preserve_newline(
+                conv,
+                get_input_token_budget(
+                    self.engine,
+                    WritePageOutlineFromConv,
+                    opportunity,
+                    old_outline,
+                    max_budget=6600,
+                ),
+                get_token_counter(self.engine),
+            )
             outline = ArticleTextProcessing.clean_up_outline(
                 self.write_page_outline(
                     opportunity=opportunity, old_outline=old_outline, conv=conv
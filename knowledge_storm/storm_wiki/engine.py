@@ -164,7 +164,8 @@ class STORMWikiRunnerArguments:
         default=10,
         metadata={
             "help": "Maximum number of threads to use. "
-            "Consider reducing it if keep getting 'Exceed rate limit' error when calling LM API."
+            "Consider reducing it if keep getting 'Exceed rate limit' error when calling LM API, "
+            "or cap the requests sent to the provider with `set_lm_rate_limit()` in `knowledge_storm.lm`."
         },
     )
 
@@ -179,7 +180,12 @@ class STORMWikiRunner(Engine):
         self.args = args
         self.lm_configs = lm_configs
 
-        self.retriever = Retriever(rm=rm, max_thread=self.args.max_thread_num)
+        # Personas search concurrently, in up to `max_thread_num` threads.
+        self.retriever = Retriever(
+            rm=rm,
+            max_thread=self.args.max_thread_num,
+            max_callers=self.args.max_thread_num,
+        )
         storm_persona_generator = StormPersonaGenerator(
             self.lm_configs.question_asker_lm
         )
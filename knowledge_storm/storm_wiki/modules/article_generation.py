@@ -9,7 +9,11 @@ import dspy
 from .callback import BaseCallbackHandler
 from .storm_dataclass import StormInformationTable, StormArticle
 from ...interface import ArticleGenerationModule, Information
-from ...utils import ArticleTextProcessing
+from ...utils import (
+    ArticleTextProcessing,
+    get_input_token_budget,
+    get_token_counter,
+)
 
 
 class StormArticleGenerationModule(ArticleGenerationModule):
@@ -150,7 +154,13 @@ class ConvToSection(dspy.Module):
             info += f"[{idx + 1}]\n" + "\n".join(storm_info.snippets)
             info += "\n\n"
 
-        info = ArticleTextProcessing.limit_word_count_preserve_newline(info, 1500)
+        info = ArticleTextProcessing.limit_token_count_preserve_newline(
+            info,
+            get_input_token_budget(
+                self.engine, WriteSection, topic, section, max_budget=2000
+            ),
+            get_token_counter(self.engine),
+        )
 
         with dspy.settings.context(lm=self.engine):
             section = ArticleTextProcessing.clean_up_section(
@@ -4,9 +4,9 @@ from collections import OrderedDict
 from typing import Union, Optional, Any, List, Tuple, Dict
 
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from sklearn.metrics.pairwise import cosine_similarity
 
+from ...encoder import get_sentence_transformer
 from ...interface import Information, InformationTable, Article, ArticleSectionNode
 from ...utils import ArticleTextProcessing, FileIOHelper
 
@@ -107,7 +107,7 @@ class StormInformationTable(InformationTable):
         return cls(conversations)
 
     def prepare_table_for_retrieval(self):
-        self.encoder = SentenceTransformer("paraphrase-MiniLM-L6-v2")
+        self.encoder = get_sentence_transformer()
         self.collected_urls = []
         self.collected_snippets = []
         for url, information in self.url_to_info.items():
@@ -149,7 +149,7 @@ class StormInformationTable(InformationTable):
 
 class StormArticle(Article):
     def __init__(self, topic_name):
-        super().__init__(topic_name=topic_name)
+        super().__init__(topic_name)
         self.reference = {"url_to_unified_index": {}, "url_to_info": {}}
 
     def find_section(
@@ -1,6 +1,12 @@
+import asyncio
 import concurrent.futures
+import functools
+import io
 import json
 import logging
+import math
+import mmap
+import multiprocessing
 import os
 import pickle
 import re
@@ -8,9 +14,15 @@ import regex
 import sys
 import time
 import random
-from typing import List, Dict
+import threading
+import weakref
+from collections import Counter, defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, List, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 import httpx
+import numpy as np
 import pandas as pd
 import toml
 from langchain_core.documents import Document
@@ -20,8 +32,25 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 from qdrant_client import QdrantClient, models
 from tqdm import tqdm
 from trafilatura import extract
+from transformers import AutoTokenizer
 
-from .lm import OpenAIModel
+from .cache import SQLiteCache
+from .lm import OpenAIModel, TGIClient, TogetherClient, VLLMClient
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+try:
+    import h2  # Enables HTTP/2 in httpx.
+except ImportError:
+    h2 = None
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
 
 logging.getLogger("httpx").setLevel(logging.WARNING)  # Disable INFO logging for httpx.
 
@@ -59,6 +88,11 @@ def load_api_key(toml_file_path):
         os.environ[key] = str(value)
 
 
+def normalize_query(query: str) -> str:
+    """Normalize a search query so that queries differing only in case, whitespace or final punctuation match."""
+    return " ".join(query.lower().split()).strip(" ?.!")
+
+
 def makeStringRed(message):
     return f"\033[91m {message}\033[00m"
 
@@ -291,6 +325,501 @@ class QdrantVectorStoreManager:
         qdrant.client.close()
 
 
+class BM25Index:
+    """On-disk BM25 inverted index over chunks of documents, used by `BM25RM` to search a local corpus on CPU.
+
+    The index is a directory of segments, one per call to `add_csv()`/`add_documents()`, so that new documents
+    are indexed without rebuilding the index. A segment stores its postings as NumPy arrays which are memory-mapped
+    when the index is loaded (term i has the chunk ids `postings_docs[term_offsets[i]:term_offsets[i + 1]]` with
+    the term frequencies `postings_tfs[...]`), and the chunks as JSON lines read through `mmap`. Document
+    frequencies, the number of chunks and the average chunk length are aggregated over segments at load time, so
+    scores are the same as with a single segment. As in `VectorRM`, URLs identify documents: documents whose URL
+    is already indexed are skipped. Each segment stores the URLs of its documents, so that they are checked without
+    reading the chunks.
+    """
+
+    STOPWORDS = frozenset(
+        "a an and are as at be but by for from has have in is it its of on or that the this to was were will "
+        "with".split()
+    )
+
+    def __init__(self, index_path: str, k1: float = 1.2, b: float = 0.75):
+        """
+        Args:
+            index_path: Directory of the index. It is created by the first call to `add_csv()`.
+            k1: BM25 term frequency saturation.
+            b: BM25 length normalization.
+        """
+        self.index_path = os.path.expanduser(index_path)
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._segments = []
+        self._urls = set()
+        self.load()
+
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        return [
+            token
+            for token in regex.findall(r"\w+", text.lower())
+            if token not in cls.STOPWORDS
+        ]
+
+    def _read_meta(self) -> dict:
+        meta_path = os.path.join(self.index_path, "meta.json")
+        if not os.path.exists(meta_path):
+            return {"segments": []}
+        with open(meta_path) as f:
+            return json.load(f)
+
+    def _load_segment(self, name: str) -> dict:
+        path = os.path.join(self.index_path, name)
+        with open(os.path.join(path, "vocab.json"), encoding="utf-8") as f:
+            vocab = {term: i for i, term in enumerate(json.load(f))}
+        chunks_file = open(os.path.join(path, "chunks.jsonl"), "rb")
+        segment = {
+            "name": name,
+            "vocab": vocab,
+            "chunks_file": chunks_file,
+            "chunks": mmap.mmap(chunks_file.fileno(), 0, access=mmap.ACCESS_READ),
+        }
+        for array in (
+            "term_offsets",
+            "postings_docs",
+            "postings_tfs",
+            "doc_lens",
+            "chunk_offsets",
+        ):
+            segment[array] = np.load(os.path.join(path, f"{array}.npy"), mmap_mode="r")
+        urls_path = os.path.join(path, "urls.json")
+        if os.path.exists(urls_path):
+            with open(urls_path, encoding="utf-8") as f:
+                segment["urls"] = set(json.load(f))
+        else:
+            # Segments written before the URLs were stored.
+            segment["urls"] = {
+                BM25Index._get_chunk(segment, i)["url"]
+                for i in range(len(segment["doc_lens"]))
+            }
+        return segment
+
+    def load(self):
+        """(Re)load the index, e.g., to see the segments added by another process. Segments already loaded are
+        reused."""
+        with self._lock:
+            loaded = {segment["name"]: segment for segment in self._segments}
+        # Loaded segments are copied since their norms depend on the average chunk length of the whole index.
+        segments = [
+            dict(loaded[name]) if name in loaded else self._load_segment(name)
+            for name in self._read_meta()["segments"]
+        ]
+        num_chunks = sum(len(segment["doc_lens"]) for segment in segments)
+        total_len = sum(int(segment["doc_lens"].sum()) for segment in segments)
+        avg_len = total_len / num_chunks if num_chunks else 0.0
+        for segment in segments:
+            # Denominator of the BM25 term frequency part without the term frequency, per chunk.
+            segment["norms"] = self.k1 * (
+                1 - self.b + self.b * np.asarray(segment["doc_lens"]) / avg_len
+            )
+        urls = set().union(*(segment["urls"] for segment in segments))
+        with self._lock:
+            self._segments = segments
+            self.num_chunks = num_chunks
+            self._urls = urls
+        # The replaced segments are not closed since searches may still be reading them; their files are closed
+        # once they are no longer referenced.
+
+    def __len__(self):
+        return self.num_chunks
+
+    def get_urls(self) -> set:
+        """Get the URLs of the indexed documents."""
+        with self._lock:
+            return set(self._urls)
+
+    @staticmethod
+    def _get_postings(segment: dict, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the chunk ids and term frequencies of a term in a segment."""
+        term_id = segment["vocab"].get(term)
+        if term_id is None:
+            return segment["postings_docs"][:0], segment["postings_tfs"][:0]
+        start, end = segment["term_offsets"][term_id : term_id + 2]
+        return segment["postings_docs"][start:end], segment["postings_tfs"][start:end]
+
+    @staticmethod
+    def _get_chunk(segment: dict, i: int) -> dict:
+        start, end = segment["chunk_offsets"][i], segment["chunk_offsets"][i + 1]
+        return json.loads(segment["chunks"][start:end])
+
+    def add_documents(
+        self, documents: List[dict], chunk_size: int = 500, chunk_overlap: int = 100
+    ) -> int:
+        """Split documents into chunks and index them as a new segment.
+
+        Args:
+            documents: Dicts with the keys "content", "url" and optionally "title" and "description".
+            chunk_size: Size of each chunk.
+            chunk_overlap: Overlap between chunks.
+
+        Returns:
+            The number of chunks indexed.
+        """
+        text_splitter = _make_snippet_splitter(chunk_size, chunk_overlap)
+        indexed_urls = self.get_urls()
+        chunks = []
+        for document in documents:
+            if document["url"] in indexed_urls:
+                continue
+            indexed_urls.add(document["url"])
+            for content in text_splitter.split_text(document["content"]):
+                chunks.append(
+                    {
+                        "content": content,
+                        "title": document.get("title", ""),
+                        "url": document["url"],
+                        "description": document.get("description", ""),
+                    }
+                )
+        if not chunks:
+            return 0
+
+        postings = defaultdict(list)
+        doc_lens = np.zeros(len(chunks), dtype=np.int32)
+        for i, chunk in enumerate(chunks):
+            tokens = self.tokenize(chunk["content"])
+            doc_lens[i] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                postings[term].append((i, tf))
+        vocab = sorted(postings)
+        term_offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        term_offsets[1:] = np.cumsum([len(postings[term]) for term in vocab])
+        postings_docs = np.empty(term_offsets[-1], dtype=np.int32)
+        postings_tfs = np.empty(term_offsets[-1], dtype=np.float32)
+        for i, term in enumerate(vocab):
+            docs, tfs = zip(*postings[term])
+            postings_docs[term_offsets[i] : term_offsets[i + 1]] = docs
+            postings_tfs[term_offsets[i] : term_offsets[i + 1]] = tfs
+
+        meta = self._read_meta()
+        name = f"segment_{len(meta['segments']):05d}_{int(time.time() * 1000)}"
+        # Write the segment under a temporary name so that readers never see a partial segment.
+        tmp_path = os.path.join(self.index_path, f".{name}.tmp")
+        os.makedirs(tmp_path)
+        encoded_chunks = [
+            (json.dumps(chunk, ensure_ascii=False) + "\n").encode("utf-8")
+            for chunk in chunks
+        ]
+        with open(os.path.join(tmp_path, "chunks.jsonl"), "wb") as f:
+            f.writelines(encoded_chunks)
+        chunk_offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+        chunk_offsets[1:] = np.cumsum([len(line) for line in encoded_chunks])
+        with open(os.path.join(tmp_path, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(vocab, f, ensure_ascii=False)
+        with open(os.path.join(tmp_path, "urls.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                list(dict.fromkeys(chunk["url"] for chunk in chunks)),
+                f,
+                ensure_ascii=False,
+            )
+        for array_name, array in (
+            ("term_offsets", term_offsets),
+            ("postings_docs", postings_docs),
+            ("postings_tfs", postings_tfs),
+            ("doc_lens", doc_lens),
+            ("chunk_offsets", chunk_offsets),
+        ):
+            np.save(os.path.join(tmp_path, f"{array_name}.npy"), array)
+        os.rename(tmp_path, os.path.join(self.index_path, name))
+
+        meta["segments"].append(name)
+        meta_path = os.path.join(self.index_path, "meta.json")
+        with open(f"{meta_path}.tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(f"{meta_path}.tmp", meta_path)
+        self.load()
+        return len(chunks)
+
+    def add_csv(
+        self,
+        file_path: str,
+        content_column: str,
+        title_column: str = "title",
+        url_column: str = "url",
+        desc_column: str = "description",
+        chunk_size: int = 500,
+        chunk_overlap: int = 100,
+    ) -> int:
+        """
+        Takes a CSV file and indexes each row of the CSV file as a document, skipping the documents whose URL is
+        already indexed.
+
+        The CSV file has the same schema as in `QdrantVectorStoreManager.create_or_update_vector_store`.
+
+        Args:
+            file_path (str): Path to the CSV file.
+            content_column (str): Name of the column containing the content.
+            title_column (str): Name of the column containing the title. Default is "title".
+            url_column (str): Name of the column containing the URL. Default is "url".
+            desc_column (str): Name of the column containing the description. Default is "description".
+            chunk_size: Size of each chunk.
+            chunk_overlap: Overlap between chunks.
+
+        Returns:
+            The number of chunks indexed.
+        """
+        if file_path is None:
+            raise ValueError("Please provide a file path.")
+        # check if the file is a csv file
+        if not file_path.endswith(".csv"):
+            raise ValueError(f"Not valid file format. Please provide a csv file.")
+        if content_column is None:
+            raise ValueError("Please provide the name of the content column.")
+        if url_column is None:
+            raise ValueError("Please provide the name of the url column.")
+
+        # read the csv file
+        df = pd.read_csv(file_path)
+        # check that content column exists and url column exists
+        if content_column not in df.columns:
+            raise ValueError(
+                f"Content column {content_column} not found in the csv file."
+            )
+        if url_column not in df.columns:
+            raise ValueError(f"URL column {url_column} not found in the csv file.")
+        df = df.fillna("")
+
+        documents = [
+            {
+                "content": str(row[content_column]),
+                "title": str(row.get(title_column, "")),
+                "url": str(row[url_column]),
+                "description": str(row.get(desc_column, "")),
+            }
+            for row in df.to_dict(orient="records")
+        ]
+        return self.add_documents(
+            documents, chunk_size=chunk_size, chunk_overlap=chunk_overlap
+        )
+
+    def search(self, query: str, k: int) -> List[Tuple[float, dict]]:
+        """Get the k chunks with the highest BM25 scores for the query, as (score, chunk) pairs."""
+        with self._lock:
+            segments = self._segments
+            num_chunks = self.num_chunks
+        terms = list(dict.fromkeys(self.tokenize(query)))
+        if not terms or not num_chunks:
+            return []
+
+        # Document frequencies over all segments.
+        dfs = {
+            term: sum(len(self._get_postings(s, term)[0]) for s in segments)
+            for term in terms
+        }
+        idfs = {
+            term: math.log(1 + (num_chunks - df + 0.5) / (df + 0.5))
+            for term, df in dfs.items()
+            if df
+        }
+
+        candidates = []
+        for segment in segments:
+            docs, contributions = [], []
+            for term, idf in idfs.items():
+                term_docs, tfs = self._get_postings(segment, term)
+                if not len(term_docs):
+                    continue
+                docs.append(term_docs)
+                contributions.append(
+                    idf * tfs * (self.k1 + 1) / (tfs + segment["norms"][term_docs])
+                )
+            if not docs:
+                continue
+            unique_docs, inverse = np.unique(np.concatenate(docs), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(contributions))
+            top = np.argpartition(-scores, min(k, len(scores) - 1))[:k]
+            candidates.extend(
+                (float(scores[i]), segment, int(unique_docs[i])) for i in top
+            )
+
+        candidates.sort(key=lambda x: x[0], reverse=True)
+        return [
+            (score, self._get_chunk(segment, i)) for score, segment, i in candidates[:k]
+        ]
+
+    def close(self):
+        with self._lock:
+            segments = self._segments
+            self._segments = []
+            self.num_chunks = 0
+            self._urls = set()
+        for segment in segments:
+            segment["chunks"].close()
+            segment["chunks_file"].close()
+
+
+class TokenCounter:
+    """Count the tokens of text with the tokenizer of a model.
+
+    Token counts are cached per line (and per word for the last line of a truncated text), so fitting the same
+    snippets into a budget again does not tokenize them again.
+    """
+
+    def __init__(
+        self,
+        encode: Optional[Callable[[str], list]] = None,
+        cache_size: int = 100_000,
+    ):
+        """
+        Args:
+            encode: Function turning text into tokens. None estimates 4 tokens per 3 words instead.
+            cache_size: Number of distinct lines whose token count is cached.
+        """
+        self._encode = encode
+        self._count_line = functools.lru_cache(maxsize=cache_size)(self._count)
+
+    def _count(self, text: str) -> int:
+        if self._encode is None:
+            return math.ceil(len(text.split()) * 4 / 3)
+        return len(self._encode(text))
+
+    def count(self, text: str) -> int:
+        lines = text.split("\n")
+        return sum(self._count_line(line) for line in lines) + len(lines) - 1
+
+
+_token_counters = {}
+_token_counters_lock = threading.Lock()
+
+
+def _load_encode(lm, model: str) -> Optional[Callable[[str], list]]:
+    tokenizer = getattr(lm, "tokenizer", None)
+    if tokenizer is None and isinstance(lm, (VLLMClient, TGIClient, TogetherClient)):
+        try:
+            tokenizer = AutoTokenizer.from_pretrained(model)
+        except Exception as e:
+            logging.warning(f"Cannot load the tokenizer of {model}: {e}")
+    if tokenizer is not None:
+        return functools.partial(tokenizer.encode, add_special_tokens=False)
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model).encode
+        except KeyError:
+            # Approximate models without a tiktoken encoding, e.g., Claude or Gemini, with the GPT-4 encoding.
+            return tiktoken.get_encoding("cl100k_base").encode
+    except Exception as e:
+        logging.warning(f"Cannot load the tiktoken encoding for {model}: {e}")
+        return None
+
+
+def get_token_counter(lm) -> TokenCounter:
+    """Get the token counter matching the tokenizer of a language model; counters are shared per model.
+
+    OpenAI-compatible models are counted with tiktoken, models served with vLLM, TGI or Together with their
+    Hugging Face tokenizer, and other models with tiktoken's cl100k_base encoding as an approximation. If no
+    tokenizer is available, tokens are estimated from the word count.
+    """
+    model = _get_lm_model_name(lm)
+    key = (type(lm).__name__, model)
+    with _token_counters_lock:
+        if key not in _token_counters:
+            _token_counters[key] = TokenCounter(encode=_load_encode(lm, model))
+        return _token_counters[key]
+
+
+def _get_lm_model_name(lm) -> str:
+    return (
+        getattr(lm, "model", None)
+        or getattr(lm, "kwargs", {}).get("model")
+        or type(lm).__name__
+    )
+
+
+# Context windows in tokens, matched against the model name (the longest matching key wins).
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4-1106": 128000,
+    "gpt-4-0125": 128000,
+    "gpt-4-32k": 32768,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo-instruct": 4096,
+    "gpt-3.5-turbo": 16385,
+    "o1": 128000,
+    "claude": 200000,
+    "gemini-1.5": 1000000,
+    "gemini": 32760,
+    "mistral": 32768,
+    "mixtral": 32768,
+    "llama-3.1": 131072,
+    "llama-3.2": 131072,
+    "llama-3": 8192,
+    "llama-2": 4096,
+    "qwen2": 32768,
+    "deepseek": 65536,
+}
+# Used for models not listed above.
+DEFAULT_CONTEXT_WINDOW = 8192
+# Tokens of the prompt template of dspy around the fields: format instructions, field labels and separators.
+PROMPT_TEMPLATE_TOKENS = 150
+
+
+def get_context_window(lm) -> int:
+    """Get the context window of a language model in tokens.
+
+    It is read from the `context_window` attribute or request argument of the LM if set, and otherwise looked up
+    by model name in `MODEL_CONTEXT_WINDOWS`.
+    """
+    context_window = getattr(lm, "context_window", None) or getattr(
+        lm, "kwargs", {}
+    ).get("context_window")
+    if context_window:
+        return context_window
+    model = _get_lm_model_name(lm).lower()
+    matches = [name for name in MODEL_CONTEXT_WINDOWS if name in model]
+    if not matches:
+        return DEFAULT_CONTEXT_WINDOW
+    return MODEL_CONTEXT_WINDOWS[max(matches, key=len)]
+
+
+def _get_signature_text(signature) -> str:
+    parts = [signature.instructions]
+    for field in signature.fields.values():
+        extra = field.json_schema_extra or {}
+        parts += [str(extra.get("prefix", "")), str(extra.get("desc", ""))]
+    return "\n".join(parts)
+
+
+def get_input_token_budget(
+    lm, signature, *other_inputs: str, max_budget: Optional[int] = None
+) -> int:
+    """Get the number of tokens left for the variable-length input of a prompt, e.g., collected snippets.
+
+    The budget is the context window of `lm` minus the prompt reserve (instructions and fields of the dspy
+    `signature`, the other inputs of the prompt and the template) and the output reserve (`max_tokens`), capped
+    at `max_budget`.
+
+    Args:
+        lm: The language model the prompt is sent to.
+        signature: The dspy signature of the prompt.
+        other_inputs: The values of the other input fields of the prompt.
+        max_budget: Maximum budget, so that models with large context windows are not sent all the collected
+            text, which would raise cost and latency. None means no cap.
+    """
+    counter = get_token_counter(lm)
+    kwargs = getattr(lm, "kwargs", {})
+    output_reserve = kwargs.get("max_tokens") or kwargs.get("max_output_tokens") or 0
+    prompt_reserve = (
+        counter.count(_get_signature_text(signature))
+        + sum(counter.count(text or "") for text in other_inputs)
+        + PROMPT_TEMPLATE_TOKENS
+    )
+    budget = max(0, get_context_window(lm) - prompt_reserve - output_reserve)
+    return budget if max_budget is None else min(budget, max_budget)
+
+
 class ArticleTextProcessing:
     @staticmethod
     def limit_word_count_preserve_newline(input_string, max_word_count):
@@ -326,6 +855,52 @@ class ArticleTextProcessing:
 
         return limited_string.strip()
 
+    @staticmethod
+    def limit_token_count_preserve_newline(
+        input_string, max_token_count, token_counter: TokenCounter
+    ):
+        """
+        Limit the token count of an input string to a specified maximum, while preserving the integrity of complete lines.
+
+        Works like `limit_word_count_preserve_newline` but measures the budget in tokens of the target model, so
+        that the text fits the context of the model neither overshooting nor wasting it.
+
+        Args:
+            input_string (str): The string to be truncated. This string may contain multiple lines.
+            max_token_count (int): The maximum number of tokens allowed in the truncated string.
+            token_counter (TokenCounter): The token counter of the target model, see `get_token_counter`.
+
+        Returns:
+            str: The truncated string with token count limited to `max_token_count`.
+        """
+
+        token_count = 0
+        limited_lines = []
+
+        for line in input_string.split("\n"):
+            line = " ".join(line.split())
+            if not line:
+                continue
+            # Count one token for the newline separating the lines.
+            line_token_count = token_counter.count(line) + 1
+            if token_count + line_token_count <= max_token_count:
+                limited_lines.append(line)
+                token_count += line_token_count
+                continue
+            # Keep the words of the first line exceeding the budget which still fit.
+            line_words = []
+            for word in line.split():
+                word_token_count = token_counter.count(word)
+                if token_count + word_token_count > max_token_count:
+                    break
+                line_words.append(word)
+                token_count += word_token_count
+            if line_words:
+                limited_lines.append(" ".join(line_words))
+            break
+
+        return "\n".join(limited_lines).strip()
+
     @staticmethod
     def remove_citations(s):
         """
@@ -623,137 +1198,973 @@ class FileIOHelper:
             return pickle.load(f)
 
 
+class ResponseTooLarge(Exception):
+    """Raised when the body of a response exceeds the maximum size of a download."""
+
+
+class HTTPClientPool:
+    """Long-lived pooled HTTP client shared by the `WebPageHelper` of all retrievers in a process.
+
+    Connections are kept alive across pages and retrievers, HTTP/2 is used when the `h2` package is installed,
+    and the number of concurrent requests to the same host is capped by `max_connections_per_host` (httpx only
+    bounds the pool as a whole). `get()` is for threads; `aget()` is its asyncio counterpart, which uses one
+    async client per event loop. `run()` executes a coroutine on an event loop owned by the pool, so that sync
+    callers reuse the connections of its async client across calls.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 50,
+        max_connections_per_host: int = 6,
+        keepalive_expiry: float = 30.0,
+        http2: bool = True,
+        timeout: float = 10.0,
+    ):
+        self.max_connections_per_host = max_connections_per_host
+        self.http2 = http2 and h2 is not None
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = timeout
+        self.client = httpx.Client(
+            http2=self.http2,
+            limits=self.limits,
+            timeout=timeout,
+            follow_redirects=True,
+        )
+        self._lock = threading.Lock()
+        self._host_semaphores = defaultdict(
+            lambda: threading.BoundedSemaphore(self.max_connections_per_host)
+        )
+        self._hosts = set()
+        # Event loop -> (async client, per-host asyncio semaphores). asyncio objects are bound to their loop.
+        self._async_states = weakref.WeakKeyDictionary()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stats = defaultdict(float)
+
+    @staticmethod
+    def get_host(url: str) -> str:
+        return urlsplit(url).netloc.lower()
+
+    def _log(self, **counts):
+        with self._lock:
+            for k, v in counts.items():
+                self._stats[k] += v
+
+    def _log_response(self, response: httpx.Response):
+        self._log(
+            requests=1,
+            http2_responses=response.http_version == "HTTP/2",
+            bytes_downloaded=len(response.content),
+        )
+
+    @contextmanager
+    def host_slot(self, url: str):
+        """Hold one of the `max_connections_per_host` request slots of the host of `url`."""
+        host = self.get_host(url)
+        with self._lock:
+            self._hosts.add(host)
+            semaphore = self._host_semaphores[host]
+        start_time = time.time()
+        with semaphore:
+            self._log(host_wait_seconds=time.time() - start_time)
+            yield
+
+    def get(self, url: str, **kwargs) -> httpx.Response:
+        with self.host_slot(url):
+            try:
+                response = self.client.get(url, **kwargs)
+            except Exception:
+                self._log(requests=1, errors=1)
+                raise
+        self._log_response(response)
+        return response
+
+    def _get_async_state(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            state = self._async_states.get(loop)
+            if state is None or state[0].is_closed:
+                client = httpx.AsyncClient(
+                    http2=self.http2,
+                    limits=self.limits,
+                    timeout=self.timeout,
+                    follow_redirects=True,
+                )
+                semaphores = defaultdict(
+                    lambda: asyncio.Semaphore(self.max_connections_per_host)
+                )
+                state = (client, semaphores)
+                self._async_states[loop] = state
+        return state
+
+    @asynccontextmanager
+    async def ahost_slot(self, url: str):
+        """Async counterpart of `host_slot()`. The slots are shared by the coroutines of the running loop."""
+        _, semaphores = self._get_async_state()
+        host = self.get_host(url)
+        with self._lock:
+            self._hosts.add(host)
+        start_time = time.time()
+        async with semaphores[host]:
+            self._log(host_wait_seconds=time.time() - start_time)
+            yield
+
+    async def aget(
+        self,
+        url: str,
+        accept: Optional[Callable[[httpx.Response], bool]] = None,
+        max_body_size: Optional[int] = None,
+        **kwargs,
+    ) -> httpx.Response:
+        """GET `url`, streaming the body so that unwanted bodies are not transferred.
+
+        Args:
+            accept: Called with the response once its status and headers are received; if it returns False, the
+                connection is closed without reading the body and the response is returned with an empty body.
+            max_body_size: Maximum size of the body in bytes. Larger bodies raise `ResponseTooLarge` as soon as
+                the Content-Length header or the bytes read exceed it.
+        """
+        client, _ = self._get_async_state()
+        async with self.ahost_slot(url):
+            try:
+                async with client.stream("GET", url, **kwargs) as response:
+                    content = b""
+                    if accept is None or accept(response):
+                        content = await self._aread_body(response, max_body_size)
+                    else:
+                        self._log(skipped_bodies=1)
+            except ResponseTooLarge:
+                self._log(requests=1, skipped_bodies=1)
+                raise
+            except Exception:
+                self._log(requests=1, errors=1)
+                raise
+        response = httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            content=content,
+            request=response.request,
+            extensions=response.extensions,
+        )
+        self._log_response(response)
+        return response
+
+    @staticmethod
+    async def _aread_body(response: httpx.Response, max_body_size: Optional[int]):
+        if max_body_size is None:
+            return await response.aread()
+        content_length = response.headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > max_body_size:
+            raise ResponseTooLarge(f"{response.url}: {content_length} bytes")
+        chunks = []
+        size = 0
+        async for chunk in response.aiter_bytes():
+            size += len(chunk)
+            if size > max_body_size:
+                raise ResponseTooLarge(f"{response.url}: over {max_body_size} bytes")
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def run(self, coro):
+        """Run a coroutine on the event loop of the pool from a thread without a running loop and wait for it."""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name="HTTPClientPool", daemon=True
+                ).start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def get_stats(self) -> dict:
+        """Get the request counters of the pool and the number of connections it currently holds."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["hosts"] = len(self._hosts)
+            clients = [self.client] + [c for c, _ in self._async_states.values()]
+        # httpx does not expose its pool; httpcore's ConnectionPool lists its connections.
+        connections = [
+            connection
+            for client in clients
+            for connection in getattr(
+                getattr(client._transport, "_pool", None), "connections", []
+            )
+        ]
+        stats["open_connections"] = len(connections)
+        stats["idle_connections"] = sum(1 for c in connections if c.is_idle())
+        return {k: int(v) if k != "host_wait_seconds" else v for k, v in stats.items()}
+
+    def close(self):
+        self.client.close()
+        if self._loop is not None:
+            state = self._async_states.get(self._loop)
+            if state is not None:
+                self.run(state[0].aclose())
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+
+
+_http_pool: Optional[HTTPClientPool] = None
+_http_pool_lock = threading.Lock()
+
+
+def configure_http_pool(**kwargs) -> HTTPClientPool:
+    """Replace the HTTP client pool shared by all `WebPageHelper` instances, see `HTTPClientPool` for the settings."""
+    global _http_pool
+    with _http_pool_lock:
+        if _http_pool is not None:
+            _http_pool.close()
+        _http_pool = HTTPClientPool(**kwargs)
+    return _http_pool
+
+
+def get_http_pool() -> HTTPClientPool:
+    """Get the HTTP client pool shared by all `WebPageHelper` instances, creating it on first use."""
+    global _http_pool
+    with _http_pool_lock:
+        if _http_pool is None:
+            _http_pool = HTTPClientPool()
+        return _http_pool
+
+
+class DownloadScheduler:
+    """Decide when webpages are downloaded and retried, shared by the `WebPageHelper` of all retrievers.
+
+    - Politeness: requests to the same host start at least `min_host_interval` seconds apart. The interval of a
+      host grows when it answers 429/503 (honoring Retry-After) and shrinks back as its requests succeed. The
+      number of concurrent requests per host is capped by the HTTP client pool.
+    - Failing hosts: after `host_failure_threshold` consecutive failures, a host is skipped for `host_cooldown`
+      seconds instead of holding download slots with requests bound to fail.
+    - Retry budget: retries are allowed while they stay below `retry_budget_ratio` of the requests of the last
+      `retry_budget_window` seconds (plus `min_retry_budget`), so that retries cannot multiply the load when many
+      hosts fail at once. Retry delays are awaited, not slept, and therefore do not hold any thread.
+    """
+
+    # Failures worth retrying; other responses (e.g., 404) are final.
+    RETRYABLE_STATUS_CODES = (408, 425, 429, 500, 502, 503, 504)
+
+    def __init__(
+        self,
+        min_host_interval: float = 0.0,
+        max_host_interval: float = 30.0,
+        retry_base_delay: float = 1.0,
+        max_retry_delay: float = 30.0,
+        retry_budget_ratio: float = 0.2,
+        min_retry_budget: int = 10,
+        retry_budget_window: float = 60.0,
+        host_failure_threshold: int = 3,
+        host_cooldown: float = 300.0,
+    ):
+        """
+        Args:
+            min_host_interval: Minimum time in seconds between the starts of two requests to the same host.
+            max_host_interval: Upper bound of the interval of a host slowed down by 429/503 answers.
+            retry_base_delay: Delay in seconds before the first retry; it doubles at every further retry.
+            max_retry_delay: Upper bound of the delay before a retry, including the delay asked by Retry-After.
+            retry_budget_ratio: Maximum ratio of retries to requests over the budget window.
+            min_retry_budget: Number of retries always allowed within the budget window.
+            retry_budget_window: Length in seconds of the sliding window of the retry budget.
+            host_failure_threshold: Number of consecutive failures after which a host is skipped.
+            host_cooldown: Time in seconds during which a failing host is skipped.
+        """
+        self.min_host_interval = min_host_interval
+        self.max_host_interval = max_host_interval
+        self.retry_base_delay = retry_base_delay
+        self.max_retry_delay = max_retry_delay
+        self.retry_budget_ratio = retry_budget_ratio
+        self.min_retry_budget = min_retry_budget
+        self.retry_budget_window = retry_budget_window
+        self.host_failure_threshold = host_failure_threshold
+        self.host_cooldown = host_cooldown
+        self._lock = threading.Lock()
+        self._hosts = defaultdict(
+            lambda: {
+                "requests": 0,
+                "errors": 0,
+                "consecutive_failures": 0,
+                "latency": None,
+                "interval": self.min_host_interval,
+                "next_request_at": 0.0,
+                "retry_after": 0.0,
+                "skipped_until": 0.0,
+            }
+        )
+        self._request_times = deque()
+        self._retry_times = deque()
+        self._stats = defaultdict(int)
+
+    @staticmethod
+    def get_host(url: str) -> str:
+        return urlsplit(url).netloc.lower()
+
+    def should_skip(self, url: str) -> bool:
+        """Whether the host of `url` failed recently and is skipped."""
+        with self._lock:
+            skip = time.time() < self._hosts[self.get_host(url)]["skipped_until"]
+            if skip:
+                self._stats["skipped"] += 1
+        return skip
+
+    async def wait_for_turn(self, url: str):
+        """Wait until a request to the host of `url` may start, and book that start."""
+        now = time.time()
+        with self._lock:
+            host = self._hosts[self.get_host(url)]
+            start_at = max(now, host["next_request_at"])
+            host["next_request_at"] = start_at + host["interval"]
+            # Trimmed here as well so that the window stays bounded when no request is ever retried.
+            self._trim_window(self._request_times, now)
+            self._request_times.append(now)
+        if start_at > now:
+            await asyncio.sleep(start_at - now)
+
+    def _trim_window(self, times: deque, now: float):
+        while times and times[0] < now - self.retry_budget_window:
+            times.popleft()
+
+    def acquire_retry(self) -> bool:
+        """Take a retry from the budget, or return False if it is spent."""
+        now = time.time()
+        with self._lock:
+            self._trim_window(self._request_times, now)
+            self._trim_window(self._retry_times, now)
+            budget = self.min_retry_budget + self.retry_budget_ratio * len(
+                self._request_times
+            )
+            if len(self._retry_times) >= budget:
+                self._stats["retries_denied"] += 1
+                return False
+            self._retry_times.append(now)
+            self._stats["retries"] += 1
+        return True
+
+    def get_retry_delay(self, url: str, attempt: int) -> float:
+        """Get the delay before retrying `url` for the `attempt`-th time (starting from 1)."""
+        with self._lock:
+            retry_after = self._hosts[self.get_host(url)]["retry_after"]
+        delay = self.retry_base_delay * 2 ** (attempt - 1) + random.uniform(0, 1)
+        return min(max(delay, retry_after), self.max_retry_delay)
+
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> float:
+        """Get the delay of a Retry-After header given in seconds; HTTP dates are ignored."""
+        try:
+            return max(0.0, float(value))
+        except (TypeError, ValueError):
+            return 0.0
+
+    def record(
+        self,
+        url: str,
+        latency: float,
+        response: Optional[httpx.Response] = None,
+    ) -> bool:
+        """Record the outcome of a request, without response if it raised.
+
+        Returns:
+            whether the request failed in a way worth retrying.
+        """
+        retryable = (
+            response is None or response.status_code in self.RETRYABLE_STATUS_CODES
+        )
+        with self._lock:
+            host = self._hosts[self.get_host(url)]
+            host["requests"] += 1
+            host["latency"] = (
+                latency
+                if host["latency"] is None
+                else 0.8 * host["latency"] + 0.2 * latency
+            )
+            if not retryable:
+                host["consecutive_failures"] = 0
+                host["retry_after"] = 0.0
+                host["interval"] = max(self.min_host_interval, host["interval"] / 2)
+                return False
+            host["errors"] += 1
+            host["consecutive_failures"] += 1
+            self._stats["errors"] += 1
+            if response is not None and response.status_code in (429, 503):
+                # The host asks to slow down.
+                host["retry_after"] = self._parse_retry_after(
+                    response.headers.get("retry-after")
+                )
+                host["interval"] = min(
+                    self.max_host_interval,
+                    max(2 * host["interval"], self.retry_base_delay),
+                )
+            if host["consecutive_failures"] >= self.host_failure_threshold:
+                host["skipped_until"] = time.time() + self.host_cooldown
+        return True
+
+    def get_host_stats(self, url: str) -> dict:
+        with self._lock:
+            return dict(self._hosts[self.get_host(url)])
+
+    def get_stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            stats = dict(self._stats)
+            stats["hosts"] = len(self._hosts)
+            stats["skipped_hosts"] = sum(
+                host["skipped_until"] > now for host in self._hosts.values()
+            )
+        return stats
+
+
+_download_scheduler: Optional[DownloadScheduler] = None
+_download_scheduler_lock = threading.Lock()
+
+
+def configure_download_scheduler(**kwargs) -> DownloadScheduler:
+    """Replace the download scheduler shared by all `WebPageHelper` instances, see `DownloadScheduler` for the
+    settings. Host health and the retry budget start afresh, e.g., for a new run."""
+    global _download_scheduler
+    with _download_scheduler_lock:
+        _download_scheduler = DownloadScheduler(**kwargs)
+    return _download_scheduler
+
+
+def get_download_scheduler() -> DownloadScheduler:
+    """Get the download scheduler shared by all `WebPageHelper` instances, creating it on first use."""
+    global _download_scheduler
+    with _download_scheduler_lock:
+        if _download_scheduler is None:
+            _download_scheduler = DownloadScheduler()
+        return _download_scheduler
+
+
+class WebPageCache:
+    """On-disk cache of processed webpages (extracted text and snippets), keyed by normalized URL.
+
+    Entries are fresh for `ttl` seconds. A stale entry is revalidated with a conditional request using the ETag
+    and Last-Modified headers of the cached response; a 304 Not Modified answer renews the entry without
+    downloading or extracting the page again. Pages without any text worth keeping are cached as well, so that
+    they are not downloaded again either.
+    """
+
+    # Query parameters that only track the visitor and do not change the page.
+    TRACKING_PARAMETERS = ("utm_", "gclid", "fbclid", "mc_cid", "mc_eid")
+
+    def __init__(
+        self,
+        path: str = "~/.cache/knowledge_storm/page_cache.sqlite",
+        ttl: float = 7 * 24 * 3600,
+        max_age: Optional[float] = None,
+        max_size_bytes: Optional[int] = 1024 * 1024 * 1024,
+    ):
+        """
+        Args:
+            path: Path to the SQLite file. Processes pointing to the same file share the cache.
+            ttl: Time in seconds during which a page is served from the cache without asking the server.
+            max_age: Time in seconds after which an entry is dropped instead of revalidated. None means never.
+            max_size_bytes: Size bound of the cache; least recently used pages are evicted beyond it.
+        """
+        self.ttl = ttl
+        self._cache = SQLiteCache(path=path, ttl=max_age, max_size_bytes=max_size_bytes)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "revalidated": 0, "misses": 0}
+
+    @classmethod
+    def normalize_url(cls, url: str) -> str:
+        """Normalize the URL so that different spellings of the same page share an entry."""
+        parts = urlsplit(url.strip())
+        scheme = parts.scheme.lower()
+        netloc = parts.netloc.lower()
+        if (scheme, parts.port) in (("http", 80), ("https", 443)):
+            netloc = netloc.rsplit(":", 1)[0]
+        query = urlencode(
+            sorted(
+                (k, v)
+                for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                if not k.lower().startswith(cls.TRACKING_PARAMETERS)
+            )
+        )
+        return urlunsplit((scheme, netloc, parts.path or "/", query, ""))
+
+    def _make_key(self, url: str, min_char_count: int) -> str:
+        return SQLiteCache.make_key("page", self.normalize_url(url), min_char_count)
+
+    def _log(self, **counts):
+        with self._lock:
+            for k, v in counts.items():
+                self._stats[k] += v
+
+    def get(self, url: str, min_char_count: int) -> Optional[dict]:
+        """Get the cache entry of a page, fresh or stale. Returns None if the page is not cached."""
+        entry = self._cache.get(self._make_key(url, min_char_count))
+        if entry is not None and self.is_fresh(entry):
+            self._log(hits=1)
+        return entry
+
+    def is_fresh(self, entry: dict) -> bool:
+        return time.time() - entry["fetched_at"] < self.ttl
+
+    @staticmethod
+    def get_conditional_headers(entry: dict) -> dict:
+        """Get the headers revalidating a stale entry."""
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def set(
+        self,
+        url: str,
+        min_char_count: int,
+        article: Optional[dict],
+        response: Optional[httpx.Response] = None,
+        snippet_chunk_size: Optional[int] = None,
+    ) -> dict:
+        """Cache the processed page, together with the validators of the response it was downloaded with."""
+        headers = response.headers if response is not None else {}
+        entry = {
+            "url": url,
+            "article": article,
+            "snippet_chunk_size": snippet_chunk_size,
+            "etag": headers.get("etag"),
+            "last_modified": headers.get("last-modified"),
+            "fetched_at": time.time(),
+        }
+        self._cache.set(self._make_key(url, min_char_count), entry)
+        self._log(misses=1)
+        return entry
+
+    def renew(self, url: str, min_char_count: int, entry: dict) -> dict:
+        """Mark a stale entry as fresh again after the server confirmed it is unchanged."""
+        entry = {**entry, "fetched_at": time.time()}
+        self._cache.set(self._make_key(url, min_char_count), entry)
+        self._log(revalidated=1)
+        return entry
+
+    def get_stats(self) -> dict:
+        stats = self._cache.stats()
+        # Hits and misses counted here tell apart fresh hits and revalidations.
+        with self._lock:
+            stats.update(self._stats)
+        return stats
+
+    def close(self):
+        self._cache.close()
+
+
+# Process-wide webpage cache used by all WebPageHelper instances. Disabled unless `enable_page_cache` is called.
+_page_cache: Optional[WebPageCache] = None
+
+
+def enable_page_cache(**kwargs) -> WebPageCache:
+    """Turn on the on-disk webpage cache consulted by all retrievers downloading webpages.
+
+    Args:
+        **kwargs: Arguments of `WebPageCache`, e.g., its path and TTL.
+    """
+    global _page_cache
+    _page_cache = WebPageCache(**kwargs)
+    return _page_cache
+
+
+def disable_page_cache():
+    global _page_cache
+    if _page_cache is not None:
+        _page_cache.close()
+    _page_cache = None
+
+
+def get_page_cache() -> Optional[WebPageCache]:
+    return _page_cache
+
+
+def _make_snippet_splitter(
+    chunk_size: int, chunk_overlap: int = 0
+) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        is_separator_regex=False,
+        separators=[
+            "\n\n",
+            "\n",
+            ".",
+            "\uff0e",  # Fullwidth full stop
+            "\u3002",  # Ideographic full stop
+            ",",
+            "\uff0c",  # Fullwidth comma
+            "\u3001",  # Ideographic comma
+            " ",
+            "\u200B",  # Zero-width space
+            "",
+        ],
+    )
+
+
+# One splitter per worker process.
+_get_snippet_splitter = functools.lru_cache(maxsize=None)(_make_snippet_splitter)
+
+
+def _extract_pdf_text(content: bytes) -> str:
+    reader = pypdf.PdfReader(io.BytesIO(content))
+    return "\n\n".join(page.extract_text() or "" for page in reader.pages).strip()
+
+
+def extract_article(
+    html: bytes, min_char_count: int, content_type: Optional[str] = None
+) -> Optional[dict]:
+    """Extract the main text of a webpage, or None if it is shorter than `min_char_count` characters.
+
+    PDF documents (by `content_type`) are read with pypdf instead of trafilatura.
+    """
+    try:
+        if content_type is not None and "application/pdf" in content_type.lower():
+            article_text = _extract_pdf_text(html)
+        else:
+            article_text = extract(
+                html,
+                include_tables=False,
+                include_comments=False,
+                output_format="txt",
+            )
+    except Exception:
+        return None
+    if article_text is not None and len(article_text) > min_char_count:
+        return {"text": article_text}
+    return None
+
+
+def extract_snippets(
+    html: bytes,
+    min_char_count: int,
+    snippet_chunk_size: int,
+    content_type: Optional[str] = None,
+) -> Optional[dict]:
+    """Like `extract_article()`, with the text also split into snippets of at most `snippet_chunk_size` characters.
+
+    Module-level so that it can run in a process pool: it takes the raw page and returns plain data.
+    """
+    article = extract_article(html, min_char_count, content_type)
+    if article is not None:
+        article["snippets"] = split_snippets(article["text"], snippet_chunk_size)
+    return article
+
+
+def split_snippets(text: str, snippet_chunk_size: int) -> List[str]:
+    return _get_snippet_splitter(snippet_chunk_size).split_text(text)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_extraction_process_pool(
+    max_workers: int,
+) -> concurrent.futures.ProcessPoolExecutor:
+    """Worker processes are shared by all WebPageHelper instances, as starting them imports the package anew."""
+    # Forking a process running several threads may deadlock the child.
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _get_extraction_thread_pool(
+    max_workers: int,
+) -> concurrent.futures.ThreadPoolExecutor:
+    """Worker threads are shared by all WebPageHelper instances, which retrievers create and never close."""
+    return concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="WebPageHelper"
+    )
+
+
 class WebPageHelper:
     """Helper class to process web pages.
 
     Acknowledgement: Part of the code is adapted from https://github.com/stanford-oval/WikiChat project.
     """
 
+    HEADERS = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0.0.0 Safari/537.36",
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+        "Accept-Language": "en-US,en;q=0.5",
+    }
+
     def __init__(
         self,
         min_char_count: int = 150,
         snippet_chunk_size: int = 1000,
         max_thread_num: int = 10,
+        http_pool: Optional[HTTPClientPool] = None,
+        download_deadline: Optional[float] = None,
+        extraction_processes: Optional[int] = None,
+        page_cache: Optional[WebPageCache] = None,
+        download_scheduler: Optional[DownloadScheduler] = None,
+        max_body_size: Optional[int] = 5 * 1024 * 1024,
+        pdf_extraction: bool = False,
     ):
         """
         Args:
             min_char_count: Minimum character count for the article to be considered valid.
             snippet_chunk_size: Maximum character count for each snippet.
             max_thread_num: Maximum number of threads to use for concurrent requests (e.g., downloading webpages).
+            http_pool: HTTP client pool to download webpages with. Defaults to the pool shared by all
+                retrievers, see `configure_http_pool()`.
+            download_deadline: Time budget in seconds of `urls_to_articles()`; pages not processed by then are
+                dropped. None means waiting for all pages.
+            extraction_processes: Number of worker processes extracting the text of webpages and splitting it
+                into snippets. Extraction is CPU-bound and holds the GIL, so processes let it use several cores.
+                The processes are shared by all helpers with the same number of processes. None runs the
+                extraction in `max_thread_num` threads of this process, shared by all helpers with the same
+                number of threads.
+            page_cache: On-disk cache of processed webpages. Defaults to the process-wide cache, see
+                `enable_page_cache()`.
+            download_scheduler: Scheduler of downloads and retries. Defaults to the scheduler shared by all
+                retrievers, see `configure_download_scheduler()`.
+            max_body_size: Maximum size of a downloaded page in bytes; larger pages are dropped as soon as the
+                limit is reached. None means unbounded.
+            pdf_extraction: Whether to extract the text of PDF documents (requires `pip install pypdf`).
+                Otherwise, only HTML pages are downloaded; the body of other documents is never transferred.
         """
-        self.httpx_client = httpx.Client(verify=False)
+        self._http_pool = http_pool
+        self._page_cache = page_cache
+        self._download_scheduler = download_scheduler
+        if pdf_extraction and pypdf is None:
+            raise ImportError("PDF extraction requires `pip install pypdf`.")
+        self.max_body_size = max_body_size
+        self.pdf_extraction = pdf_extraction
         self.min_char_count = min_char_count
         self.max_thread_num = max_thread_num
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=snippet_chunk_size,
-            chunk_overlap=0,
-            length_function=len,
-            is_separator_regex=False,
-            separators=[
-                "\n\n",
-                "\n",
-                ".",
-                "\uff0e",  # Fullwidth full stop
-                "\u3002",  # Ideographic full stop
-                ",",
-                "\uff0c",  # Fullwidth comma
-                "\u3001",  # Ideographic comma
-                " ",
-                "\u200B",  # Zero-width space
-                "",
-            ],
-        )
+        self.download_deadline = download_deadline
+        self.snippet_chunk_size = snippet_chunk_size
+        self.download_stats = {"downloaded": 0, "failed": 0}
+        # Workers running the CPU-bound extraction while the event loop keeps downloading.
+        if extraction_processes is None:
+            self._extraction_executor = _get_extraction_thread_pool(max_thread_num)
+        else:
+            self._extraction_executor = _get_extraction_process_pool(
+                extraction_processes
+            )
+        self.text_splitter = _make_snippet_splitter(snippet_chunk_size)
+
+    @property
+    def http_pool(self) -> HTTPClientPool:
+        return self._http_pool or get_http_pool()
+
+    @property
+    def page_cache(self) -> Optional[WebPageCache]:
+        return self._page_cache or get_page_cache()
+
+    @property
+    def download_scheduler(self) -> DownloadScheduler:
+        return self._download_scheduler or get_download_scheduler()
+
+    def get_pool_stats(self) -> dict:
+        """Get the statistics of the HTTP client pool used to download webpages."""
+        return self.http_pool.get_stats()
+
+    def _is_wanted(self, res: httpx.Response) -> bool:
+        """Decide from the status and headers of a response whether its body is worth downloading."""
+        if res.status_code != 200:
+            return False
+        content_type = res.headers.get("content-type", "").lower()
+        if "text/html" in content_type:
+            return True
+        return self.pdf_extraction and "application/pdf" in content_type
+
+    def _get_html(self, res: httpx.Response) -> Optional[bytes]:
+        """Get the content of a response if it is a usable HTML page (or PDF document, see `pdf_extraction`)."""
+        if not self._is_wanted(res):
+            return None
+        if not res.content or len(res.content) < 100:
+            return None
+        return res.content
 
     def download_webpage(self, url: str, max_retries=3):
-        # Initialize stats dictionary if it doesn't exist
-        if not hasattr(self, 'download_stats'):
-            self.download_stats = {
-                'downloaded': 0,
-                'failed': 0
-            }
+        # Retries wait on the event loop of the HTTP client pool rather than in the calling thread.
+        return self.http_pool.run(self.adownload_webpage(url, max_retries))
 
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5'
-        }
-
-        client = httpx.Client(follow_redirects=True)
-        try:
-            for attempt in range(max_retries):
-                try:
-                    if attempt > 0:
-                        time.sleep(2 ** attempt + random.uniform(0, 1))
-
-                    res = client.get(url, timeout=10, headers=headers)
-
-                    if res.status_code == 200:
-                        content_type = res.headers.get('content-type', '')
-                        if 'text/html' not in content_type.lower():
-                            if attempt == max_retries - 1:
-                                self.download_stats['failed'] += 1
-                            continue
+    async def adownload_webpage(self, url: str, max_retries=3):
+        """Async counterpart of `download_webpage()`."""
+        res = await self._adownload_response(url, max_retries)
+        return res.content if res is not None else None
 
-                        if not res.content or len(res.content) < 100:
-                            if attempt == max_retries - 1:
-                                self.download_stats['failed'] += 1
-                            continue
-
-                        self.download_stats['downloaded'] += 1
-                        return res.content
-
-                    elif res.status_code >= 400 and attempt == max_retries - 1:
-                        self.download_stats['failed'] += 1
-
-                except Exception as e:
-                    if attempt == max_retries - 1:
-                        self.download_stats['failed'] += 1
-
-        finally:
-            client.close()
+    async def _adownload_response(
+        self, url: str, max_retries=3, headers: Optional[dict] = None
+    ) -> Optional[httpx.Response]:
+        """Download a webpage, returning the response if it is a usable HTML page or a 304 Not Modified.
 
+        Only failures worth retrying (network errors, 429, 5xx) are retried, within the retry budget of the
+        download scheduler, and hosts which failed recently are not requested at all.
+        """
+        scheduler = self.download_scheduler
+        for attempt in range(max_retries):
+            if scheduler.should_skip(url):
+                break
+            if attempt > 0:
+                if not scheduler.acquire_retry():
+                    break
+                await asyncio.sleep(scheduler.get_retry_delay(url, attempt))
+            await scheduler.wait_for_turn(url)
+            start_time = time.time()
+            try:
+                res = await self.http_pool.aget(
+                    url,
+                    accept=self._is_wanted,
+                    max_body_size=self.max_body_size,
+                    timeout=10,
+                    headers={**self.HEADERS, **(headers or {})},
+                )
+            except ResponseTooLarge:
+                break
+            except Exception:
+                scheduler.record(url, time.time() - start_time)
+                continue
+            if scheduler.record(url, time.time() - start_time, res):
+                continue
+            if res.status_code == 304:
+                return res
+            if self._get_html(res) is not None:
+                self.download_stats["downloaded"] += 1
+                return res
+            break
+
+        self.download_stats["failed"] += 1
         return None
 
-    def urls_to_articles(self, urls: List[str]) -> Dict:
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=self.max_thread_num
-        ) as executor:
-            htmls = list(executor.map(self.download_webpage, urls))
+    async def _afrom_cache(self, entry: dict, with_snippets: bool) -> Optional[dict]:
+        """Get the processed page of a cache entry, splitting its text into snippets if they are missing."""
+        article = entry["article"]
+        if article is None:
+            return None
+        if not with_snippets:
+            return {"text": article["text"]}
+        if entry["snippet_chunk_size"] == self.snippet_chunk_size:
+            return article
+        snippets = await asyncio.get_running_loop().run_in_executor(
+            self._extraction_executor,
+            split_snippets,
+            article["text"],
+            self.snippet_chunk_size,
+        )
+        return {**article, "snippets": snippets}
 
-        articles = {}
+    async def _aprocess_urls(
+        self, urls: List[str], with_snippets: bool, deadline: Optional[float]
+    ) -> Dict:
+        """Download the pages and hand each one to the extraction workers as soon as it arrives.
 
-        for h, u in zip(htmls, urls):
-            try:
-                if h is None:
-                    continue
+        Pages in the page cache are served from it, after a conditional request if their entry is stale.
+        Returns the results of the pages processed within `deadline` seconds, in the order of `urls`.
+        """
+        loop = asyncio.get_running_loop()
+        page_cache = self.page_cache
+        if with_snippets:
+            process = functools.partial(
+                extract_snippets,
+                min_char_count=self.min_char_count,
+                snippet_chunk_size=self.snippet_chunk_size,
+            )
+        else:
+            process = functools.partial(
+                extract_article, min_char_count=self.min_char_count
+            )
+        results = {}
+
+        async def download_and_process(url):
+            entry = None
+            if page_cache is not None:
+                entry = page_cache.get(url, self.min_char_count)
+                if entry is not None and page_cache.is_fresh(entry):
+                    result = await self._afrom_cache(entry, with_snippets)
+                    if result is not None:
+                        results[url] = result
+                    return
+            res = await self._adownload_response(
+                url,
+                headers=(page_cache.get_conditional_headers(entry) if entry else None),
+            )
+            if res is None:
+                return
+            if res.status_code == 304:
+                entry = page_cache.renew(url, self.min_char_count, entry)
+                result = await self._afrom_cache(entry, with_snippets)
+            else:
+                try:
+                    result = await loop.run_in_executor(
+                        self._extraction_executor,
+                        functools.partial(
+                            process, content_type=res.headers.get("content-type")
+                        ),
+                        res.content,
+                    )
+                except concurrent.futures.process.BrokenProcessPool:
+                    logging.error(f"Extraction worker died while processing {url}.")
+                    return
+                if page_cache is not None:
+                    page_cache.set(
+                        url,
+                        self.min_char_count,
+                        result,
+                        response=res,
+                        snippet_chunk_size=(
+                            self.snippet_chunk_size if with_snippets else None
+                        ),
+                    )
+            if result is not None:
+                results[url] = result
 
-                article_text = extract(
-                    h,
-                    include_tables=False,
-                    include_comments=False,
-                    output_format="txt",
+        tasks = {
+            asyncio.create_task(download_and_process(u)): u for u in dict.fromkeys(urls)
+        }
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=deadline)
+            for task in pending:
+                task.cancel()
+            for task in done:
+                if task.exception() is not None:
+                    logging.error(
+                        f"Error occurs when processing {tasks[task]}: {task.exception()!r}"
+                    )
+            if pending:
+                logging.warning(
+                    f"{len(pending)} of {len(tasks)} webpages were not processed within the {deadline}s deadline."
                 )
+        return {u: results[u] for u in urls if u in results}
 
-                if article_text is not None and len(article_text) > self.min_char_count:
-                    articles[u] = {"text": article_text}
+    async def aurls_to_articles(
+        self, urls: List[str], deadline: Optional[float] = None
+    ) -> Dict:
+        """Download and extract webpages concurrently, returning those processed within `deadline` seconds."""
+        return await self._aprocess_urls(urls, False, deadline)
 
-            except Exception:
-                continue
+    async def aurls_to_snippets(
+        self, urls: List[str], deadline: Optional[float] = None
+    ) -> Dict:
+        """Like `aurls_to_articles()`, with the text of every article also split into snippets."""
+        return await self._aprocess_urls(urls, True, deadline)
 
+    def _print_download_stats(self):
         # Print download statistics after processing all URLs
         print(f"\nDownload Statistics:")
         print(f"Successfully downloaded: {self.download_stats['downloaded']}")
         print(f"Failed downloads: {self.download_stats['failed']}")
 
+    def urls_to_articles(self, urls: List[str]) -> Dict:
+        articles = self.http_pool.run(
+            self.aurls_to_articles(urls, deadline=self.download_deadline)
+        )
+        self._print_download_stats()
         return articles
 
     def urls_to_snippets(self, urls: List[str]) -> Dict:
-        articles = self.urls_to_articles(urls)
-        for u in articles:
-            articles[u]["snippets"] = self.text_splitter.split_text(articles[u]["text"])
-
+        articles = self.http_pool.run(
+            self.aurls_to_snippets(urls, deadline=self.download_deadline)
+        )
+        self._print_download_stats()
         return articles
 
+    def close(self):
+        """Kept for compatibility: the extraction workers are shared by all helpers and left running."""
+
 def user_input_appropriateness_check(user_input):
     my_openai_model = OpenAIModel(
         api_key=os.getenv("OPENAI_API_KEY"),
@@ -0,0 +1,63 @@
+import asyncio
+
+from knowledge_storm.lm import FailoverLM
+
+
+class FakeBackend:
+    provider = "fake"
+
+    def __init__(self, model: str):
+        self.model = model
+        self.kwargs = {"model": model}
+        self.history = []
+        self.fail = False
+        self.calls = 0
+
+    def __call__(self, prompt, **kwargs):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError(f"{self.model} is down")
+        return [f"{self.model}: {prompt}"]
+
+    async def acall(self, prompt, **kwargs):
+        return self(prompt, **kwargs)
+
+    def get_usage_and_reset(self):
+        return {}
+
+
+def make_failover_lm():
+    primary, secondary = FakeBackend("primary"), FakeBackend("secondary")
+    lm = FailoverLM([primary, secondary], min_requests=2, cooldown=0.0)
+    # Open the circuit of the secondary; with no cooldown it is half-open right away.
+    for _ in range(2):
+        lm.circuit_breakers[1].record_failure()
+    assert lm.circuit_breakers[1].state == "half_open"
+    return lm, primary, secondary
+
+
+def test_primary_success_keeps_trial_slot_of_half_open_secondary():
+    lm, primary, secondary = make_failover_lm()
+
+    for _ in range(3):
+        assert lm("hello") == ["primary: hello"]
+
+    assert secondary.calls == 0
+    assert lm.circuit_breakers[1].would_allow_request()
+
+    # The secondary is still tried once the primary fails, and its recovery closes the circuit.
+    primary.fail = True
+    assert lm("hello") == ["secondary: hello"]
+    assert lm.circuit_breakers[1].state == "closed"
+
+
+def test_async_primary_success_keeps_trial_slot_of_half_open_secondary():
+    lm, primary, secondary = make_failover_lm()
+
+    for _ in range(3):
+        assert asyncio.run(lm.acall("hello")) == ["primary: hello"]
+
+    assert secondary.calls == 0
+    primary.fail = True
+    assert asyncio.run(lm.acall("hello")) == ["secondary: hello"]
+    assert lm.circuit_breakers[1].state == "closed"
@@ -0,0 +1,40 @@
+from types import SimpleNamespace
+
+from knowledge_storm.lm import ClaudeModel, disable_lm_cache, enable_lm_cache
+
+
+class FakeMessages:
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        prompt = kwargs["messages"][0]["content"]
+        return SimpleNamespace(
+            content=[SimpleNamespace(text=f"answer to {prompt}")],
+            model=kwargs["model"],
+            role="assistant",
+            stop_reason="end_turn",
+            stop_sequence=None,
+            type="message",
+            usage=SimpleNamespace(input_tokens=3, output_tokens=4),
+        )
+
+
+def test_cache_hit_is_logged_in_history(tmp_path):
+    enable_lm_cache(str(tmp_path / "lm_cache.sqlite"))
+    try:
+        claude = ClaudeModel(model="claude-3-haiku-20240307", api_key="test")
+        messages = FakeMessages()
+        claude.client = SimpleNamespace(messages=messages)
+
+        assert claude("prompt") == claude("prompt") == ["answer to prompt"]
+    finally:
+        disable_lm_cache()
+
+    assert messages.calls == 1
+    miss, hit = claude.history
+    assert "cached" not in miss
+    assert hit["cached"] is True
+    assert hit["prompt"] == "prompt"
+    assert hit["response"]["content"] == miss["response"]["content"]
@@ -0,0 +1,58 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from knowledge_storm.lm import (
+    ClaudeModel,
+    _get_latency_histogram,
+    disable_lm_hedging,
+    enable_lm_hedging,
+)
+
+
+class SlowFirstMessages:
+    """Fake Anthropic messages API whose first request is slow, so that it is hedged and loses."""
+
+    def __init__(self):
+        self.calls = 0
+        self.lock = threading.Lock()
+        self.loser_done = threading.Event()
+
+    def create(self, **kwargs):
+        with self.lock:
+            self.calls += 1
+            call = self.calls
+        if call == 1:
+            time.sleep(0.5)
+        response = SimpleNamespace(
+            content=[SimpleNamespace(text=f"answer {call}")],
+            model=kwargs["model"],
+            role="assistant",
+            stop_reason="end_turn",
+            stop_sequence=None,
+            type="message",
+            usage=SimpleNamespace(input_tokens=3, output_tokens=4),
+        )
+        if call == 1:
+            self.loser_done.set()
+        return response
+
+
+def test_only_the_winning_request_is_logged():
+    claude = ClaudeModel(model="claude-hedging-test", api_key="test")
+    messages = SlowFirstMessages()
+    claude.client = SimpleNamespace(messages=messages)
+    enable_lm_hedging(min_samples=1, min_delay=0.05)
+    try:
+        _get_latency_histogram(claude).record(0.01)
+        assert claude("prompt") == ["answer 2"]
+        # The losing request runs to completion in the background.
+        assert messages.loser_done.wait(timeout=5)
+        time.sleep(0.05)
+    finally:
+        disable_lm_hedging()
+
+    assert messages.calls == 2
+    assert len(claude.history) == 1
+    assert claude.history[0]["response"]["content"] == "answer 2"
+    assert claude.get_usage_and_reset()["claude-hedging-test"]["prompt_tokens"] == 3
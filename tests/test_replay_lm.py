@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+from knowledge_storm.lm import ClaudeModel, ReplayLM
+
+
+class FakeMessages:
+    def create(self, **kwargs):
+        prompt = kwargs["messages"][0]["content"]
+        return SimpleNamespace(
+            content=[SimpleNamespace(text=f"answer to {prompt}")],
+            model=kwargs["model"],
+            role="assistant",
+            stop_reason="end_turn",
+            stop_sequence=None,
+            type="message",
+            usage=SimpleNamespace(input_tokens=3, output_tokens=4),
+        )
+
+
+def test_claude_recording_replays(tmp_path):
+    path = str(tmp_path / "recording.jsonl")
+    claude = ClaudeModel(model="claude-3-haiku-20240307", api_key="test")
+    claude.client = SimpleNamespace(messages=FakeMessages())
+    # Unlike the dspy base LM, the Claude wrapper does not send penalty kwargs.
+    assert "frequency_penalty" not in claude.kwargs
+
+    recorder = ReplayLM(path, lm=claude, mode="record")
+    recorded = [recorder("first prompt"), recorder("second prompt", temperature=0.5)]
+    recorder.log.close()
+
+    replayer = ReplayLM(path, mode="replay")
+    replayed = [replayer("first prompt"), replayer("second prompt", temperature=0.5)]
+
+    assert (
+        replayed
+        == recorded
+        == [["answer to first prompt"], ["answer to second prompt"]]
+    )
+    assert replayer.missed_prompts == 0
+    assert replayer.get_usage_and_reset()[replayer.kwargs["model"]] == {
+        "prompt_tokens": 6,
+        "completion_tokens": 8,
+    }